@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Benchmark: cold start to readiness of the Python backends per tokenizer source.
+
+Each run starts a fresh interpreter that imports a chart ``model.py``
+(against the stand-in ``triton_python_backend_utils`` in ``harness/``)
+and calls ``initialize``, like a Triton instance process does. The
+script reports the wall time from process spawn to ``initialize``
+returning, the ``⏱️  Ready in`` stage breakdown from the init logs, peak
+RSS and whether ``transformers``/``torch`` got imported, for
+
+* ``transformers`` - ``AutoTokenizer.from_pretrained`` on the weights
+* ``artifact``     - the compiled ``synaplan-tokenizer.bin`` from
+  ``synaplan_triton.tokenizer`` (what ``build-models.sh`` writes)
+
+Without ``--weights`` a tiny tokenizer (and, for ``mistral-cpu``, a tiny
+random model) is built first::
+
+    python3 benchmarks/triton/bench_cold_start.py --weights /cache/weights/mistral-7b-instruct-v0.3 \
+        --models mistral-streaming
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HARNESS = os.path.join(HERE, "harness")
+PYTHON_LIB = os.path.join(HERE, "..", "..", "charts", "triton", "files", "python")
+REPOSITORY = os.path.join(HERE, "..", "..", "charts", "triton", "files", "repository")
+
+READY = re.compile(r"Ready in ([\d.]+)s \(RSS [^)]*\): (.*)")
+
+
+def peak_rss_mb():
+    # VmHWM is reset by exec; ru_maxrss would include the parent's peak before the fork
+    with open("/proc/self/status") as f:
+        return int(re.search(r"VmHWM:\s+(\d+)", f.read()).group(1)) / 1024
+
+
+def child(model, weights, artifact):
+    """Runs in the fresh interpreter: initialize ``model`` and print one JSON line."""
+    sys.path[:0] = [HARNESS, PYTHON_LIB]
+    import importlib.util
+
+    import fixtures
+
+    config = fixtures.load_model_config(model, {"weights_dir": weights, "tokenizer_artifact": artifact,
+                                                "log_level": "INFO", "log_async": "false"})
+    spec = importlib.util.spec_from_file_location("model", os.path.join(REPOSITORY, model, "1", "model.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.TritonPythonModel().initialize({"model_config": json.dumps(config)})
+    print(json.dumps({
+        "ready": True,
+        "transformers": "transformers" in sys.modules,
+        "torch": "torch" in sys.modules,
+        "peak_rss_mb": peak_rss_mb(),
+    }), flush=True)
+
+
+def run_once(model, weights, artifact):
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", model, weights, artifact],
+                          capture_output=True, text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"))
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{model} failed to start:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    match = READY.search(proc.stdout)
+    result["stages"] = {name: float(s) for name, s in re.findall(r"(\w+) ([\d.]+)s", match.group(2))} if match else {}
+    result["wall"] = wall
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", default="mistral-streaming,mistral-cpu")
+    parser.add_argument("--weights", help="tokenizer/model directory (default: build a tiny one)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    sys.path[:0] = [HARNESS, PYTHON_LIB]
+    import fixtures
+    from synaplan_triton import tokenizer
+
+    with tempfile.TemporaryDirectory(prefix="synaplan-cold-start-") as tmp:
+        weights = args.weights or fixtures.build_weights(tmp, with_model="mistral-cpu" in args.models)
+        artifact = os.path.join(tmp, "synaplan-tokenizer.bin")
+        tokenizer.write_artifact(tokenizer.load_auto_tokenizer(weights), weights, artifact)
+        print(f"artifact: {os.path.getsize(artifact)} bytes, {args.runs} runs per row (median)\n")
+
+        print(f"{'model':>18} {'tokenizer':>12} {'spawn→ready s':>14} {'imports s':>10} {'tokenizer s':>12} "
+              f"{'model s':>8} {'peak RSS MB':>12} {'imports transformers/torch':>27}")
+        for model in args.models.split(","):
+            for source, path in (("transformers", ""), ("artifact", artifact)):
+                runs = [run_once(model, weights, path) for _ in range(args.runs)]
+                median = lambda key: statistics.median(r[key] for r in runs)  # noqa: E731
+                stage = lambda name: statistics.median(r["stages"].get(name, 0.0) for r in runs)  # noqa: E731
+                print(f"{model:>18} {source:>12} {median('wall'):>14.2f} {stage('imports'):>10.2f} "
+                      f"{stage('tokenizer'):>12.3f} {stage('model'):>8.2f} {median('peak_rss_mb'):>12.0f} "
+                      f"{str(runs[0]['transformers']) + '/' + str(runs[0]['torch']):>27}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Benchmark: mistral-cpu decode throughput vs. concurrency.
+
+Compares serial ``model.generate`` (one request at a time, the
+``batching_mode: serial`` path) with ``synaplan_triton.batcher.
+ContinuousBatcher`` at increasing numbers of concurrent requests and
+prints aggregate generated tokens/sec. Decoding is greedy and EOS is
+ignored so every request produces exactly ``--new-tokens`` tokens.
+
+Run inside the Triton CPU image::
+
+    python3 benchmarks/triton/bench_cpu_batching.py \
+        --model /cache/weights/mistral-7b-instruct-v0.3
+
+``--tiny`` swaps in a randomly initialised two-layer Mistral for a quick
+smoke run without weights.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "charts", "triton", "files", "python"))
+
+import torch  # noqa: E402
+
+from synaplan_triton.batcher import ContinuousBatcher, Sequence  # noqa: E402
+
+
+def load_model(args):
+    if args.tiny:
+        from transformers import MistralConfig, MistralForCausalLM
+        torch.manual_seed(0)
+        config = MistralConfig(vocab_size=32768, hidden_size=256, intermediate_size=512,
+                               num_hidden_layers=2, num_attention_heads=8, num_key_value_heads=2)
+        return MistralForCausalLM(config).eval()
+
+    from transformers import AutoModelForCausalLM
+    model = AutoModelForCausalLM.from_pretrained(args.model, local_files_only=True,
+                                                 torch_dtype=torch.bfloat16, low_cpu_mem_usage=True)
+    return model.eval()
+
+
+def make_prompts(n, length, vocab_size):
+    generator = torch.Generator().manual_seed(1234)
+    return [torch.randint(100, vocab_size, (length,), generator=generator).tolist() for _ in range(n)]
+
+
+def run_serial(model, prompts, new_tokens):
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for prompt in prompts:
+            model.generate(torch.tensor([prompt]), max_new_tokens=new_tokens, min_new_tokens=new_tokens,
+                           do_sample=False, pad_token_id=0)
+    return time.perf_counter() - start
+
+
+def run_batched(model, prompts, new_tokens, concurrency):
+    done = threading.Semaphore(0)
+    batcher = ContinuousBatcher(model, eos_token_id=-1, max_batch_size=concurrency,
+                                on_finish=lambda seq, error: done.release())
+    start = time.perf_counter()
+    for prompt in prompts:
+        batcher.submit(Sequence(prompt, new_tokens, temperature=0.0))
+    for _ in prompts:
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    batcher.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="/cache/weights/mistral-7b-instruct-v0.3")
+    parser.add_argument("--tiny", action="store_true", help="use a small random model instead of --model")
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument("--requests-per-slot", type=int, default=2)
+    parser.add_argument("--prompt-tokens", type=int, default=256)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    model = load_model(args)
+    vocab_size = model.config.vocab_size
+
+    print(f"{'mode':>10} {'conc':>5} {'requests':>9} {'seconds':>9} {'tok/s':>9}")
+    for concurrency in [int(x) for x in args.concurrency.split(",")]:
+        prompts = make_prompts(concurrency * args.requests_per_slot, args.prompt_tokens, vocab_size)
+        total_tokens = len(prompts) * args.new_tokens
+
+        if concurrency == 1:
+            elapsed = run_serial(model, prompts, args.new_tokens)
+            print(f"{'serial':>10} {1:>5} {len(prompts):>9} {elapsed:>9.2f} {total_tokens / elapsed:>9.1f}")
+
+        elapsed = run_batched(model, prompts, args.new_tokens, concurrency)
+        print(f"{'continuous':>10} {concurrency:>5} {len(prompts):>9} {elapsed:>9.2f} {total_tokens / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Benchmark: mistral-cpu aggregate decode tokens/sec per instance / thread / pinning layout.
+
+Each ``--layout INSTANCESxTHREADS:PINNING`` (threads 0 = automatic) starts
+one process per instance. Every process places itself with
+``synaplan_triton.cpu_affinity`` the way ``mistral-cpu`` does, with the
+``instance_group`` count and ``cpu_*`` parameters of the layout, and only
+then loads the model. Once all instances are loaded, they decode at the
+same time. ``--sequences`` concurrent sequences are split evenly over the
+instances, so every layout serves the same load. Aggregate tokens/sec is
+all generated tokens over the wall time of the slowest instance::
+
+    python3 benchmarks/triton/bench_cpu_layout.py --weights /cache/weights/mistral-7b-instruct-v0.3 \\
+        --precision int8 --layout 1x0:off --layout 2x0:numa --layout 4x0:numa --layout 2x0:cores
+
+Without ``--weights`` a random Mistral of ``--layers`` x ``--hidden`` is
+built. Results depend on the CPUs the benchmark may use
+(``taskset -c``, the container's cpuset) and on its CPU quota.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HARNESS = os.path.join(HERE, "harness")
+PYTHON_LIB = os.path.join(HERE, "..", "..", "charts", "triton", "files", "python")
+
+DEFAULT_LAYOUTS = ["1x0:off", "1x0:numa", "2x0:numa", "4x0:numa"]
+
+
+def parse_layout(layout):
+    """``"2x0:numa"`` -> ``(2, 0, "numa")``."""
+    shape, _, pinning = layout.partition(":")
+    instances, _, threads = shape.partition("x")
+    return int(instances), int(threads or 0), pinning or "numa"
+
+
+def child(spec):
+    """One instance: place, load, wait until all instances are loaded, decode, report."""
+    spec = json.loads(spec)
+    sys.path[:0] = [PYTHON_LIB]
+    from synaplan_triton import cpu_affinity
+
+    model_config = {
+        "name": spec["name"],
+        "instance_group": [{"count": spec["instances"], "kind": "KIND_CPU"}],
+        "parameters": {
+            "cpu_pinning": {"string_value": spec["pinning"]},
+            "cpu_threads": {"string_value": str(spec["threads"])},
+            "cpu_interop_threads": {"string_value": "1"},
+        },
+    }
+    placement = cpu_affinity.from_model_config(model_config, f"{spec['name']}_0_{spec['index']}")
+
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    if spec["precision"] == "bf16":
+        model = AutoModelForCausalLM.from_pretrained(spec["weights"], local_files_only=True,
+                                                     torch_dtype=torch.bfloat16, low_cpu_mem_usage=True).eval()
+    else:
+        from synaplan_triton import quantize
+        model = quantize.load(spec["artifact"], spec["weights"])
+    print(json.dumps({"loaded": True}), flush=True)
+    sys.stdin.readline()  # all instances loaded
+
+    generator = torch.Generator().manual_seed(spec["index"])
+    prompt = torch.randint(3, model.config.vocab_size, (spec["sequences"], spec["prompt_tokens"]),
+                           generator=generator)
+    tokens, start = 0, time.perf_counter()
+    with torch.no_grad():
+        for _ in range(spec["rounds"]):
+            model.generate(prompt, attention_mask=torch.ones_like(prompt), max_new_tokens=spec["new_tokens"],
+                           min_new_tokens=spec["new_tokens"], do_sample=False, pad_token_id=0)
+            tokens += spec["sequences"] * spec["new_tokens"]
+    print(json.dumps({"tokens": tokens, "seconds": time.perf_counter() - start,
+                      "placement": placement.describe() if placement else "torch defaults",
+                      "threads": torch.get_num_threads()}), flush=True)
+
+
+def run(layout, weights, artifact, args):
+    instances, threads, pinning = parse_layout(layout)
+    if args.sequences % instances:
+        raise ValueError(f"--sequences {args.sequences} does not split evenly over {instances} instances")
+    procs = []
+    for index in range(instances):
+        spec = {"name": f"bench-layout-{os.getpid()}-{layout}", "index": index, "instances": instances,
+                "threads": threads, "pinning": pinning, "precision": args.precision, "weights": weights,
+                "artifact": artifact, "sequences": args.sequences // instances, "rounds": args.rounds,
+                "prompt_tokens": args.prompt_tokens, "new_tokens": args.new_tokens}
+        procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec)],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True))
+    for proc in procs:
+        if not proc.stdout.readline():
+            raise RuntimeError(f"{layout}: an instance failed to load")
+    for proc in procs:
+        proc.stdin.write("go\n")
+        proc.stdin.flush()
+    results = [json.loads(proc.stdout.readline()) for proc in procs]
+    for proc in procs:
+        proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--layout", action="append", metavar="NxT:PINNING",
+                        help=f"instances x threads (0 = automatic) : off/cores/numa (default: {' '.join(DEFAULT_LAYOUTS)})")
+    parser.add_argument("--weights", help="Hugging Face checkpoint (default: build a random one)")
+    parser.add_argument("--precision", default="int8", help="bf16, int8 or int4")
+    parser.add_argument("--sequences", type=int, default=8, help="concurrent sequences, split over the instances")
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--prompt-tokens", type=int, default=128)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--hidden", type=int, default=1024)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    sys.path[:0] = [HARNESS, PYTHON_LIB]
+    import fixtures
+    from synaplan_triton import cpu_affinity, quantize
+
+    cpus = cpu_affinity.available_cpus()
+    quota = cpu_affinity.cpu_quota()
+    print(f"{len(cpus)} CPUs ({len(cpu_affinity.physical_cores(cpus))} cores, "
+          f"{len(cpu_affinity.numa_nodes(cpus))} NUMA nodes), quota {quota or 'none'}, {args.precision}, "
+          f"{args.sequences} sequences x {args.rounds} rounds x {args.new_tokens} tokens\n")
+
+    with tempfile.TemporaryDirectory(prefix="synaplan-cpu-layout-") as tmp:
+        weights = args.weights or fixtures.build_weights(
+            os.path.join(tmp, "weights"), num_hidden_layers=args.layers, hidden_size=args.hidden,
+            intermediate_size=args.hidden * 7 // 2, num_attention_heads=args.hidden // 128,
+            num_key_value_heads=max(1, args.hidden // 512))
+        artifact = ""
+        if args.precision != "bf16":
+            artifact = os.path.join(tmp, args.precision)
+            quantize.convert(weights, artifact, args.precision)
+
+        print(f"{'layout':>10} {'threads':>8} {'tok/s':>8} {'per instance':>13}   placement")
+        for layout in args.layout or DEFAULT_LAYOUTS:
+            try:
+                results = run(layout, weights, artifact, args)
+            except (RuntimeError, ValueError) as e:
+                print(f"{layout:>10} FAILED: {e}")
+                continue
+            wall = max(r["seconds"] for r in results)
+            total = sum(r["tokens"] for r in results) / wall
+            print(f"{layout:>10} {'/'.join(str(r['threads']) for r in results):>8} {total:>8.1f} "
+                  f"{total / len(results):>13.1f}   {results[0]['placement']}")
+            for r in results[1:]:
+                print(f"{'':>45}{r['placement']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Benchmark: mistral-cpu load time, memory and decode speed per weight precision.
+
+For ``bf16`` (``from_pretrained`` on the Hugging Face checkpoint) and the
+``int8`` / ``int4`` artifacts of ``synaplan_triton.quantize``, starts
+``--instances`` processes that load the model the way ``mistral-cpu``
+does. Once all are loaded, each one reports its memory from
+``/proc/self/smaps_rollup`` after a forward pass and a greedy decode.
+Each instance counts RSS in full. PSS divides shared pages between the
+processes mapping them, so memory-mapped weights show up as shared. The
+script also reports decode tokens/sec and how often the teacher-forced
+next-token prediction matches ``bf16``. With random weights the logits
+are nearly flat, so expect low agreement; use ``--weights`` for a
+meaningful quality check.
+
+Without ``--weights`` a random Mistral of ``--layers`` x ``--hidden`` is
+built so the weights dominate memory::
+
+    python3 benchmarks/triton/bench_cpu_weights.py --weights /cache/weights/mistral-7b-instruct-v0.3 --instances 2
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+HARNESS = os.path.join(HERE, "harness")
+PYTHON_LIB = os.path.join(HERE, "..", "..", "charts", "triton", "files", "python")
+
+
+def smaps_mb():
+    with open("/proc/self/smaps_rollup") as f:
+        text = f.read()
+    field = lambda name: int(re.search(rf"^{name}:\s+(\d+)", text, re.M).group(1)) / 1024  # noqa: E731
+    return {"rss_mb": field("Rss"), "pss_mb": field("Pss"),
+            "shared_mb": field("Shared_Clean") + field("Shared_Dirty")}
+
+
+def child(precision, weights, artifact, new_tokens):
+    """One instance: load, wait until all instances are loaded, run the model, report."""
+    sys.path[:0] = [PYTHON_LIB]
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    start = time.perf_counter()
+    if precision == "bf16":
+        model = AutoModelForCausalLM.from_pretrained(weights, local_files_only=True, torch_dtype=torch.bfloat16,
+                                                     low_cpu_mem_usage=True).eval()
+    else:
+        from synaplan_triton import quantize
+        model = quantize.load(artifact, weights)
+    load_seconds = time.perf_counter() - start
+    print(json.dumps({"loaded": True}), flush=True)
+    sys.stdin.readline()  # all instances loaded
+
+    generator = torch.Generator().manual_seed(0)
+    prompt = torch.randint(3, model.config.vocab_size, (1, 256), generator=generator)
+    with torch.no_grad():
+        predicted = model(prompt).logits.argmax(-1)[0].tolist()  # teacher-forced next-token predictions
+        decode_start = time.perf_counter()
+        model.generate(prompt[:, :64], max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False)
+        decode_seconds = time.perf_counter() - decode_start
+    # after the forward passes, so every weight page has been touched
+    print(json.dumps({"load_seconds": load_seconds, **smaps_mb(), "tokens_per_second": new_tokens / decode_seconds,
+                      "predicted": predicted}), flush=True)
+
+
+def run(precision, weights, artifact, args):
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", precision, weights, artifact,
+                               str(args.new_tokens)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+             for _ in range(args.instances)]
+    for proc in procs:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"{precision} instance failed to load")
+    for proc in procs:
+        proc.stdin.write("go\n")
+        proc.stdin.flush()
+    results = [json.loads(proc.stdout.readline()) for proc in procs]
+    for proc in procs:
+        proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--weights", help="Hugging Face checkpoint (default: build a random one)")
+    parser.add_argument("--precisions", default="bf16,int8,int4")
+    parser.add_argument("--instances", type=int, default=2, help="concurrent instance processes")
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--hidden", type=int, default=1024)
+    parser.add_argument("--child", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        precision, weights, artifact, new_tokens = args.child
+        child(precision, weights, artifact, int(new_tokens))
+        return
+
+    sys.path[:0] = [HARNESS, PYTHON_LIB]
+    import fixtures
+    from synaplan_triton import quantize
+
+    with tempfile.TemporaryDirectory(prefix="synaplan-cpu-weights-") as tmp:
+        weights = args.weights or fixtures.build_weights(
+            os.path.join(tmp, "weights"), num_hidden_layers=args.layers, hidden_size=args.hidden,
+            intermediate_size=args.hidden * 7 // 2, num_attention_heads=args.hidden // 128,
+            num_key_value_heads=max(1, args.hidden // 512))
+
+        print(f"{'precision':>9} {'convert s':>9} {'file MB':>8} {'load s':>7} {'RSS MB':>8} {'PSS MB':>8} "
+              f"{'shared MB':>9} {'tok/s':>7} {'top-1 = bf16':>13}   ({args.instances} instances, median)")
+        reference = None
+        for precision in args.precisions.split(","):
+            artifact, convert_seconds, size = "", 0.0, 0.0
+            if precision != "bf16":
+                artifact = os.path.join(tmp, precision)
+                start = time.perf_counter()
+                quantize.convert(weights, artifact, precision)
+                convert_seconds = time.perf_counter() - start
+                size = os.path.getsize(os.path.join(artifact, quantize.WEIGHTS_FILE)) / 2 ** 20
+            results = run(precision, weights, artifact, args)
+            median = lambda key: statistics.median(r[key] for r in results)  # noqa: E731
+            predicted = results[0]["predicted"]
+            if precision == "bf16":
+                reference = predicted
+            agreement = (f"{sum(a == b for a, b in zip(predicted, reference)) / len(predicted):.1%}"
+                         if reference is not None else "-")
+            print(f"{precision:>9} {convert_seconds:>9.1f} {size:>8.0f} {median('load_seconds'):>7.2f} "
+                  f"{median('rss_mb'):>8.0f} {median('pss_mb'):>8.0f} {median('shared_mb'):>9.0f} "
+                  f"{median('tokens_per_second'):>7.1f} {agreement:>13}")
+
+
+if __name__ == "__main__":
+    main()
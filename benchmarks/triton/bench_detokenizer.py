@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: full re-decode vs. incremental detokenization.
+
+Replays the same generated token stream against prompts of increasing
+length and compares the per-token decode cost of the original
+``decode(prompt_ids + generated)[len(prev):]`` loop with
+``synaplan_triton.detokenizer.IncrementalDetokenizer``. The streamed
+text of each path is checked against a single decode of the whole
+sequence; an incremental mismatch fails the run (the full re-decode can
+garble characters split across byte-fallback tokens, which is reported).
+
+Run inside the Triton image (needs ``transformers``)::
+
+    python3 benchmarks/triton/bench_detokenizer.py \
+        --tokenizer /cache/weights/mistral-7b-instruct-v0.3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "charts", "triton", "files", "python"))
+
+from synaplan_triton.detokenizer import IncrementalDetokenizer  # noqa: E402
+
+FILLER = (
+    "Synaplan retrieves the relevant passages from the knowledge base and "
+    "hands them to the model as context. Überprüfe die Antwort sorgfältig, "
+    "añade ejemplos 👍 und zitiere die Quelle.\n"
+)
+ANSWER = (
+    "Sure! Here is a short summary of the document:\n\n"
+    "1. The contract starts on 1 January and runs for 24 months.\n"
+    "2. Either party may terminate with three months' notice — in writing.\n"
+    "3. Prices are quoted in € and exclude VAT 🙂.\n"
+)
+
+DECODE_KWARGS = dict(skip_special_tokens=True, clean_up_tokenization_spaces=False,
+                     spaces_between_special_tokens=False)
+
+
+def make_ids(tokenizer, text, length):
+    ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+    while len(ids) < length:
+        ids = ids + ids
+    return ids[:length]
+
+
+def reference(tokenizer, prompt_ids, output_ids):
+    prompt_text = tokenizer.decode(prompt_ids, **DECODE_KWARGS)
+    text = tokenizer.decode(prompt_ids + output_ids, **DECODE_KWARGS)[len(prompt_text):]
+    return text[1:] if text[:1] == " " else text
+
+
+def full_redecode(tokenizer, prompt_ids, output_ids):
+    prev = tokenizer.decode(prompt_ids, **DECODE_KWARGS)
+    generated = []
+    pieces = []
+    for token_id in output_ids:
+        generated.append(token_id)
+        full_text = tokenizer.decode(prompt_ids + generated, **DECODE_KWARGS)
+        chunk = full_text[len(prev):]
+        prev = full_text
+        if len(generated) == 1 and chunk[:1] == " ":
+            chunk = chunk[1:]
+        pieces.append(chunk)
+    return "".join(pieces)
+
+
+def incremental(tokenizer, prompt_ids, output_ids):
+    detok = IncrementalDetokenizer(tokenizer, prompt_ids)
+    pieces = [detok.step(token_id) for token_id in output_ids]
+    pieces.append(detok.flush())
+    return "".join(pieces)
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokenizer", default="/cache/weights/mistral-7b-instruct-v0.3")
+    parser.add_argument("--prompt-lengths", default="128,512,1024,2048,4096")
+    parser.add_argument("--output-tokens", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, local_files_only=True)
+
+    output_ids = make_ids(tokenizer, ANSWER, args.output_tokens)
+
+    print(f"{'prompt':>8} {'full µs/tok':>12} {'incr µs/tok':>12} {'speedup':>8}  full ok  incr ok")
+    mismatches = 0
+    for prompt_len in [int(x) for x in args.prompt_lengths.split(",")]:
+        prompt_ids = tokenizer.apply_chat_template(
+            [{"role": "user", "content": "x"}], tokenize=True, add_generation_prompt=True)
+        prompt_ids = make_ids(tokenizer, FILLER, prompt_len - len(prompt_ids)) + prompt_ids
+
+        full_s, full_text = timed(full_redecode, tokenizer, prompt_ids, output_ids, repeat=args.repeat)
+        incr_s, incr_text = timed(incremental, tokenizer, prompt_ids, output_ids, repeat=args.repeat)
+        expected = reference(tokenizer, prompt_ids, output_ids)
+        full_ok = full_text == expected
+        incr_ok = incr_text == expected
+        mismatches += not incr_ok
+        print(f"{len(prompt_ids):>8} {full_s / len(output_ids) * 1e6:>12.1f} "
+              f"{incr_s / len(output_ids) * 1e6:>12.1f} {full_s / incr_s:>7.1f}x  "
+              f"{'yes' if full_ok else 'no':>7}  {'yes' if incr_ok else 'NO':>7}")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Benchmark: streamed messages/sec and token latency per flush policy.
+
+Simulates ``--streams`` concurrent generations that each produce a token
+every ``--token-interval-ms`` and pass the decoded deltas through
+``synaplan_triton.coalescer.ChunkCoalescer``. Every flushed chunk is
+serialized and written to a loopback socket (one shared connection, like
+Triton's response path to the frontend); a reader thread timestamps its
+arrival. For each policy the script prints the number of messages,
+messages/sec, average chunk size, process CPU time per 1k tokens and the
+latency from a token being generated to its text reaching the reader.
+
+Deltas come from ``IncrementalDetokenizer`` when ``--tokenizer`` is given,
+otherwise from a word-piece split of a built-in sample text::
+
+    python3 benchmarks/triton/bench_flush_policy.py \
+        --tokenizer /cache/weights/mistral-7b-instruct-v0.3
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "charts", "triton", "files", "python"))
+
+from synaplan_triton.coalescer import ChunkCoalescer  # noqa: E402
+
+SAMPLE_TEXT = (
+    "Sure! Here is a short overview of the deployment.\n\n"
+    "1. The Triton server loads the model repository from the cache volume. "
+    "Each model has its own configuration, and the Python backends share a small helper package.\n"
+    "2. Requests are tokenized in batches; the TensorRT-LLM engine streams tokens back, "
+    "which are detokenized incrementally and sent to the client.\n\n"
+    "Is there anything else you would like to know about scaling, metrics or caching?"
+)
+
+UNLIMITED = 10 ** 9
+
+POLICIES = {
+    "per-token": dict(max_tokens=1),
+    "4 tokens": dict(max_tokens=4, on_sentence=False),
+    "16 tokens": dict(max_tokens=16, on_sentence=False),
+    "50 ms": dict(max_tokens=UNLIMITED, max_delay_ms=50, on_sentence=False),
+    "sentence": dict(max_tokens=UNLIMITED, on_sentence=True),
+    "4 tok/50 ms/sentence": dict(max_tokens=4, max_delay_ms=50, on_sentence=True),
+}
+
+
+def make_deltas(args):
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        from synaplan_triton.detokenizer import IncrementalDetokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, local_files_only=True)
+        ids = tokenizer(SAMPLE_TEXT, add_special_tokens=False)["input_ids"]
+        detokenizer = IncrementalDetokenizer(tokenizer, tokenizer("[INST] Hi [/INST]")["input_ids"])
+        return [detokenizer.step(t) for t in ids] + [detokenizer.flush()]
+    # ~4 characters per token, keeping leading spaces and newlines as separate deltas
+    return [piece for word in re.findall(r"\n|\s?[^\s]+", SAMPLE_TEXT)
+            for piece in ([word] if len(word) <= 4 else [word[i:i + 4] for i in range(0, len(word), 4)])]
+
+
+class Reader(threading.Thread):
+
+    def __init__(self, sock):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.arrivals = {}  # message id -> arrival time
+
+    def _read(self, n):
+        data = b""
+        while len(data) < n:
+            part = self.sock.recv(n - len(data))
+            if not part:
+                raise EOFError
+            data += part
+        return data
+
+    def run(self):
+        try:
+            while True:
+                (length,) = struct.unpack("!I", self._read(4))
+                message = json.loads(self._read(length))
+                self.arrivals[message["id"]] = time.perf_counter()
+        except (EOFError, OSError):
+            pass
+
+
+def run_policy(policy, deltas, args):
+    writer, reader_sock = socket.socketpair()
+    reader = Reader(reader_sock)
+    reader.start()
+
+    write_lock = threading.Lock()
+    sent = {}  # message id -> (generation times of the tokens it carries, text)
+    counter = iter(range(10 ** 12))
+    interval = args.token_interval_ms / 1000.0
+
+    def send(stream, text, token_times):
+        message_id = next(counter)
+        payload = json.dumps({"id": message_id, "stream": stream, "text_output": text}).encode("utf-8")
+        sent[message_id] = (token_times, text)
+        with write_lock:
+            writer.sendall(struct.pack("!I", len(payload)) + payload)
+
+    def generate(stream):
+        coalescer = ChunkCoalescer(**policy)
+        waiting = []
+        next_tick = time.perf_counter() + (stream % 10) * interval / 10  # stagger streams
+        for delta in deltas:
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_tick += interval
+            waiting.append(time.perf_counter())
+            chunk = coalescer.add(delta)
+            if chunk:
+                send(stream, chunk, waiting)
+                waiting = []
+        tail = coalescer.flush()
+        if tail or waiting:
+            send(stream, tail, waiting)
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    threads = [threading.Thread(target=generate, args=(i,)) for i in range(args.streams)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+
+    deadline = time.perf_counter() + 5
+    while len(reader.arrivals) < len(sent) and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    cpu = time.process_time() - cpu_start
+    writer.close()
+
+    latencies = sorted((reader.arrivals[mid] - t) * 1000 for mid, (times, _) in sent.items() for t in times)
+    tokens = len(latencies)
+    return {
+        "messages": len(sent),
+        "msg_per_s": len(sent) / wall,
+        "chars_per_msg": statistics.mean(len(text) for _, text in sent.values()),
+        "cpu_ms_per_1k_tokens": cpu * 1000 / tokens * 1000,
+        "latency_mean_ms": statistics.mean(latencies),
+        "latency_p99_ms": latencies[int(0.99 * (tokens - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokenizer", help="HF tokenizer directory (default: built-in word-piece split)")
+    parser.add_argument("--streams", type=int, default=32)
+    parser.add_argument("--token-interval-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    deltas = make_deltas(args)
+    print(f"{len(deltas)} tokens per stream, {args.streams} streams, one token every {args.token_interval_ms} ms\n")
+    print(f"{'policy':>22} {'messages':>9} {'msg/s':>9} {'chars/msg':>10} {'cpu ms/1k tok':>14} "
+          f"{'lat mean ms':>12} {'lat p99 ms':>11}")
+    for name, policy in POLICIES.items():
+        r = run_policy(policy, deltas, args)
+        print(f"{name:>22} {r['messages']:>9} {r['msg_per_s']:>9.0f} {r['chars_per_msg']:>10.1f} "
+              f"{r['cpu_ms_per_1k_tokens']:>14.1f} {r['latency_mean_ms']:>12.1f} {r['latency_p99_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
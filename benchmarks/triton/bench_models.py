@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""Offline load test of the chart's Python backends.
+
+Loads ``mistral-streaming/1/model.py`` and ``mistral-cpu/1/model.py``
+from the chart against the stand-in ``triton_python_backend_utils`` in
+``harness/``, with a tiny local tokenizer/model and (for
+``mistral-streaming``) a mock TRT-LLM BLS target that streams synthetic
+``output_ids`` at ``--token-rate`` tokens/sec per sequence.
+
+A driver thread plays Triton: it batches queued requests up to the
+model's ``max_batch_size`` and calls ``execute()``. ``--concurrency``
+closed-loop clients each replay a multi-turn conversation one user turn
+at a time, so prompt and KV caches see realistic growing histories.
+
+Every (model, workload, concurrency) scenario runs in a fresh process
+and reports TTFT and inter-token latency percentiles, tokens/sec, CPU
+time per token and peak RSS. The JSON written to ``--output`` (default
+stdout) carries the chart version and git revision, so runs can be
+compared across chart versions::
+
+    python3 benchmarks/triton/bench_models.py --concurrency 1,8 --output results.json
+    python3 benchmarks/triton/bench_models.py --models mistral-cpu --param batching_mode=serial
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+HARNESS = os.path.join(HERE, "harness")
+PYTHON_LIB = os.path.join(ROOT, "charts", "triton", "files", "python")
+
+
+def peak_rss_mb():
+    # VmHWM is reset by exec; ru_maxrss would include the parent's peak before the fork
+    with open("/proc/self/status") as f:
+        return int(re.search(r"VmHWM:\s+(\d+)", f.read()).group(1)) / 1024
+
+
+def percentiles(values, scale=1.0):
+    if not values:
+        return None
+    values = sorted(v * scale for v in values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]  # noqa: E731
+    return {"mean": statistics.mean(values), "p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99)}
+
+
+def load_model_module(model):
+    import importlib.util
+    path = os.path.join(ROOT, "charts", "triton", "files", "repository", model, "1", "model.py")
+    spec = importlib.util.spec_from_file_location(model.replace("-", "_") + "_model", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Client(threading.Thread):
+    """Replays conversations turn by turn, waiting for each stream to finish."""
+
+    def __init__(self, index, args, submit):
+        super().__init__(daemon=True)
+        self.index = index
+        self.args = args
+        self.submit = submit
+        self.records = []
+
+    def run(self):
+        import fixtures
+        import triton_python_backend_utils as pb_utils
+
+        _, _, max_tokens = fixtures.WORKLOADS[self.args.workload]
+        for round_ in range(self.args.rounds):
+            messages = fixtures.conversation(self.args.workload, seed=self.index * 1000 + round_)
+            for end in range(2, len(messages), 2):
+                record = {"chunks": 0, "first": None, "error": None, "text": ""}
+
+                def on_response(response, flags, record=record):
+                    now = time.perf_counter()
+                    if response is None:
+                        return
+                    if response.has_error():
+                        record["error"] = response.error().message()
+                        return
+                    text = pb_utils.get_output_tensor_by_name(response, "text_output")
+                    text = text.as_numpy().reshape(-1)[0] if text is not None else ""
+                    if text:
+                        record["chunks"] += 1
+                        record["text"] += text
+                        if record["first"] is None:
+                            record["first"] = now
+
+                request = pb_utils.Request(fixtures.request_inputs(messages[:end], max_tokens), on_response)
+                record["start"] = time.perf_counter()
+                self.submit(request)
+                request.sender.closed.wait()
+                record["end"] = time.perf_counter()
+                self.records.append(record)
+
+
+def run_scenario(spec):
+    """Child process: load one model, drive it with clients, return the measurements."""
+    args = argparse.Namespace(**spec)
+    os.dup2(2, 1)  # model logs go to stderr; stdout is reserved for the JSON report
+    os.environ["SYNAPLAN_LOG_LEVEL"] = args.log_level
+    sys.path[:0] = [HARNESS, PYTHON_LIB]
+
+    import fixtures
+    import triton_python_backend_utils as pb_utils
+
+    parameters = dict(p.split("=", 1) for p in args.param)
+    parameters["weights_dir"] = args.weights
+    model_config = fixtures.load_model_config(args.model, parameters)
+
+    if args.model == "mistral-streaming":
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.weights)
+        target = model_config["parameters"].get("target_model", {}).get("string_value", "mistral-7b-instruct-v0.3")
+        pb_utils.register_model(target, fixtures.MockTrtLlm(tokenizer, args.token_rate, eos_token_id=tokenizer.eos_token_id))
+
+    module = load_model_module(args.model)
+    load_start = time.perf_counter()
+    model = module.TritonPythonModel()
+    model.initialize({"model_config": json.dumps(model_config), "model_name": args.model})
+    load_seconds = time.perf_counter() - load_start
+
+    # --- Triton stand-in: batch queued requests into execute() calls ---
+    pending = queue.Queue()
+    max_batch = max(1, model_config["max_batch_size"])
+
+    def drive():
+        while True:
+            batch = [pending.get()]
+            if batch[0] is None:
+                return
+            deadline = time.perf_counter() + 0.001
+            while len(batch) < max_batch:
+                try:
+                    item = pending.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    pending.put(None)
+                    break
+                batch.append(item)
+            model.execute(batch)
+
+    driver = threading.Thread(target=drive, daemon=True)
+    driver.start()
+
+    # Warm-up request, not measured
+    warmup = Client(-1, argparse.Namespace(**{**spec, "rounds": 1, "workload": "short"}), pending.put)
+    warmup.run()
+    for metric in pb_utils.METRICS.values():
+        metric.values.clear()
+        metric.value = 0.0
+
+    clients = [Client(i, args, pending.put) for i in range(args.concurrency)]
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    pending.put(None)
+    driver.join()
+    model.finalize()
+
+    def histogram(name):
+        for (family, _), metric in pb_utils.METRICS.items():
+            if family == f"synaplan_llm_{name}":
+                return metric.values
+        return []
+
+    records = [r for c in clients for r in c.records]
+    output_tokens = sum(histogram("output_tokens"))
+    return {
+        "model": args.model,
+        "workload": args.workload,
+        "concurrency": args.concurrency,
+        "requests": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "load_seconds": load_seconds,
+        "wall_seconds": wall,
+        "ttft_ms": percentiles([r["first"] - r["start"] for r in records if r["first"]], 1000),
+        "itl_ms": percentiles(histogram("inter_token_latency_seconds"), 1000),
+        "e2e_ms": percentiles([r["end"] - r["start"] for r in records], 1000),
+        "prompt_tokens": percentiles(histogram("prompt_tokens")),
+        "output_tokens": output_tokens,
+        "tokens_per_second": output_tokens / wall if wall else 0.0,
+        "chunks_per_request": statistics.mean(r["chunks"] for r in records) if records else 0.0,
+        "cpu_ms_per_token": cpu * 1000 / output_tokens if output_tokens else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _child(spec, results):
+    try:
+        results.put(run_scenario(spec))
+    except BaseException as e:  # report instead of hanging the parent
+        results.put({"model": spec["model"], "workload": spec["workload"], "concurrency": spec["concurrency"],
+                     "error": f"{type(e).__name__}: {e}"})
+        raise
+
+
+def metadata(args):
+    def git(*cmd):
+        try:
+            return subprocess.check_output(["git", *cmd], cwd=ROOT, stderr=subprocess.DEVNULL, text=True).strip()
+        except Exception:
+            return None
+
+    with open(os.path.join(ROOT, "charts", "triton", "Chart.yaml")) as f:
+        chart_version = re.search(r"^version:\s*(\S+)", f.read(), re.M).group(1)
+    versions = {}
+    for name in ("numpy", "torch", "transformers", "tokenizers"):
+        try:
+            versions[name] = __import__(name).__version__
+        except ImportError:
+            versions[name] = None
+    return {
+        "chart_version": chart_version,
+        "git_revision": git("rev-parse", "--short", "HEAD"),
+        "git_dirty": bool(git("status", "--porcelain", "--", "charts")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+        "args": {k: v for k, v in vars(args).items() if k != "output"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", default="mistral-streaming,mistral-cpu")
+    parser.add_argument("--workloads", default="short,chat,long", help="comma-separated: short, chat, long")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--rounds", type=int, default=2, help="conversations replayed per client")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="mock TRT-LLM tokens/sec per sequence")
+    parser.add_argument("--param", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a config.pbtxt parameter (repeatable)")
+    parser.add_argument("--log-level", default="WARNING", help="SYNAPLAN_LOG_LEVEL for the models")
+    parser.add_argument("--weights", help="tokenizer/model directory (default: build a tiny one)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    sys.path[:0] = [HARNESS, PYTHON_LIB]
+    with tempfile.TemporaryDirectory(prefix="synaplan-bench-") as tmp:
+        if args.weights is None:
+            import fixtures
+            args.weights = fixtures.build_weights(tmp, with_model="mistral-cpu" in args.models)
+
+        context = multiprocessing.get_context("spawn")
+        results = []
+        for model in args.models.split(","):
+            for workload in args.workloads.split(","):
+                for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                    spec = dict(vars(args), model=model, workload=workload, concurrency=concurrency)
+                    spec.pop("output")
+                    queue_ = context.Queue()
+                    process = context.Process(target=_child, args=(spec, queue_))
+                    process.start()
+                    result = queue_.get()
+                    process.join()
+                    results.append(result)
+                    if "error" in result:
+                        print(f"{model:>18} {workload:>6} c={concurrency:<3} FAILED: {result['error']}", file=sys.stderr)
+                        continue
+                    p50 = lambda key: (result[key] or {}).get("p50", float("nan"))  # noqa: E731
+                    print(f"{model:>18} {workload:>6} c={concurrency:<3} "
+                          f"ttft p50 {p50('ttft_ms'):8.1f} ms  itl p50 {p50('itl_ms'):7.1f} ms  "
+                          f"{result['tokens_per_second']:8.1f} tok/s  "
+                          f"{result['cpu_ms_per_token'] or float('nan'):6.2f} cpu ms/tok  "
+                          f"rss {result['peak_rss_mb']:7.1f} MB  errors {result['errors']}", file=sys.stderr)
+
+    report = json.dumps({"meta": metadata(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
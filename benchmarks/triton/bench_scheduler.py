@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Benchmark: interactive TTFT under bulk load per mistral-streaming scheduling policy.
+
+``--bulk`` closed-loop clients of one tenant send long summarization-style
+requests back to back while ``--interactive`` clients of other tenants
+send short chat turns with a think time in between. Every request goes
+through ``mistral-streaming`` (``synaplan_triton.scheduler``) to the mock
+TRT-LLM of ``harness/``, whose in-flight batch has as many slots as
+``max_concurrent_streams``.
+
+Each ``--policy name=scheduler_classes`` runs in a fresh process; the
+``fifo`` policy has a single class, i.e. arrival order as before the
+scheduler; ``weighted`` lets bulk work take every stream, so only the
+order of queued requests changes, while ``reserved`` (the chart default)
+keeps a quarter of the streams for interactive requests. Requests send
+``priority`` ``interactive`` / ``batch`` only when the policy defines
+those classes. Reported per policy: interactive
+TTFT percentiles, scheduler queue wait per class and bulk tokens/sec::
+
+    python3 benchmarks/triton/bench_scheduler.py --bulk 24 --interactive 4 \\
+        --policy fifo=all --policy reserved=interactive:4:16,batch:1:12 --policy strict=interactive:4:16,batch:1:8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE]
+
+import bench_models  # noqa: E402
+
+DEFAULT_POLICIES = ["fifo=all", "weighted=interactive:4:16,batch:1:16", "reserved=interactive:4:16,batch:1:12"]
+
+
+def run_policy(spec):
+    """Child process: load mistral-streaming with one policy and drive the mixed load."""
+    args = argparse.Namespace(**spec)
+    os.environ["SYNAPLAN_LOG_LEVEL"] = "WARNING"
+    sys.path[:0] = [bench_models.HARNESS, bench_models.PYTHON_LIB]
+
+    import numpy as np
+    from transformers import AutoTokenizer
+
+    import fixtures
+    import triton_python_backend_utils as pb_utils
+
+    classes = [entry.split(":")[0] for entry in args.classes.split(",")]
+    model_config = fixtures.load_model_config("mistral-streaming", {
+        "weights_dir": args.weights,
+        "max_concurrent_streams": args.streams,
+        "scheduler_classes": args.classes,
+        "response_cache_enabled": "false",
+    })
+    tokenizer = AutoTokenizer.from_pretrained(args.weights)
+    pb_utils.register_model("mistral-7b-instruct-v0.3", fixtures.MockTrtLlm(
+        tokenizer, args.token_rate, max_batch_size=args.streams, eos_token_id=tokenizer.eos_token_id))
+
+    model = bench_models.load_model_module("mistral-streaming").TritonPythonModel()
+    model.initialize({"model_config": json.dumps(model_config), "model_name": "mistral-streaming"})
+
+    def send(messages, max_tokens, priority, tenant):
+        record = {"start": time.perf_counter(), "first": None, "tokens": 0}
+
+        def on_response(response, flags):
+            if response is None or response.has_error():
+                return
+            if record["first"] is None:
+                record["first"] = time.perf_counter()
+
+        inputs = fixtures.request_inputs(messages, max_tokens)
+        inputs.append(pb_utils.Tensor("tenant", np.array([[tenant.encode()]], dtype=object)))
+        if priority in classes:
+            inputs.append(pb_utils.Tensor("priority", np.array([[priority.encode()]], dtype=object)))
+        request = pb_utils.Request(inputs, on_response)
+        model.execute([request])
+        request.sender.closed.wait()
+        record["end"] = time.perf_counter()
+        return record
+
+    done = threading.Event()
+    bulk_records, interactive_records = [], []
+
+    def bulk_client(index):
+        round_ = 0
+        while not done.is_set():
+            messages = fixtures.conversation("long", seed=index * 1000 + round_)[:2]
+            bulk_records.append(send(messages, args.bulk_tokens, "batch", "bulk"))
+            round_ += 1
+
+    def interactive_client(index):
+        for round_ in range(args.rounds):
+            time.sleep(args.think_ms / 1000.0)
+            messages = fixtures.conversation("short", seed=index * 1000 + round_)[:2]
+            interactive_records.append(send(messages, 32, "interactive", f"chat-{index}"))
+
+    bulk = [threading.Thread(target=bulk_client, args=(i,), daemon=True) for i in range(args.bulk)]
+    interactive = [threading.Thread(target=interactive_client, args=(i,)) for i in range(args.interactive)]
+    start = time.perf_counter()
+    for thread in bulk:
+        thread.start()
+    time.sleep(0.5)  # let the bulk load fill the slots first
+    for thread in interactive:
+        thread.start()
+    for thread in interactive:
+        thread.join()
+    wall = time.perf_counter() - start
+    done.set()
+    model.finalize()
+
+    queue_wait = {}
+    for (family, labels), metric in pb_utils.METRICS.items():
+        if family == "synaplan_llm_queue_wait_seconds":
+            queue_wait[dict(labels).get("priority")] = bench_models.percentiles(metric.values, 1000)
+    finished_bulk = [r for r in bulk_records if r["end"] - start <= wall]
+    return {
+        "policy": args.policy,
+        "classes": args.classes,
+        "interactive_ttft_ms": bench_models.percentiles(
+            [r["first"] - r["start"] for r in interactive_records if r["first"]], 1000),
+        "queue_wait_ms": queue_wait,
+        "bulk_requests": len(finished_bulk),
+        "bulk_tokens_per_second": len(finished_bulk) * args.bulk_tokens / wall,
+    }
+
+
+def _child(spec, results):
+    try:
+        results.put(run_policy(spec))
+    except BaseException as e:
+        results.put({"policy": spec["policy"], "error": f"{type(e).__name__}: {e}"})
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--policy", action="append", metavar="NAME=CLASSES",
+                        help=f"scheduler_classes to compare (default: {' '.join(DEFAULT_POLICIES)})")
+    parser.add_argument("--streams", type=int, default=16, help="max_concurrent_streams = mock engine batch slots")
+    parser.add_argument("--bulk", type=int, default=24, help="bulk clients (one tenant, priority batch)")
+    parser.add_argument("--bulk-tokens", type=int, default=256, help="max_tokens of bulk requests")
+    parser.add_argument("--interactive", type=int, default=4, help="interactive clients (a tenant each)")
+    parser.add_argument("--rounds", type=int, default=10, help="chat turns per interactive client")
+    parser.add_argument("--think-ms", type=float, default=200.0, help="pause before each chat turn")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="mock TRT-LLM tokens/sec per sequence")
+    parser.add_argument("--weights", help="tokenizer directory (default: build a tiny one)")
+    args = parser.parse_args()
+
+    sys.path[:0] = [bench_models.HARNESS, bench_models.PYTHON_LIB]
+    with tempfile.TemporaryDirectory(prefix="synaplan-scheduler-") as tmp:
+        if args.weights is None:
+            import fixtures
+            args.weights = fixtures.build_weights(tmp, with_model=False)
+
+        context = multiprocessing.get_context("spawn")
+        print(f"{args.bulk} bulk clients x {args.bulk_tokens} tokens, {args.interactive} interactive clients, "
+              f"{args.streams} streams\n")
+        print(f"{'policy':>8} {'ttft p50':>9} {'ttft p99':>9} {'wait interactive p99':>21} "
+              f"{'wait batch p99':>15} {'bulk tok/s':>11}")
+        for policy in args.policy or DEFAULT_POLICIES:
+            name, classes = policy.split("=", 1)
+            spec = dict(vars(args), policy=name, classes=classes)
+            results = context.Queue()
+            process = context.Process(target=_child, args=(spec, results))
+            process.start()
+            result = results.get()
+            process.join()
+            if "error" in result:
+                print(f"{name:>8} FAILED: {result['error']}")
+                continue
+            ttft = result["interactive_ttft_ms"] or {}
+            wait = lambda cls: (result["queue_wait_ms"].get(cls) or {}).get("p99", float("nan"))  # noqa: E731
+            default = classes.split(",")[0].split(":")[0]
+            print(f"{name:>8} {ttft.get('p50', float('nan')):>7.1f}ms {ttft.get('p99', float('nan')):>7.1f}ms "
+                  f"{wait('interactive') if 'interactive' in result['queue_wait_ms'] else wait(default):>19.1f}ms "
+                  f"{wait('batch'):>13.1f}ms {result['bulk_tokens_per_second']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Benchmark: mistral-cpu decode speed with and without speculative decoding.
+
+Generates ``--new-tokens`` tokens for a RAG-style prompt (a context
+document followed by a question that asks to quote it), with the
+backend's sampling settings unless ``--greedy``, for each
+``speculative_mode`` of ``synaplan_triton.speculative``:
+
+* ``off``           - plain ``model.generate``
+* ``prompt_lookup`` - drafts copied from the prompt
+* ``draft_model``   - drafts from ``--draft`` (needs a checkpoint that
+  shares the tokenizer)
+
+and prints decode tokens/sec, the speed-up over ``off``, the acceptance
+rate and the tokens produced per forward pass of the model. Without
+``--weights`` a tiny random model (and a one-layer draft) is built; its
+output is noise, so acceptance says little there::
+
+    python3 benchmarks/triton/bench_speculative.py --weights /cache/weights/mistral-7b-instruct-v0.3 \
+        --context docs/contract.txt --modes off,prompt_lookup
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, "harness"), os.path.join(HERE, "..", "..", "charts", "triton", "files", "python")]
+
+import torch  # noqa: E402
+from transformers import AutoModelForCausalLM, AutoTokenizer  # noqa: E402
+
+import fixtures  # noqa: E402
+from synaplan_triton import speculative  # noqa: E402
+
+QUESTION = "Using only the context above, quote the passages about the contract term and notice period verbatim."
+
+
+def run(model, input_ids, speculation, args):
+    kwargs = dict(max_new_tokens=args.new_tokens, min_new_tokens=args.new_tokens, pad_token_id=2,
+                  return_dict_in_generate=True)
+    kwargs.update(dict(do_sample=False) if args.greedy else dict(do_sample=True, temperature=0.7, top_p=0.9))
+    results = []
+    for run_ in range(args.runs):
+        torch.manual_seed(run_)
+        acceptance = None
+        start = time.perf_counter()
+        with torch.no_grad():
+            if speculation is None:
+                output = model.generate(input_ids, **kwargs)
+            else:
+                with speculation.track(model, input_ids.shape[1]) as acceptance:
+                    output = model.generate(input_ids, **kwargs, **speculation.generation_kwargs())
+        seconds = time.perf_counter() - start
+        generated = output.sequences.shape[1] - input_ids.shape[1]
+        results.append({
+            "tokens_per_second": generated / seconds,
+            "acceptance": acceptance.accepted(generated) / acceptance.drafted if acceptance and acceptance.drafted else None,
+            "tokens_per_step": generated / acceptance.steps if acceptance else 1.0,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--weights", help="Hugging Face checkpoint (default: build a tiny random one)")
+    parser.add_argument("--draft", help="draft checkpoint for draft_model (default: tiny random one without --weights)")
+    parser.add_argument("--context", help="text file used as the retrieved context (default: the harness corpus)")
+    parser.add_argument("--modes", default="off,prompt_lookup,draft_model")
+    parser.add_argument("--num-tokens", type=int, default=10, help="speculative_num_tokens")
+    parser.add_argument("--max-ngram", type=int, default=3, help="speculative_max_ngram")
+    parser.add_argument("--new-tokens", type=int, default=128)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--greedy", action="store_true", help="greedy decoding instead of temperature 0.7 / top-p 0.9")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="synaplan-speculative-") as tmp:
+        weights = args.weights or fixtures.build_weights(os.path.join(tmp, "weights"))
+        draft = args.draft
+        if draft is None and args.weights is None:
+            draft = fixtures.build_weights(os.path.join(tmp, "draft"), num_hidden_layers=1)
+
+        tokenizer = AutoTokenizer.from_pretrained(weights, local_files_only=True)
+        model = AutoModelForCausalLM.from_pretrained(weights, local_files_only=True, torch_dtype=torch.bfloat16,
+                                                     low_cpu_mem_usage=True).eval()
+        if args.context:
+            with open(args.context) as f:
+                context = f.read()
+        else:
+            context = fixtures.CORPUS * 4
+        input_ids = torch.tensor([tokenizer.apply_chat_template(
+            [{"role": "user", "content": f"Context:\n{context}\n\n{QUESTION}"}],
+            tokenize=True, add_generation_prompt=True, return_dict=True)["input_ids"]])
+
+        print(f"prompt {input_ids.shape[1]} tokens, {args.new_tokens} new tokens, "
+              f"{'greedy' if args.greedy else 'sampling'}, {args.runs} runs per row (median)\n")
+        print(f"{'mode':>14} {'tok/s':>8} {'speed-up':>9} {'acceptance':>11} {'tokens/step':>12}")
+        baseline = None
+        for mode in args.modes.split(","):
+            if mode == "off":
+                speculation = None
+            elif mode == "draft_model":
+                if draft is None:
+                    print(f"{mode:>14} skipped, needs --draft")
+                    continue
+                speculation = speculative.Speculation(mode, args.num_tokens, args.max_ngram,
+                                                      speculative.load_draft_model(draft, model))
+            else:
+                speculation = speculative.Speculation(mode, args.num_tokens, args.max_ngram)
+            results = run(model, input_ids, speculation, args)
+            median = lambda key: statistics.median(r[key] for r in results)  # noqa: E731
+            tokens_per_second = median("tokens_per_second")
+            if mode == "off":
+                baseline = tokens_per_second
+            acceptance = [r["acceptance"] for r in results if r["acceptance"] is not None]
+            print(f"{mode:>14} {tokens_per_second:>8.1f} "
+                  f"{(f'{tokens_per_second / baseline:.2f}x' if baseline else '-'):>9} "
+                  f"{(f'{statistics.median(acceptance):.1%}' if acceptance else '-'):>11} "
+                  f"{median('tokens_per_step'):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Tiny tokenizer/model, workloads and the mock TRT-LLM target for the harness."""
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import numpy as np
+
+import triton_python_backend_utils as pb_utils
+
+REPOSITORY = os.path.join(os.path.dirname(__file__), "..", "..", "..", "charts", "triton", "files", "repository")
+
+CORPUS = (
+    "Synaplan retrieves the relevant passages from the knowledge base and hands them to the model as context. "
+    "The contract starts on 1 January and runs for 24 months. Either party may terminate with three months notice. "
+    "Prices are quoted in euro and exclude VAT. Please summarize the document, list the open questions and "
+    "suggest next steps for the team. Überprüfe die Antwort sorgfältig, añade ejemplos und zitiere die Quelle. "
+    "Sure! Here is a short overview:\n\n1. The server loads the model repository.\n2. Requests are tokenized "
+    "in batches and streamed back to the client.\n"
+)
+
+SPECIAL_TOKENS = ["<unk>", "<s>", "</s>", "[INST]", "[/INST]"]
+
+# Mistral-style template: the system prompt is merged into the last user turn
+CHAT_TEMPLATE = (
+    "{{ bos_token }}{% set system = messages | selectattr('role', 'equalto', 'system') | list %}"
+    "{% set turns = messages | rejectattr('role', 'equalto', 'system') | list %}"
+    "{% for m in turns %}{% if m['role'] == 'user' %}[INST] "
+    "{% if loop.last and system %}{{ system[0]['content'] }}\n\n{% endif %}{{ m['content'] }}[/INST]"
+    "{% else %} {{ m['content'] }}{{ eos_token }}{% endif %}{% endfor %}"
+)
+
+
+def build_weights(directory, vocab_size=2048, with_model=True, **model_config):
+    """Write a tiny BPE tokenizer (and a random 2-layer Mistral) to ``directory``.
+
+    ``model_config`` overrides ``MistralConfig`` fields, e.g. more layers for
+    benchmarks where the weights should dominate memory.
+    """
+    from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, processors, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    tok = Tokenizer(models.BPE(unk_token="<unk>", byte_fallback=True))
+    tok.normalizer = normalizers.Replace(" ", "▁")
+    tok.pre_tokenizer = pre_tokenizers.Metaspace(replacement="▁", prepend_scheme="first", split=False)
+    tok.decoder = decoders.Sequence([decoders.Replace("▁", " "), decoders.ByteFallback(), decoders.Fuse(),
+                                     decoders.Strip(" ", 1, 0)])
+    trainer = trainers.BpeTrainer(vocab_size=vocab_size,
+                                  special_tokens=SPECIAL_TOKENS + [f"<0x{i:02X}>" for i in range(256)])
+    tok.train_from_iterator([CORPUS] * 20, trainer)
+    tok.post_processor = processors.TemplateProcessing(single="<s> $A", special_tokens=[("<s>", 1)])
+
+    fast = PreTrainedTokenizerFast(tokenizer_object=tok, bos_token="<s>", eos_token="</s>", unk_token="<unk>")
+    fast.chat_template = CHAT_TEMPLATE
+    fast.save_pretrained(directory)
+
+    if with_model:
+        import torch
+        from transformers import MistralConfig, MistralForCausalLM
+        torch.manual_seed(0)
+        config = MistralConfig(**{**dict(vocab_size=len(fast), hidden_size=256, intermediate_size=512,
+                                         num_hidden_layers=2, num_attention_heads=8, num_key_value_heads=2,
+                                         max_position_embeddings=8192, bos_token_id=1, eos_token_id=2),
+                                  **model_config})
+        MistralForCausalLM(config).save_pretrained(directory)
+    return directory
+
+
+def load_model_config(model, parameters=None):
+    """Read ``config.pbtxt`` of a repository model into Triton's JSON model config shape."""
+    with open(os.path.join(REPOSITORY, model, "config.pbtxt")) as f:
+        text = f.read()
+    config = {
+        "name": re.search(r'^name:\s*"([^"]+)"', text, re.M).group(1),
+        "max_batch_size": int(re.search(r"^max_batch_size:\s*(\d+)", text, re.M).group(1)),
+        "output": [{"name": n, "data_type": t}
+                   for n, t in re.findall(r'\{\s*name:\s*"([^"]+)",\s*data_type:\s*(\w+)', text.split("output", 1)[1])],
+        "parameters": {k: {"string_value": v}
+                       for k, v in re.findall(r'key:\s*"([^"]+)",\s*value:\s*\{\s*string_value:\s*"([^"]*)"', text)},
+    }
+    for key, value in (parameters or {}).items():
+        config["parameters"][key] = {"string_value": str(value)}
+    return config
+
+
+WORKLOADS = {
+    # name: (turns per conversation, words per message, max_tokens)
+    "short": (1, 20, 32),
+    "chat": (4, 60, 64),
+    "long": (8, 200, 128),
+}
+
+
+def conversation(workload, seed):
+    """A multi-turn conversation; the harness replays it one user turn at a time."""
+    turns, words, _ = WORKLOADS[workload]
+    rng = random.Random(seed)
+    vocabulary = CORPUS.split()
+    messages = [{"role": "system", "content": "You are Synaplan, a helpful assistant. Answer precisely."}]
+    for _ in range(turns):
+        messages.append({"role": "user", "content": " ".join(rng.choice(vocabulary) for _ in range(words))})
+        messages.append({"role": "assistant", "content": " ".join(rng.choice(vocabulary) for _ in range(words))})
+    return messages
+
+
+def request_inputs(messages, max_tokens, batched=True):
+    shape = (1, 1) if batched else (1,)
+    return [
+        pb_utils.Tensor("conversation", np.array([json.dumps(messages)], dtype=object).reshape(shape)),
+        pb_utils.Tensor("max_tokens", np.array([max_tokens], dtype=np.int32).reshape(shape)),
+    ]
+
+
+class MockTrtLlm:
+    """BLS target streaming synthetic ``output_ids`` like the tensorrtllm backend.
+
+    Each stream yields a token every ``1 / token_rate`` seconds; at most
+    ``max_batch_size`` streams decode at once (the engine's in-flight
+    batch), the others wait for a slot. Generated IDs are taken from the
+    tokenized corpus so the detokenizer sees realistic text.
+    """
+
+    def __init__(self, tokenizer, token_rate=50.0, max_batch_size=16, eos_token_id=2):
+        self.interval = 1.0 / token_rate
+        self.slots = threading.BoundedSemaphore(max_batch_size)
+        self.eos_token_id = eos_token_id
+        self.token_ids = tokenizer(CORPUS, add_special_tokens=False)["input_ids"]
+        self.stopped = set()
+
+    def __call__(self, request):
+        inputs = {t.name(): t.as_numpy() for t in request.inputs()}
+        if "stop" in inputs:
+            self.stopped.add(request.request_id())
+            return iter([pb_utils.InferenceResponse(output_tensors=[])])
+        return self._stream(request, int(inputs["request_output_len"].reshape(-1)[0]))
+
+    def _stream(self, request, output_len):
+        with self.slots:
+            offset = hash(request.request_id()) % len(self.token_ids)
+            next_time = time.perf_counter()
+            for i in range(output_len + 1):
+                if request.cancelled or request.request_id() in self.stopped:
+                    return
+                next_time += self.interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                token = self.eos_token_id if i == output_len else self.token_ids[(offset + i) % len(self.token_ids)]
+                yield pb_utils.InferenceResponse(output_tensors=[
+                    pb_utils.Tensor("output_ids", np.array([[[token]]], dtype=np.int32)),
+                    pb_utils.Tensor("sequence_length", np.array([[i + 1]], dtype=np.int32)),
+                ])
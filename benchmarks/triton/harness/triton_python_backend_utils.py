@@ -0,0 +1,214 @@
+"""Stand-in for Triton's ``triton_python_backend_utils`` (benchmarks only).
+
+Implements the subset of the Python backend API the chart's models use so
+``model.py`` files can run in a plain Python process: tensors, requests
+with response senders, decoupled BLS calls into models registered with
+``register_model`` and custom metrics that keep their observations in
+memory (``METRICS``) for the harness to read back.
+"""
+import threading
+
+import numpy as np
+
+TRITONSERVER_RESPONSE_COMPLETE_FINAL = 1
+
+_NUMPY_TYPES = {
+    "TYPE_BOOL": np.bool_,
+    "TYPE_INT32": np.int32,
+    "TYPE_INT64": np.int64,
+    "TYPE_FP32": np.float32,
+    "TYPE_STRING": np.object_,
+}
+
+
+class TritonModelException(Exception):
+    pass
+
+
+class TritonError:
+
+    def __init__(self, message):
+        self._message = message
+
+    def message(self):
+        return self._message
+
+
+class Tensor:
+
+    def __init__(self, name, array):
+        self._name = name
+        self._array = np.asarray(array)
+
+    def name(self):
+        return self._name
+
+    def as_numpy(self):
+        return self._array
+
+
+class InferenceResponse:
+
+    def __init__(self, output_tensors=(), error=None):
+        self._tensors = {t.name(): t for t in output_tensors}
+        self._error = error
+
+    def has_error(self):
+        return self._error is not None
+
+    def error(self):
+        return self._error
+
+    def output_tensors(self):
+        return list(self._tensors.values())
+
+
+class ResponseSender:
+    """Collects responses; ``on_response(response, flags)`` is called for each send."""
+
+    def __init__(self, on_response):
+        self._on_response = on_response
+        self.cancelled = False
+        self.closed = threading.Event()
+
+    def send(self, response=None, flags=0):
+        if self.closed.is_set():
+            raise TritonModelException("Response sender is already closed")
+        self._on_response(response, flags)
+        if flags & TRITONSERVER_RESPONSE_COMPLETE_FINAL:
+            self.closed.set()
+
+    def is_cancelled(self):
+        return self.cancelled
+
+
+class Request:
+    """A client request as handed to ``TritonPythonModel.execute``."""
+
+    def __init__(self, inputs, on_response, request_id=""):
+        self._inputs = {t.name(): t for t in inputs}
+        self._request_id = request_id
+        self.sender = ResponseSender(on_response)
+
+    def inputs(self):
+        return list(self._inputs.values())
+
+    def request_id(self):
+        return self._request_id
+
+    def get_response_sender(self):
+        return self.sender
+
+    def is_cancelled(self):
+        return self.sender.cancelled
+
+
+def get_input_tensor_by_name(request, name):
+    return request._inputs.get(name)
+
+
+def get_output_tensor_by_name(response, name):
+    return response._tensors.get(name)
+
+
+def get_output_config_by_name(model_config, name):
+    for output in model_config.get("output", []):
+        if output["name"] == name:
+            return output
+    return None
+
+
+def triton_string_to_numpy(data_type):
+    return _NUMPY_TYPES[data_type]
+
+
+# --- BLS ---
+
+_MODELS = {}
+
+
+def register_model(name, handler):
+    """Route BLS requests for ``name`` to ``handler(request) -> iterable of InferenceResponse``."""
+    _MODELS[name] = handler
+
+
+class ResponseIterator:
+
+    def __init__(self, request, responses):
+        self._request = request
+        self._responses = iter(responses)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._responses)
+
+    def cancel(self):
+        self._request.cancelled = True
+
+
+class InferenceRequest:
+
+    def __init__(self, model_name, requested_output_names=(), inputs=(), request_id="", **kwargs):
+        self.model_name = model_name
+        self.requested_output_names = list(requested_output_names)
+        self._inputs = {t.name(): t for t in inputs}
+        self._request_id = request_id
+        self.cancelled = False
+
+    def inputs(self):
+        return list(self._inputs.values())
+
+    def request_id(self):
+        return self._request_id
+
+    def exec(self, decoupled=False):
+        handler = _MODELS.get(self.model_name)
+        if handler is None:
+            raise TritonModelException(f"Model '{self.model_name}' is not registered")
+        responses = handler(self)
+        if decoupled:
+            return ResponseIterator(self, responses)
+        return next(iter(responses))
+
+
+# --- custom metrics ---
+
+METRICS = {}  # (family name, frozenset(labels)) -> Metric
+
+
+class Metric:
+
+    def __init__(self, kind, buckets=None):
+        self.kind = kind
+        self.buckets = buckets
+        self.values = []
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.values.append(value)
+
+    def increment(self, value=1):
+        with self._lock:
+            self.value += value
+
+    def set(self, value):
+        self.value = value
+
+
+class MetricFamily:
+    COUNTER = 0
+    GAUGE = 1
+    HISTOGRAM = 2
+
+    def __init__(self, name, description, kind):
+        self.name = name
+        self.description = description
+        self.kind = kind
+
+    def Metric(self, labels=None, buckets=None):  # noqa: N802 - mirrors the Triton API
+        key = (self.name, frozenset((labels or {}).items()))
+        return METRICS.setdefault(key, Metric(self.kind, buckets))
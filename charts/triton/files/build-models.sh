@@ -6,34 +6,54 @@ find /cache
 source /functions.sh
 
 # -------------------------------
-# Model build loop
+# Settings
 # -------------------------------
 BUILD_MODELS="${BUILD_MODELS:-mistral-7b-instruct-v0.3}"
+# Models prepared (tokenizer, hash, checkpoint conversion) at once. Conversion is CPU and host-RAM
+# bound (about the checkpoint size per model); trtllm-build then runs one model at a time on the GPU
+BUILD_JOBS="${BUILD_JOBS:-2}"
 
-for MODEL_NAME in $BUILD_MODELS; do
-  PRECISION=$(pick_precision "$GPU_CC_MAJOR" "$GPU_MEM")
-  echo "[DaemonSet] Processing ${MODEL_NAME} → ${PRECISION}"
+# trtllm-build arguments; part of the build key, so changing them rebuilds the engines
+BUILD_ARGS=(
+  --max_batch_size 16
+  --max_seq_len 4096
+  --max_num_tokens 4096
+  --gpt_attention_plugin auto
+  --gemm_plugin auto
+  --use_paged_context_fmha enable
+  --workers 4
+)
 
-  WEIGHTS_DIR="$(weights_dir "${MODEL_NAME}")"
+WORK_DIR="$(mktemp -d)"  # per-model build key and stage timings of this run
+trap 'rm -rf "${WORK_DIR}"' EXIT
 
-  # Validate that weights directory exists
-  if [ ! -d "${WEIGHTS_DIR}" ]; then
-    echo "  -> ERROR: Weights directory does not exist: ${WEIGHTS_DIR}" >&2
-    echo "  -> Model ${MODEL_NAME} was specified in BUILD_MODELS but weights are missing" >&2
-    echo "  -> This indicates a configuration error - failing build" >&2
-    exit 1
-  fi
+synaplan() {
+  PYTHONPATH="/python-lib${PYTHONPATH:+:${PYTHONPATH}}" python3 -m "synaplan_triton.$1" "${@:2}"
+}
 
-  ENGINE_DIR="$(engine_dir "${MODEL_NAME}" "${PRECISION}" "${ENGINE_ID}")"
+# timed STAGE CMD... : run CMD and append "STAGE <milliseconds>" to ${TIMINGS}
+timed() {
+  local stage="$1" start end
+  shift
+  start=$(date +%s%N)
+  "$@" || return $?
+  end=$(date +%s%N)
+  echo "${stage} $(( (end - start) / 1000000 ))" >> "${TIMINGS}"
+}
 
-  if [ -f "${ENGINE_DIR}/rank0.engine" ]; then
-    echo "  -> Engine already exists, skipping."
-    continue
+# model_settings MODEL : set PRECISION, WEIGHTS_DIR, ENGINE_DIR, CONVERT_ARGS and TIMINGS for MODEL
+model_settings() {
+  MODEL_NAME="$1"
+  if [ "$ENGINE_ID" = "cpu" ]; then
+    # CPU mode (cpuQuantization): weight-only quantized checkpoint for mistral-cpu
+    PRECISION="${CPU_WEIGHT_PRECISION:-int8}"
+  else
+    PRECISION=$(pick_precision "$GPU_CC_MAJOR" "$GPU_MEM")
   fi
+  WEIGHTS_DIR="$(weights_dir "${MODEL_NAME}")"
+  ENGINE_DIR="$(engine_dir "${MODEL_NAME}" "${PRECISION}" "${ENGINE_ID}")"
+  TIMINGS="${WORK_DIR}/${MODEL_NAME}.timings"
 
-  mkdir -p "${ENGINE_DIR}/converted"
-
-  echo "  -> Running convert_checkpoint.py"
   # Set base dtype based on precision
   case "$PRECISION" in
     bf16)
@@ -56,31 +76,155 @@ for MODEL_NAME in $BUILD_MODELS; do
       CONVERT_ARGS=(--dtype float16 --tp_size 1)
       ;;
   esac
+}
+
+# -------------------------------
+# Stage 1 (in parallel per model): tokenizer, build key, checkpoint conversion
+# -------------------------------
+prepare_model() {
+  model_settings "$1"
+  echo "[DaemonSet] Processing ${MODEL_NAME} → ${PRECISION}"
+
+  # Validate that weights directory exists
+  if [ ! -d "${WEIGHTS_DIR}" ]; then
+    echo "  -> ERROR: Weights directory does not exist: ${WEIGHTS_DIR}" >&2
+    echo "  -> Model ${MODEL_NAME} was specified in BUILD_MODELS but weights are missing" >&2
+    echo "  -> This indicates a configuration error - failing build" >&2
+    exit 1
+  fi
+
+  # Compiled tokenizer for the Python backends; rebuilt every run (about a second) so it
+  # follows the weights. Not fatal: the backends fall back to AutoTokenizer without it.
+  TOKENIZER_ARTIFACT="$(tokenizer_artifact "${MODEL_NAME}")"
+  echo "  -> Compiling tokenizer artifact ${TOKENIZER_ARTIFACT}"
+  timed tokenizer synaplan tokenizer "${WEIGHTS_DIR}" "${TOKENIZER_ARTIFACT}" \
+    || echo "  -> WARNING: tokenizer artifact not built, backends will load the HuggingFace tokenizer" >&2
+
+  if [ "$ENGINE_ID" = "cpu" ]; then
+    # Skipped when the artifact matches the weights and this image's torch; needs about
+    # the bf16 checkpoint size in RAM while converting
+    echo "  -> Quantizing ${WEIGHTS_DIR} to ${PRECISION} weight-only for CPU"
+    timed quantize synaplan quantize "${WEIGHTS_DIR}" "${ENGINE_DIR}" --precision "${PRECISION}" --if-stale
+    return
+  fi
+
+  # Content hash of the weights (digests cached by size/mtime), precision, engine ID and arguments
+  local key
+  key=$(timed hash synaplan engine_cache key "${WEIGHTS_DIR}" --precision "${PRECISION}" \
+    --engine-id "${ENGINE_ID}" --digest-cache "$(weights_digest_cache "${MODEL_NAME}")" \
+    -- "${CONVERT_ARGS[@]}" "${BUILD_ARGS[@]}")
+  echo "  -> Build key ${key:0:12}"
+
+  if synaplan engine_cache check "${ENGINE_DIR}" "${key}"; then
+    echo "  -> Engine is up to date, skipping."
+    return
+  fi
+  if [ -f "${ENGINE_DIR}/rank0.engine" ] && [ ! -f "${ENGINE_DIR}/build-manifest.json" ]; then
+    # Built before manifests existed, from unknown weights and arguments: rebuilt once, keyed from then on
+    echo "  -> Engine has no build manifest, rebuilding it once as ${key:0:12}"
+  fi
+
+  # Leftovers of an interrupted build (the lock in the main loop keeps other builders out). A crash
+  # between the two renames of the swap leaves only ENGINE_DIR.old: that is the engine, put it back
+  if [ -d "${ENGINE_DIR}.old" ] && [ ! -d "${ENGINE_DIR}" ]; then
+    mv "${ENGINE_DIR}.old" "${ENGINE_DIR}"
+  fi
+  rm -rf "${ENGINE_DIR}.staging" "${ENGINE_DIR}.converted" "${ENGINE_DIR}.old"
+  mkdir -p "${ENGINE_DIR}.converted"
 
-  python3 /app/tensorrt_llm/examples/models/core/llama/convert_checkpoint.py \
+  echo "  -> Running convert_checkpoint.py"
+  timed convert python3 /app/tensorrt_llm/examples/models/core/llama/convert_checkpoint.py \
     --model_dir "${WEIGHTS_DIR}" \
-    --output_dir "${ENGINE_DIR}/converted" \
+    --output_dir "${ENGINE_DIR}.converted" \
     "${CONVERT_ARGS[@]}"
 
+  echo "${key}" > "${WORK_DIR}/${MODEL_NAME}.key"
+}
+
+# -------------------------------
+# Stage 2 (one model at a time): trtllm-build into a staging directory, then swap it in
+# -------------------------------
+build_model() {
+  model_settings "$1"
+  [ -f "${WORK_DIR}/${MODEL_NAME}.key" ] || return 0
+  local key staging="${ENGINE_DIR}.staging"
+  key="$(cat "${WORK_DIR}/${MODEL_NAME}.key")"
+
+  echo "[DaemonSet] Building ${MODEL_NAME} → ${PRECISION}"
   echo "  -> Running trtllm-build"
-  trtllm-build \
-    --checkpoint_dir "${ENGINE_DIR}/converted" \
-    --output_dir "${ENGINE_DIR}" \
-    --max_batch_size 16 \
-    --max_seq_len 4096 \
-    --max_num_tokens 4096 \
-    --gpt_attention_plugin auto \
-    --gemm_plugin auto \
-    --use_paged_context_fmha enable \
-    --workers 4
+  timed build trtllm-build \
+    --checkpoint_dir "${ENGINE_DIR}.converted" \
+    --output_dir "${staging}" \
+    "${BUILD_ARGS[@]}"
+  rm -rf "${ENGINE_DIR}.converted"
 
   echo "  -> Running generate_xgrammar_tokenizer_info.py"
-  python3 /app/tensorrt_llm/examples/generate_xgrammar_tokenizer_info.py \
+  timed tokenizer_info python3 /app/tensorrt_llm/examples/generate_xgrammar_tokenizer_info.py \
     --model_dir "${WEIGHTS_DIR}" \
-    --output_dir "${ENGINE_DIR}/tokenizer_info"
+    --output_dir "${staging}/tokenizer_info"
+
+  synaplan engine_cache manifest "${staging}" --key "${key}" --model "${MODEL_NAME}" \
+    --precision "${PRECISION}" --engine-id "${ENGINE_ID}" --weights-dir "${WEIGHTS_DIR}" \
+    --digest-cache "$(weights_digest_cache "${MODEL_NAME}")" --timings "${TIMINGS}" \
+    -- "${CONVERT_ARGS[@]}" "${BUILD_ARGS[@]}"
+
+  # The complete engine replaces the old one by two renames on the same filesystem, so ENGINE_DIR
+  # is never a partial engine. The old one is set aside first and put back if the second rename
+  # fails; after a crash between the two, the next run restores it (see prepare_model)
+  if [ -d "${ENGINE_DIR}" ]; then
+    mv "${ENGINE_DIR}" "${ENGINE_DIR}.old"
+  fi
+  if ! mv "${staging}" "${ENGINE_DIR}"; then
+    echo "  -> ERROR: could not move the new engine into ${ENGINE_DIR}, keeping the previous one" >&2
+    if [ -d "${ENGINE_DIR}.old" ]; then
+      rm -rf "${ENGINE_DIR}"
+      mv "${ENGINE_DIR}.old" "${ENGINE_DIR}"
+    fi
+    return 1
+  fi
+  rm -rf "${ENGINE_DIR}.old"
+
+  echo "  -> Built engine: ${ENGINE_DIR}/rank0.engine"
+}
 
-  echo "  -> Built engine: ${ENGINE_DIR}/engine.plan"
+# -------------------------------
+# Model build loop
+# -------------------------------
+# One builder per engine directory: replicas sharing /cache wait here, then find the engine current
+for MODEL_NAME in $BUILD_MODELS; do
+  model_settings "${MODEL_NAME}"
+  mkdir -p "$(dirname "${ENGINE_DIR}")"
+  exec {lock_fd}>"${ENGINE_DIR}.lock"
+  flock "${lock_fd}"
 done
 
-echo "[DaemonSet] All models processed."
+pids=()
+for MODEL_NAME in $BUILD_MODELS; do
+  while [ "$(jobs -rp | wc -l)" -ge "${BUILD_JOBS}" ]; do
+    wait -n || true  # statuses are collected below
+  done
+  ( prepare_model "${MODEL_NAME}" ) > >(sed -u "s|^|[${MODEL_NAME}] |") 2>&1 &
+  pids+=("$!")
+done
+failed=0
+for pid in "${pids[@]}"; do
+  wait "${pid}" || failed=1
+done
+
+# Models whose preparation failed have no build key and are skipped; the others still build
+for MODEL_NAME in $BUILD_MODELS; do
+  build_model "${MODEL_NAME}"
+done
+
+echo "[DaemonSet] All models processed. Stage timings:"
+for MODEL_NAME in $BUILD_MODELS; do
+  [ -f "${WORK_DIR}/${MODEL_NAME}.timings" ] || continue
+  awk -v model="${MODEL_NAME}" '{ t[$1] += $2; if (!($1 in seen)) { seen[$1] = 1; order[++n] = $1 } }
+    END { line = "  " model ":"; for (i = 1; i <= n; i++) line = line sprintf(" %s %.1fs", order[i], t[order[i]] / 1000); print line }' \
+    "${WORK_DIR}/${MODEL_NAME}.timings"
+done
 find /cache
+if [ "${failed}" -ne 0 ]; then
+  echo "[DaemonSet] ERROR: preparing at least one model failed" >&2
+  exit 1
+fi
@@ -89,3 +89,15 @@ weights_dir() {
   local model_name="${1}"
   echo "/cache/weights/${model_name}"
 }
+
+# Compiled tokenizer shared by all precisions/engines of a model (see synaplan_triton/tokenizer.py)
+tokenizer_artifact() {
+  local model_name="${1}"
+  echo "/cache/engines/${model_name}/synaplan-tokenizer.bin"
+}
+
+# Per-file SHA-256 of a model's weights, reused while size and mtime match (see synaplan_triton/engine_cache.py)
+weights_digest_cache() {
+  local model_name="${1}"
+  echo "/cache/engines/${model_name}/weights-sha256.json"
+}
@@ -33,6 +33,13 @@ else
     echo "[Init] Mistral weights directory: ${MISTRAL_WEIGHTS_DIR}"
 fi
 
+# CPU mode: instances of mistral-cpu, each pinned to its own CPU partition (cpu_affinity.py)
+if [ -n "${SYNAPLAN_CPU_INSTANCES:-}" ] && [ -f /repository/mistral-cpu/config.pbtxt ]; then
+    echo "[Init] mistral-cpu instances: ${SYNAPLAN_CPU_INSTANCES}"
+    sed -i "s/^instance_group \[{ count: [0-9]*, kind: KIND_CPU }\]/instance_group [{ count: ${SYNAPLAN_CPU_INSTANCES}, kind: KIND_CPU }]/" \
+      /repository/mistral-cpu/config.pbtxt
+fi
+
 find /repository
 for f in $(find /repository -name config.pbtxt); do
   subs=""
@@ -47,6 +54,9 @@ for f in $(find /repository -name config.pbtxt); do
   fi
 done
 
+# Shared python helpers (synaplan_triton) for the python backends
+export PYTHONPATH="/python-lib${PYTHONPATH:+:${PYTHONPATH}}"
+
 echo "[Init] Model repository ready. Launching Triton..."
 exec tritonserver \
   --model-repository=/repository \
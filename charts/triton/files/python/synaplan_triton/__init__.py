@@ -0,0 +1,6 @@
+"""Shared helpers for the Synaplan Triton Python backends.
+
+The chart ships this package as a ConfigMap mounted at
+``/python-lib/synaplan_triton``; ``init.sh`` puts ``/python-lib`` on the
+``PYTHONPATH`` so every ``model.py`` can ``import synaplan_triton``.
+"""
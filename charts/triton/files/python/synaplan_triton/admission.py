@@ -0,0 +1,226 @@
+"""Length-aware admission control against the TensorRT-LLM engine limits.
+
+The engine is built with fixed sequence and token budgets (``trtllm-build
+--max_seq_len / --max_input_len / --max_num_tokens``). A request that
+exceeds them is only refused by TRT-LLM after it was tokenized, queued
+and handed a stream slot. ``AdmissionController`` checks every request
+right after tokenization instead, against the limits recorded in the
+engine's ``config.json``:
+
+* the prompt must fit ``max_input_len`` and, as the tensorrtllm model
+  runs with ``enable_chunked_context`` off, ``max_num_tokens``
+* prompt plus ``max_tokens`` must fit ``max_seq_len``; depending on
+  ``max_tokens_policy`` an oversized ``max_tokens`` is clamped to the
+  room left or the request is rejected
+* with ``truncate_history`` the oldest turns of an oversized conversation
+  are dropped (system messages and the last user turn are kept) until the
+  prompt fits, instead of rejecting it
+
+The admitted prompt and output length are the request's worst-case KV
+cache footprint (``Admission.tokens``); the scheduler starts requests
+only while their sum stays within ``max_inflight_tokens``, so a burst of
+long prompts waits in the queue rather than crowding the paged KV cache.
+"""
+import json
+import logging
+import os
+
+from .config import get_parameter
+
+logger = logging.getLogger(__name__)
+
+ENGINE_CONFIG = "config.json"
+# trtllm-build arguments of build-models.sh, used when the engine config cannot be read
+DEFAULT_MAX_SEQ_LEN = 4096
+DEFAULT_MAX_NUM_TOKENS = 4096
+DEFAULT_MAX_BATCH_SIZE = 16
+MAX_TOKENS_POLICIES = ("clamp", "reject")
+
+
+class EngineLimits:
+    """Sequence and token budgets an engine was built with."""
+
+    __slots__ = ("max_seq_len", "max_input_len", "max_num_tokens", "max_batch_size", "source")
+
+    def __init__(self, max_seq_len=DEFAULT_MAX_SEQ_LEN, max_input_len=None, max_num_tokens=DEFAULT_MAX_NUM_TOKENS,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE, source="defaults"):
+        self.max_seq_len = max_seq_len
+        self.max_input_len = max_input_len or max_seq_len
+        self.max_num_tokens = max_num_tokens or max_seq_len
+        self.max_batch_size = max_batch_size
+        self.source = source
+
+    @property
+    def max_prompt_tokens(self):
+        # Without chunked context the whole prompt is one context step of at most max_num_tokens
+        return min(self.max_input_len, self.max_num_tokens, self.max_seq_len - 1)
+
+    def __repr__(self):
+        return (f"EngineLimits(max_seq_len={self.max_seq_len}, max_input_len={self.max_input_len}, "
+                f"max_num_tokens={self.max_num_tokens}, max_batch_size={self.max_batch_size}, source={self.source!r})")
+
+
+def read_engine_limits(engine_dir, fallback=None):
+    """``EngineLimits`` from ``<engine_dir>/config.json``; values it lacks come from ``fallback``.
+
+    Reads the ``build_config`` section of current TRT-LLM engines and the
+    ``builder_config`` section (``max_input_len + max_output_len``) of
+    engines built before 0.9. Raises OSError / ValueError if the file is
+    missing or unreadable.
+    """
+    fallback = fallback or EngineLimits()
+    path = os.path.join(engine_dir, ENGINE_CONFIG)
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    build = config.get("build_config")
+    if build is None:
+        build = dict(config.get("builder_config") or {})
+        if "max_seq_len" not in build and build.get("max_input_len") and build.get("max_output_len"):
+            build["max_seq_len"] = build["max_input_len"] + build["max_output_len"]
+    if not isinstance(build, dict) or not build.get("max_seq_len"):
+        raise ValueError(f"No max_seq_len in {path}")
+
+    return EngineLimits(
+        max_seq_len=int(build["max_seq_len"]),
+        max_input_len=int(build.get("max_input_len") or 0) or None,
+        max_num_tokens=int(build.get("max_num_tokens") or 0) or fallback.max_num_tokens,
+        max_batch_size=int(build.get("max_batch_size") or 0) or fallback.max_batch_size,
+        source=path,
+    )
+
+
+class Admission:
+    """What a request may run with: the (possibly truncated) prompt and its output budget."""
+
+    __slots__ = ("input_ids", "max_tokens", "requested_max_tokens", "dropped_messages")
+
+    def __init__(self, input_ids, max_tokens, requested_max_tokens, dropped_messages=0):
+        self.input_ids = input_ids
+        self.max_tokens = max_tokens
+        self.requested_max_tokens = requested_max_tokens
+        self.dropped_messages = dropped_messages
+
+    @property
+    def prompt_tokens(self):
+        return self.input_ids.shape[1]
+
+    @property
+    def tokens(self):
+        """Worst-case KV cache tokens: the prompt plus every token it may generate."""
+        return self.prompt_tokens + self.max_tokens
+
+    @property
+    def clamped(self):
+        return self.max_tokens < self.requested_max_tokens
+
+
+def history_cuts(conversation):
+    """Shorter versions of ``conversation``, each dropping more of the oldest turns.
+
+    Leading system messages stay, and every version starts at a user
+    message so chat templates that require alternating roles still render.
+    The last user turn is always kept.
+    """
+    head = 0
+    while head < len(conversation) and conversation[head].get("role") == "system":
+        head += 1
+    starts = [i for i in range(head + 1, len(conversation)) if conversation[i].get("role") == "user"]
+    return [conversation[:head] + conversation[i:] for i in starts]
+
+
+class AdmissionController:
+
+    def __init__(self, limits, max_tokens_policy="clamp", truncate_history=True, min_output_tokens=16,
+                 max_inflight_tokens=None):
+        if max_tokens_policy not in MAX_TOKENS_POLICIES:
+            raise ValueError(f"max_tokens_policy must be one of {MAX_TOKENS_POLICIES}, got {max_tokens_policy!r}")
+        self.limits = limits
+        self.max_tokens_policy = max_tokens_policy
+        self.truncate_history = truncate_history
+        self.min_output_tokens = max(1, min(min_output_tokens, limits.max_seq_len - 1))
+        self.max_inflight_tokens = max_inflight_tokens or limits.max_batch_size * limits.max_seq_len
+
+    def prompt_budget(self, max_tokens):
+        """Longest prompt a request with ``max_tokens`` may have."""
+        room = self.min_output_tokens if self.max_tokens_policy == "clamp" else max_tokens
+        return min(self.limits.max_prompt_tokens, self.limits.max_seq_len - room)
+
+    def admit(self, conversation, input_ids, max_tokens, encode):
+        """Check a tokenized request -> ``Admission``; ValueError with a client-facing message.
+
+        ``encode(conversation)`` renders and tokenizes a shortened
+        conversation to ``[1, length]`` IDs (used only to truncate history).
+        """
+        limits = self.limits
+        if max_tokens < 1:
+            raise ValueError(f"max_tokens must be at least 1, got {max_tokens}")
+        if self.max_tokens_policy == "reject" and max_tokens > limits.max_seq_len - 1:
+            raise ValueError(f"max_tokens {max_tokens} exceeds the engine's max_seq_len {limits.max_seq_len}")
+
+        budget = self.prompt_budget(max_tokens)
+        dropped = 0
+        if input_ids.shape[1] > budget:
+            if not self.truncate_history:
+                raise ValueError(self._too_long(input_ids.shape[1], budget, max_tokens))
+            input_ids, dropped = self._truncate(conversation, input_ids, budget, max_tokens, encode)
+
+        room = limits.max_seq_len - input_ids.shape[1]
+        return Admission(input_ids, min(max_tokens, room), max_tokens, dropped)
+
+    def _truncate(self, conversation, input_ids, budget, max_tokens, encode):
+        """Drop the fewest oldest turns that make the prompt fit ``budget`` (binary search)."""
+        cuts = history_cuts(conversation)
+        fits, shortest, lo, hi = None, input_ids.shape[1], 0, len(cuts) - 1
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            ids = encode(cuts[mid])
+            if ids.shape[1] <= budget:
+                fits, hi = (ids, len(conversation) - len(cuts[mid])), mid - 1
+            else:
+                shortest, lo = ids.shape[1], mid + 1  # all fail: the last probe is the shortest cut
+        if fits is None:
+            raise ValueError(self._too_long(shortest, budget, max_tokens, truncated=bool(cuts)))
+        return fits
+
+    def _too_long(self, prompt_tokens, budget, max_tokens, truncated=False):
+        what = "Even without older turns, the prompt" if truncated else "The prompt"
+        limits = self.limits
+        if budget >= limits.max_prompt_tokens:
+            return f"{what} has {prompt_tokens} tokens, the engine accepts at most {limits.max_prompt_tokens}"
+        if self.max_tokens_policy == "reject":
+            return (f"{what} ({prompt_tokens} tokens) plus max_tokens {max_tokens} exceeds the engine's "
+                    f"max_seq_len {limits.max_seq_len}")
+        return (f"{what} ({prompt_tokens} tokens) leaves fewer than {self.min_output_tokens} of the engine's "
+                f"max_seq_len {limits.max_seq_len} tokens for the output")
+
+
+def from_model_config(model_config):
+    """Build the controller from ``engine_dir`` and the ``max_*`` / admission parameters.
+
+    The limits come from the engine config in ``engine_dir``; if it cannot
+    be read the ``max_seq_len`` / ``max_num_tokens`` / ``max_batch_size``
+    parameters (defaults: build-models.sh) are used.
+    """
+    fallback = EngineLimits(
+        max_seq_len=get_parameter(model_config, "max_seq_len", DEFAULT_MAX_SEQ_LEN, int),
+        max_input_len=get_parameter(model_config, "max_input_len", None, int),
+        max_num_tokens=get_parameter(model_config, "max_num_tokens", DEFAULT_MAX_NUM_TOKENS, int),
+        max_batch_size=get_parameter(model_config, "max_batch_size", DEFAULT_MAX_BATCH_SIZE, int),
+        source="parameters",
+    )
+    limits = fallback
+    engine_dir = get_parameter(model_config, "engine_dir")
+    if engine_dir:
+        try:
+            limits = read_engine_limits(engine_dir, fallback)
+        except (OSError, ValueError) as e:
+            logger.warning("⚠️ Engine limits not read from %s (%s), using the parameters", engine_dir, e)
+
+    return AdmissionController(
+        limits,
+        max_tokens_policy=get_parameter(model_config, "max_tokens_policy", "clamp"),
+        truncate_history=get_parameter(model_config, "truncate_history", True, bool),
+        min_output_tokens=get_parameter(model_config, "min_output_tokens", 16, int),
+        max_inflight_tokens=get_parameter(model_config, "max_inflight_tokens", None, int),
+    )
@@ -0,0 +1,339 @@
+"""Continuous batching for a HuggingFace causal LM on CPU.
+
+A single scheduler thread owns the model. New sequences are prefilled one
+at a time (optionally starting from a reused KV cache) and then join the
+running batch; every step decodes one token for all active sequences in
+a single forward pass over their left-padded KV caches. Finished
+sequences leave between steps and the freed rows are refilled from the
+queue, so batch-1 matmuls become batch-N matmuls under concurrency.
+
+The batcher knows nothing about Triton: ``on_token(seq, token_id)`` and
+``on_finish(seq, error)`` callbacks are invoked from the scheduler thread.
+``cancel(seq)`` (or ``on_token`` returning False) takes a sequence out of
+the batch before the next step and frees its row; ``on_finish`` then sees
+``seq.cancelled`` set. ``on_token`` may instead set ``seq.stopped`` (a
+stop string was generated) to finish the sequence normally.
+
+Sampling settings are per sequence: temperature, top-p, top-k, an
+optional seeded ``torch.Generator`` and an optional ``guide`` (see
+``synaplan_triton.guided``) whose mask is applied to the sequence's
+logits row before sampling.
+"""
+import collections
+import logging
+import threading
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def cache_layers(cache):
+    """Return ``[(keys, values), ...]`` for a transformers KV cache object."""
+    layers = getattr(cache, "layers", None)
+    if layers is not None:  # transformers >= 4.54
+        return [(layer.keys, layer.values) for layer in layers]
+    if hasattr(cache, "key_cache"):
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [tuple(layer) for layer in cache]
+
+
+def build_cache(layers):
+    from transformers import DynamicCache
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def sample(logits, temperature, top_p, top_k=None, generators=None):
+    """Per-row temperature / nucleus / top-k sampling; rows with temperature 0 are greedy.
+
+    ``top_k`` holds 0 for rows without a top-k limit; rows with a
+    ``generators`` entry draw from that seeded generator.
+    """
+    greedy = logits.argmax(dim=-1)
+    if bool((temperature <= 0).all()):
+        return greedy
+    scaled = logits.float() / temperature.clamp(min=1e-5).unsqueeze(-1)
+    probs = torch.softmax(scaled, dim=-1)
+    sorted_probs, sorted_idx = probs.sort(dim=-1, descending=True)
+    cumulative = sorted_probs.cumsum(dim=-1)
+    sorted_probs[(cumulative - sorted_probs) > top_p.unsqueeze(-1)] = 0.0
+    if top_k is not None and bool((top_k > 0).any()):
+        ranks = torch.arange(sorted_probs.shape[-1]).unsqueeze(0)
+        sorted_probs[(top_k > 0).unsqueeze(-1) & (ranks >= top_k.unsqueeze(-1))] = 0.0
+    # Seeded rows draw only from their own generator, so they leave the process-wide RNG alone
+    seeded = {i for i, generator in enumerate(generators or ()) if generator is not None}
+    unseeded = [i for i in range(sorted_probs.shape[0]) if i not in seeded]
+    choice = torch.zeros(sorted_probs.shape[0], 1, dtype=torch.long)
+    if unseeded:
+        choice[unseeded] = torch.multinomial(sorted_probs[unseeded], num_samples=1)
+    for i in seeded:
+        choice[i] = torch.multinomial(sorted_probs[i], num_samples=1, generator=generators[i])
+    sampled = sorted_idx.gather(-1, choice).squeeze(-1)
+    return torch.where(temperature <= 0, greedy, sampled)
+
+
+def seeded_logits_processor(temperature, top_p, top_k, seed):
+    """A transformers ``LogitsProcessor`` that samples from its own seeded ``torch.Generator`` (batch size 1).
+
+    Only the sampled token keeps its score, so ``generate()`` with
+    ``do_sample=False`` emits it: the request is reproducible without
+    seeding the process-wide RNG that other requests draw from.
+    """
+    from transformers import LogitsProcessor
+
+    generator = torch.Generator().manual_seed(seed)
+    settings = torch.tensor([temperature]), torch.tensor([top_p]), torch.tensor([top_k])
+
+    class _SeededLogitsProcessor(LogitsProcessor):
+
+        def __call__(self, input_ids, scores):
+            token = sample(scores, *settings, generators=[generator])
+            chosen = torch.full_like(scores, float("-inf"))
+            chosen[0, token] = 0.0
+            return chosen
+
+    return _SeededLogitsProcessor()
+
+
+class Sequence:
+    """One generation request travelling through the batcher."""
+
+    def __init__(self, input_ids, max_new_tokens, temperature=0.7, top_p=0.9, context=None, top_k=0,
+                 seed=None, guide=None):
+        self.input_ids = [int(t) for t in input_ids]
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.generator = torch.Generator().manual_seed(seed) if seed is not None else None
+        self.guide = guide
+        self.context = context  # caller-owned state (response sender, detokenizer, ...)
+
+        self.cached_ids = []     # token IDs whose keys/values are in the batch cache
+        self.generated = 0
+        self.next_token = None
+        self.reused_tokens = 0
+        self.cancelled = False
+        self.stopped = False     # finished early by the caller (stop string)
+
+
+class ContinuousBatcher:
+
+    def __init__(self, model, eos_token_id, max_batch_size=8, on_token=None, on_finish=None,
+                 kv_cache=None):
+        self.model = model
+        self.eos_token_id = eos_token_id
+        self.max_batch_size = max_batch_size
+        self.on_token = on_token
+        self.on_finish = on_finish
+        self.kv_cache = kv_cache
+
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        # Running batch: row i of every tensor belongs to self._rows[i]
+        self._rows = []
+        self._layers = None  # [(keys [B,H,T,D], values [B,H,T,D]), ...]
+        self._mask = None    # [B, T], 0 for left padding
+
+        self._thread = threading.Thread(target=self._loop, name="cpu-batcher", daemon=True)
+        self._thread.start()
+
+    # --- public API ---
+
+    def submit(self, seq):
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Batcher is stopped")
+            self._pending.append(seq)
+            self._cond.notify()
+
+    def cancel(self, seq):
+        """Stop generating for ``seq``; safe to call from any thread."""
+        seq.cancelled = True
+
+    @property
+    def active(self):
+        return len(self._rows)
+
+    @property
+    def queued(self):
+        return len(self._pending)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    # --- scheduler ---
+
+    def _loop(self):
+        with torch.inference_mode():
+            while True:
+                with self._cond:
+                    while not self._stopped and not self._pending and not self._rows:
+                        self._cond.wait()
+                    if self._stopped and not self._pending and not self._rows:
+                        return
+                    joining = []
+                    while self._pending and len(self._rows) + len(joining) < self.max_batch_size:
+                        joining.append(self._pending.popleft())
+
+                for seq in joining:
+                    if seq.cancelled:
+                        self._finish(seq, None)
+                        continue
+                    try:
+                        self._prefill(seq)
+                    except Exception as e:
+                        self._finish(seq, e)
+
+                self._drop_cancelled()
+                if not self._rows:
+                    continue
+                try:
+                    self._step()
+                except Exception as e:
+                    rows, self._rows, self._layers, self._mask = self._rows, [], None, None
+                    for seq in rows:
+                        self._finish(seq, e)
+
+    def _prefill(self, seq):
+        past, reused = (None, 0)
+        if self.kv_cache is not None:
+            past, reused = self.kv_cache.take(seq.input_ids)
+        seq.reused_tokens = reused
+
+        input_ids = torch.tensor([seq.input_ids[reused:]], dtype=torch.long)
+        out = self.model(input_ids=input_ids, past_key_values=past, use_cache=True)
+        seq.cached_ids = list(seq.input_ids)
+
+        token = int(self._sample([seq], out.logits[:, -1, :])[0])
+        layers = cache_layers(out.past_key_values)
+        if self._accept(seq, token):
+            self._join(seq, layers)
+        else:
+            self._store(seq, layers)
+
+    def _accept(self, seq, token):
+        """Record a sampled token; False once the sequence is finished."""
+        if token == self.eos_token_id:
+            self._finish(seq, None)
+            return False
+        seq.generated += 1
+        seq.next_token = token
+        if seq.guide is not None:
+            seq.guide.accept(token)
+        if self.on_token is not None and self.on_token(seq, token) is False:
+            seq.cancelled = True
+        if seq.cancelled or seq.stopped or seq.generated >= seq.max_new_tokens:
+            self._finish(seq, None)
+            return False
+        return True
+
+    def _join(self, seq, layers):
+        """Append a prefilled sequence as a new row, left-padding to a common length."""
+        length = layers[0][0].shape[2]
+        mask = torch.ones((1, length), dtype=torch.long)
+        if self._layers is None:
+            self._rows, self._layers, self._mask = [seq], layers, mask
+            return
+
+        width = self._mask.shape[1]
+        if length < width:
+            layers = [(_pad_left(k, width - length), _pad_left(v, width - length)) for k, v in layers]
+            mask = torch.cat([torch.zeros((1, width - length), dtype=torch.long), mask], dim=1)
+        elif length > width:
+            self._layers = [(_pad_left(k, length - width), _pad_left(v, length - width)) for k, v in self._layers]
+            self._mask = torch.cat([torch.zeros((len(self._rows), length - width), dtype=torch.long), self._mask], dim=1)
+
+        self._layers = [(torch.cat([bk, k]), torch.cat([bv, v])) for (bk, bv), (k, v) in zip(self._layers, layers)]
+        self._mask = torch.cat([self._mask, mask])
+        self._rows.append(seq)
+
+    def _step(self):
+        rows = self._rows
+        input_ids = torch.tensor([[seq.next_token] for seq in rows], dtype=torch.long)
+        mask = torch.cat([self._mask, torch.ones((len(rows), 1), dtype=torch.long)], dim=1)
+        position_ids = mask.sum(dim=1, keepdim=True) - 1
+
+        out = self.model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids,
+                         past_key_values=build_cache(self._layers), use_cache=True)
+        self._layers = cache_layers(out.past_key_values)
+        self._mask = mask
+        for seq in rows:
+            seq.cached_ids.append(seq.next_token)
+
+        tokens = self._sample(rows, out.logits[:, -1, :]).tolist()
+
+        keep = [i for i, (seq, token) in enumerate(zip(rows, tokens)) if self._accept(seq, token)]
+        if len(keep) < len(rows):
+            for i in set(range(len(rows))) - set(keep):
+                self._store(rows[i], self._row_layers(i))
+            self._evict_rows(keep)
+
+    def _sample(self, rows, logits):
+        """Next token per row, after applying the rows' grammar masks."""
+        if any(seq.guide is not None for seq in rows):
+            logits = logits.float()
+            for i, seq in enumerate(rows):
+                if seq.guide is not None:
+                    seq.guide.mask(logits[i:i + 1])
+        generators = [seq.generator for seq in rows]
+        return sample(logits,
+                      torch.tensor([seq.temperature for seq in rows]),
+                      torch.tensor([seq.top_p for seq in rows]),
+                      torch.tensor([seq.top_k for seq in rows]),
+                      generators if any(g is not None for g in generators) else None)
+
+    def _drop_cancelled(self):
+        keep = [i for i, seq in enumerate(self._rows) if not seq.cancelled]
+        if len(keep) == len(self._rows):
+            return
+        dropped = [seq for seq in self._rows if seq.cancelled]
+        for i, seq in enumerate(self._rows):
+            if seq.cancelled:
+                self._store(seq, self._row_layers(i))
+        self._evict_rows(keep)
+        for seq in dropped:
+            self._finish(seq, None)
+
+    def _row_layers(self, i):
+        pad = int(self._mask.shape[1] - self._mask[i].sum())
+        return [(k[i:i + 1, :, pad:].clone(), v[i:i + 1, :, pad:].clone()) for k, v in self._layers]
+
+    def _evict_rows(self, keep):
+        if not keep:
+            self._rows, self._layers, self._mask = [], None, None
+            return
+        index = torch.tensor(keep, dtype=torch.long)
+        self._rows = [self._rows[i] for i in keep]
+        self._mask = self._mask.index_select(0, index)
+        # Drop padding columns no remaining row needs
+        start = int((self._mask.sum(dim=0) > 0).nonzero()[0])
+        self._mask = self._mask[:, start:]
+        self._layers = [(k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+                        for k, v in self._layers]
+
+    def _store(self, seq, layers):
+        if self.kv_cache is None:
+            return
+        try:
+            self.kv_cache.put(seq.cached_ids, build_cache(layers))
+        except Exception as e:
+            logger.warning("Could not store KV cache: %s", e)
+
+    def _finish(self, seq, error):
+        if self.on_finish is not None:
+            self.on_finish(seq, error)
+
+
+def _pad_left(tensor, amount):
+    shape = list(tensor.shape)
+    shape[2] = amount
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=2)
@@ -0,0 +1,61 @@
+"""Detecting client cancellation between generated tokens.
+
+When a Synaplan user closes the tab, Triton marks the request as
+cancelled but the backends keep generating until EOS or ``max_tokens``
+unless they ask. ``CancellationWatch`` polls ``is_cancelled()`` of the
+request's response sender; every poll is an IPC round trip to the Triton
+process, so it is rate limited to once per ``interval_ms`` and latches
+once the request is cancelled.
+"""
+import time
+
+from .config import get_parameter
+
+
+class CancellationWatch:
+
+    def __init__(self, is_cancelled, interval_ms=100, clock=time.monotonic):
+        self.is_cancelled = is_cancelled
+        self.interval = interval_ms / 1000.0
+        self.clock = clock
+        self.cancelled = False
+        self._next_check = 0.0
+
+    def __call__(self):
+        """True once the client has cancelled (checks at most every ``interval_ms``)."""
+        if self.cancelled or self.is_cancelled is None:
+            return self.cancelled
+        now = self.clock()
+        if now >= self._next_check:
+            self._next_check = now + self.interval
+            try:
+                self.cancelled = bool(self.is_cancelled())
+            except Exception:
+                self.is_cancelled = None  # not supported by this Triton version
+        return self.cancelled
+
+
+def stopping_criteria(watch):
+    """A transformers ``StoppingCriteria`` that ends ``generate()`` once ``watch()`` is True."""
+    import torch
+    from transformers import StoppingCriteria
+
+    class _CancelledCriteria(StoppingCriteria):
+
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), watch(), dtype=torch.bool, device=input_ids.device)
+
+    return _CancelledCriteria()
+
+
+def from_model_config(model_config, clock=time.monotonic):
+    """Build a watch factory from the ``cancel_check_interval_ms`` parameter.
+
+    The factory takes a response sender (or anything with ``is_cancelled``).
+    """
+    interval_ms = get_parameter(model_config, "cancel_check_interval_ms", 100.0, float)
+
+    def factory(sender):
+        return CancellationWatch(getattr(sender, "is_cancelled", None), interval_ms, clock)
+
+    return factory
@@ -0,0 +1,88 @@
+"""Coalescing of decoded text deltas into fewer streamed responses.
+
+Sending one ``InferenceResponse`` per token costs a message through
+Triton's response path and the gRPC/HTTP stream for every few bytes of
+text. ``ChunkCoalescer`` buffers deltas and releases them as one chunk
+when the first of these is reached:
+
+* ``max_tokens`` tokens are buffered
+* the oldest buffered delta is ``max_delay_ms`` old (checked as tokens
+  arrive; there is no timer thread)
+* a delta contains a newline (``on_newline``)
+* a delta ends a sentence (``on_sentence``)
+
+The first text of a stream is sent right away so time-to-first-token is
+unaffected. Whitespace-only buffers are never sent on their own
+mid-stream; they are prepended to the next text, as the backends'
+``pending_ws`` handling did before. With ``max_tokens=1`` every other
+delta is sent immediately.
+"""
+import time
+
+from .config import get_parameter
+
+SENTENCE_ENDINGS = (".", "!", "?", ":", ";")
+
+
+class ChunkCoalescer:
+
+    def __init__(self, max_tokens=1, max_delay_ms=0, on_newline=True, on_sentence=True, clock=time.perf_counter):
+        self.max_tokens = max(1, max_tokens)
+        self.max_delay = max_delay_ms / 1000.0 if max_delay_ms > 0 else None
+        self.on_newline = on_newline
+        self.on_sentence = on_sentence
+        self.clock = clock
+
+        self._parts = []
+        self._tokens = 0
+        self._since = None
+        self._started = False
+
+    def add(self, text, tokens=1):
+        """Buffer a delta; return the chunk to send now, or None."""
+        self._tokens += tokens
+        if not text:
+            return self._due_by_time()
+        if self._since is None:
+            self._since = self.clock()
+        self._parts.append(text)
+
+        if "\n" in text or "\r" in text:
+            if self.on_newline:
+                return self.flush()
+        elif text.isspace():
+            return None
+        if self._tokens >= self.max_tokens or not self._started:
+            return self.flush()
+        if self.on_sentence and text.rstrip().endswith(SENTENCE_ENDINGS):
+            return self.flush()
+        return self._due_by_time()
+
+    def _due_by_time(self):
+        if self.max_delay is None or self._since is None or self.clock() - self._since < self.max_delay:
+            return None
+        if "".join(self._parts).isspace():
+            return None
+        return self.flush()
+
+    def flush(self):
+        """Return everything buffered (possibly ``""``) and reset."""
+        chunk = "".join(self._parts)
+        self._started = self._started or bool(chunk)
+        self._parts.clear()
+        self._tokens = 0
+        self._since = None
+        return chunk
+
+
+def from_model_config(model_config, clock=time.perf_counter):
+    """Build a coalescer factory from the ``flush_*`` model parameters."""
+    max_tokens = get_parameter(model_config, "flush_max_tokens", 1, int)
+    max_delay_ms = get_parameter(model_config, "flush_max_delay_ms", 0.0, float)
+    on_newline = get_parameter(model_config, "flush_on_newline", True, bool)
+    on_sentence = get_parameter(model_config, "flush_on_sentence", True, bool)
+
+    def factory():
+        return ChunkCoalescer(max_tokens, max_delay_ms, on_newline, on_sentence, clock)
+
+    return factory
@@ -0,0 +1,30 @@
+"""Access to ``parameters`` entries of a model's ``config.pbtxt``."""
+import os
+
+
+def get_parameter(model_config, key, default=None, cast=str):
+    """Return ``parameters[key].string_value`` converted with ``cast``.
+
+    Missing keys, empty values and unsubstituted ``${...}`` placeholders
+    fall back to ``default``.
+    """
+    value = model_config.get("parameters", {}).get(key, {}).get("string_value")
+    if value is None or value == "" or value.startswith("${"):
+        return default
+    if cast is bool:
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return cast(value)
+
+
+def get_setting(model_config, key, env, default=None, cast=str):
+    """``get_parameter`` falling back to the environment variable ``env``.
+
+    Lets chart values reach Python backends whose ``config.pbtxt`` keeps a
+    ``${...}`` placeholder (nothing substitutes it in CPU mode).
+    """
+    value = get_parameter(model_config, key, None, cast)
+    if value is not None:
+        return value
+    if env in os.environ:
+        return get_parameter({"parameters": {key: {"string_value": os.environ[env]}}}, key, default, cast)
+    return default
@@ -0,0 +1,237 @@
+"""CPU partitions for multi-instance ``mistral-cpu``: affinity and torch thread counts.
+
+Triton runs each instance of a Python model in its own process. Left
+alone, every instance starts as many intra-op threads as the machine has
+cores. On a 2-socket node one instance then spreads over both sockets
+(every GEMM reads weights and KV cache across the interconnect), and a
+second instance doubles the thread count on the same cores.
+``from_model_config`` splits the CPUs the pod may use into one partition
+per instance (``instance_group`` count) and pins the calling instance to
+its own partition:
+
+* ``numa`` - partitions do not cross NUMA nodes (with two nodes and two
+  instances, one socket each; with four instances, half a socket each;
+  with three, the first node is split in two). Only fewer instances than
+  nodes that do not divide them evenly get node-spanning partitions.
+* ``cores`` - the CPUs are split in order, ignoring NUMA nodes
+* ``off`` - no affinity; only the thread counts are set
+
+Partitions are made of whole physical cores (SMT siblings stay together)
+and the instance runs one intra-op thread per physical core, capped by
+the pod's CPU limit (cgroup quota) divided by the instance count. The
+pinning happens before the weights are loaded, so memory first touched
+by the instance (bf16 weights, KV cache, activations) is allocated on its
+own node. Memory-mapped int8/int4 weights are shared page cache and stay
+where they were first read.
+
+Each instance claims its partition index with a lock file, preferring the
+index of its Triton instance name; a process that exits releases it.
+"""
+import fcntl
+import logging
+import math
+import os
+import tempfile
+
+from .config import get_setting
+
+logger = logging.getLogger(__name__)
+
+PINNING_MODES = ("off", "cores", "numa")
+NODE_ROOT = "/sys/devices/system/node"
+CPU_ROOT = "/sys/devices/system/cpu"
+
+
+def parse_cpulist(text):
+    """``"0-3,8-11"`` -> ``[0, 1, 2, 3, 8, 9, 10, 11]``."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus():
+    return sorted(os.sched_getaffinity(0))
+
+
+def numa_nodes(cpus):
+    """The CPUs of each NUMA node that are in ``cpus``, in node order (one node if unknown)."""
+    allowed = set(cpus)
+    nodes = []
+    names = sorted((n for n in os.listdir(NODE_ROOT) if n[4:].isdigit()), key=lambda n: int(n[4:])) \
+        if os.path.isdir(NODE_ROOT) else []
+    for name in names:
+        node = [c for c in parse_cpulist(_read(os.path.join(NODE_ROOT, name, "cpulist")) or "") if c in allowed]
+        if node:
+            nodes.append(node)
+    return nodes or [sorted(allowed)]
+
+
+def physical_cores(cpus):
+    """Group ``cpus`` by physical core (SMT siblings together), in order of their first CPU."""
+    allowed, seen, cores = set(cpus), set(), []
+    for cpu in cpus:
+        if cpu in seen:
+            continue
+        siblings = _read(os.path.join(CPU_ROOT, f"cpu{cpu}", "topology", "thread_siblings_list"))
+        core = [c for c in parse_cpulist(siblings) if c in allowed] if siblings else [cpu]
+        core = core if cpu in core else [cpu]
+        seen.update(core)
+        cores.append(core)
+    return cores
+
+
+def cpu_quota():
+    """CPUs the cgroup may use (``cpu.max`` / CFS quota), or None without a limit."""
+    value = _read("/sys/fs/cgroup/cpu.max")
+    if value:
+        quota, _, period = value.partition(" ")
+        return None if quota == "max" else int(quota) / int(period or 100000)
+    quota = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def split(items, count):
+    """``count`` contiguous, near-equal chunks of ``items`` (shared items if there are fewer than ``count``)."""
+    if len(items) < count:
+        return [[items[i % len(items)]] for i in range(count)]
+    bounds = [round(i * len(items) / count) for i in range(count + 1)]
+    return [items[bounds[i]:bounds[i + 1]] for i in range(count)]
+
+
+def partitions(count, mode, cpus=None):
+    """``count`` lists of physical cores (each a list of logical CPUs) for ``mode`` ``cores`` / ``numa``."""
+    cpus = available_cpus() if cpus is None else cpus
+    nodes = [physical_cores(node) for node in numa_nodes(cpus)] if mode == "numa" else [physical_cores(cpus)]
+    if len(nodes) > 1 and count >= len(nodes):
+        # Instances spread over the nodes (the first nodes take the remainder), each node split on its own
+        per_node = [count // len(nodes) + (i < count % len(nodes)) for i in range(len(nodes))]
+        return [part for node, n in zip(nodes, per_node) for part in split(node, n)]
+    if len(nodes) > 1 and len(nodes) % count == 0:
+        # Several nodes per instance: whole nodes
+        return [[core for node in group for core in node] for group in split(nodes, count)]
+    return split([core for node in nodes for core in node], count)
+
+
+class Placement:
+    """The partition of one instance and the thread counts it runs with."""
+
+    def __init__(self, index, count, mode, cpus, threads, interop_threads):
+        self.index = index
+        self.count = count
+        self.mode = mode
+        self.cpus = cpus  # None = no affinity
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self._lock = None
+
+    def apply(self):
+        """Pin every thread of this process to the partition and set torch's thread pools."""
+        import torch
+
+        if self.cpus is not None:
+            for tid in os.listdir("/proc/self/task"):  # threads started before us (Triton stub) as well
+                try:
+                    os.sched_setaffinity(int(tid), self.cpus)
+                except OSError as e:
+                    logger.debug("Could not pin thread %s: %s", tid, e)
+        torch.set_num_threads(self.threads)
+        if self.interop_threads:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError as e:  # only possible before the first inter-op parallel work
+                logger.warning("⚠️ Inter-op threads not set: %s", e)
+        return self
+
+    def describe(self):
+        where = f"CPUs {_cpulist(self.cpus)}" if self.cpus is not None else "no affinity"
+        return (f"instance {self.index + 1}/{self.count}, {self.mode}: {where}, {self.threads} intra-op / "
+                f"{self.interop_threads or 'default'} inter-op threads")
+
+
+def _cpulist(cpus):
+    """``[0, 1, 2, 5]`` -> ``"0-2,5"``."""
+    ranges, start, prev = [], None, None
+    for cpu in sorted(cpus):
+        if start is None:
+            start = prev = cpu
+        elif cpu == prev + 1:
+            prev = cpu
+        else:
+            ranges.append(f"{start}-{prev}" if prev > start else str(start))
+            start = prev = cpu
+    if start is not None:
+        ranges.append(f"{start}-{prev}" if prev > start else str(start))
+    return ",".join(ranges)
+
+
+def instance_count(model_config):
+    return sum(int(group.get("count", 1)) for group in model_config.get("instance_group", [])) or 1
+
+
+def claim_index(count, preferred, name, lock_dir=None):
+    """Lock a partition index (``preferred`` first) -> ``(index, lock file)``; ``(preferred, None)`` if all are taken."""
+    lock_dir = lock_dir or tempfile.gettempdir()
+    for index in [preferred] + [i for i in range(count) if i != preferred]:
+        f = open(os.path.join(lock_dir, f"synaplan-{name}-cpu-{index}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return index, f
+        except OSError:
+            f.close()
+    return preferred, None  # e.g. while Triton reloads the model next to its old instances
+
+
+def _instance_index(instance_name, count):
+    """Trailing number of a Triton instance name (``mistral-cpu_0_1`` -> 1)."""
+    suffix = instance_name.rsplit("_", 1)[-1] if instance_name else ""
+    return int(suffix) % count if suffix.isdigit() else 0
+
+
+def from_model_config(model_config, instance_name=""):
+    """The ``Placement`` of this instance from the ``cpu_*`` parameters, applied; None if left to defaults.
+
+    ``cpu_pinning`` (``off`` / ``cores`` / ``numa``), ``cpu_threads`` (0 =
+    physical cores of the partition) and ``cpu_interop_threads`` fall back
+    to the ``SYNAPLAN_CPU_*`` environment variables.
+    """
+    mode = get_setting(model_config, "cpu_pinning", "SYNAPLAN_CPU_PINNING", "off")
+    threads = get_setting(model_config, "cpu_threads", "SYNAPLAN_CPU_THREADS", 0, int)
+    interop_threads = get_setting(model_config, "cpu_interop_threads", "SYNAPLAN_CPU_INTEROP_THREADS", 0, int)
+    if mode not in PINNING_MODES:
+        raise ValueError(f"cpu_pinning must be one of {PINNING_MODES}, got {mode!r}")
+    count = instance_count(model_config)
+    if mode == "off" and count == 1 and not threads and not interop_threads:
+        return None  # torch defaults, as before
+
+    name = model_config.get("name", "model")
+    index, lock = claim_index(count, _instance_index(instance_name, count), name)
+    if lock is None:
+        logger.info("ℹ️ All %d CPU partitions are claimed, sharing partition %d", count, index)
+
+    cpus = available_cpus()
+    quota = cpu_quota()
+    if mode == "off":
+        pinned, cores = None, len(physical_cores(cpus)) / count
+    else:
+        part = partitions(count, mode, cpus)[index]
+        pinned, cores = sorted(c for core in part for c in core), len(part)
+    if quota is not None:
+        cores = min(cores, quota / count)
+    placement = Placement(index, count, mode, pinned, threads or max(1, math.floor(cores)), interop_threads)
+    placement._lock = lock  # held for the life of the instance
+    return placement.apply()
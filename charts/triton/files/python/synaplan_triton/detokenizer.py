@@ -0,0 +1,115 @@
+"""Incremental detokenization for streaming token IDs.
+
+Re-decoding ``prompt_ids + generated_tokens`` after every token costs
+O(prompt + output) per step, i.e. quadratic per stream. The detokenizer
+below only ever decodes a short trailing window bounded by a *prefix
+offset* (start of the context used to get SentencePiece spacing right)
+and a *read offset* (everything before it has already been emitted).
+"""
+
+# Number of trailing prompt tokens used as decode context for the first
+# generated token. A handful is enough to reproduce the boundary space
+# SentencePiece attaches to the first word.
+INITIAL_CONTEXT_TOKENS = 5
+
+REPLACEMENT_CHAR = "\ufffd"
+
+
+class IncrementalDetokenizer:
+    """Turns a stream of token IDs into text deltas in O(1) per token.
+
+    Usage::
+
+        detok = IncrementalDetokenizer(tokenizer, prompt_ids)
+        for token_id in stream:
+            chunk = detok.step(token_id)
+        chunk = detok.flush()
+
+    ``step`` returns ``""`` while the tail of the window decodes to an
+    incomplete UTF-8 sequence (a byte-fallback token split across steps);
+    the held bytes are emitted as soon as they form a complete character.
+    """
+
+    def __init__(self, tokenizer, prompt_ids, strip_leading_space=True,
+                 skip_special_tokens=True):
+        self.tokenizer = tokenizer
+        self.strip_leading_space = strip_leading_space
+        self.skip_special_tokens = skip_special_tokens
+
+        self._tokens = [int(t) for t in list(prompt_ids)[-INITIAL_CONTEXT_TOKENS:]]
+        self._prefix_offset = 0
+        self._read_offset = len(self._tokens)
+        self._emitted_any = False
+        self.token_count = 0
+
+    def _decode(self, token_ids):
+        return self.tokenizer.decode(
+            token_ids,
+            skip_special_tokens=self.skip_special_tokens,
+            clean_up_tokenization_spaces=False,
+            spaces_between_special_tokens=False,
+        )
+
+    def _delta(self, allow_partial):
+        prefix_text = self._decode(self._tokens[self._prefix_offset:self._read_offset])
+        new_text = self._decode(self._tokens[self._prefix_offset:])
+
+        if len(new_text) <= len(prefix_text):
+            return ""
+        if new_text.endswith(REPLACEMENT_CHAR) and not allow_partial:
+            # Incomplete UTF-8 sequence: hold the bytes until the next token
+            return ""
+
+        chunk = new_text[len(prefix_text):]
+
+        # Slide the window forward and drop tokens that no longer matter
+        self._tokens = self._tokens[self._read_offset:]
+        self._prefix_offset = 0
+        self._read_offset = len(self._tokens)
+
+        # Strip exactly one leading space on the first emitted chunk (SentencePiece boundary quirk)
+        if not self._emitted_any:
+            self._emitted_any = True
+            if self.strip_leading_space and chunk[:1] == " ":
+                chunk = chunk[1:]
+        return chunk
+
+    def step(self, token_id):
+        """Append one generated token and return the newly decodable text."""
+        self._tokens.append(int(token_id))
+        self.token_count += 1
+        return self._delta(allow_partial=False)
+
+    def flush(self):
+        """Return any text still held back (e.g. a dangling partial character)."""
+        if self._read_offset >= len(self._tokens):
+            return ""
+        return self._delta(allow_partial=True)
+
+
+def text_streamer(tokenizer, **decode_kwargs):
+    """A transformers ``TextIteratorStreamer`` that yields ``(text, token count)`` per ``generate()`` step.
+
+    The plain streamer yields whole words, so its items cannot be
+    counted as tokens; here each item also carries how many token IDs
+    the step produced (several per step with speculative decoding, 0
+    for the flush at the end). The prompt is skipped.
+    """
+    from transformers import TextIteratorStreamer
+
+    class _CountingStreamer(TextIteratorStreamer):
+
+        def put(self, value):
+            self._step_tokens = 0 if self.next_tokens_are_prompt else value.shape[-1]
+            super().put(value)
+
+        def end(self):
+            self._step_tokens = 0
+            super().end()
+
+        def on_finalized_text(self, text, stream_end=False):
+            self.text_queue.put((text, self._step_tokens), timeout=self.timeout)
+            if stream_end:
+                self.text_queue.put(self.stop_signal, timeout=self.timeout)
+
+    return _CountingStreamer(tokenizer, skip_prompt=True, **decode_kwargs)
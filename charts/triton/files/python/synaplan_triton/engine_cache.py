@@ -0,0 +1,208 @@
+"""Build manifest of TensorRT-LLM engines, keyed by what the engine is built from.
+
+``build-models.sh`` writes ``build-manifest.json`` next to ``rank0.engine``:
+
+* ``key`` - SHA-256 over the content digests of the weights directory,
+  the precision, the engine ID (GPU arch, CUDA, TRT-LLM version) and the
+  ``convert_checkpoint.py`` / ``trtllm-build`` arguments
+* the inputs of the key, so a rebuild can be explained from the log
+* ``timings`` - seconds per build stage (hash, convert, build, ...)
+
+An engine is rebuilt only when the key changes. Hashing a 7B checkpoint
+reads about 15 GB, so digests are cached per file (keyed by size and
+mtime) in ``--digest-cache`` and a file is read again only after it was
+replaced.
+
+Command line (used by ``build-models.sh``)::
+
+    python3 -m synaplan_triton.engine_cache key WEIGHTS_DIR --precision P --engine-id ID \\
+        --digest-cache FILE -- ARGS...          # prints the key
+    python3 -m synaplan_triton.engine_cache check ENGINE_DIR KEY     # exit 0 if current
+    python3 -m synaplan_triton.engine_cache manifest ENGINE_DIR --key KEY ... --timings FILE -- ARGS...
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "build-manifest.json"
+ENGINE_FILE = "rank0.engine"
+CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def weight_files(weights_dir):
+    """Relative paths of the files in ``weights_dir``, without hidden files (download markers, caches)."""
+    files = []
+    for root, dirs, names in os.walk(weights_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(names):
+            if not name.startswith("."):
+                files.append(os.path.relpath(os.path.join(root, name), weights_dir))
+    return files
+
+
+def weight_digests(weights_dir, cache_path=None, workers=4):
+    """``{relative path: sha256}`` of the weights; unchanged files reuse the digest in ``cache_path``."""
+    cached = {}
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+
+    digests, stale, stats = {}, [], {}
+    for name in weight_files(weights_dir):
+        st = os.stat(os.path.join(weights_dir, name))
+        stats[name] = [st.st_size, st.st_mtime_ns]
+        entry = cached.get(name)
+        if entry and entry[:2] == stats[name]:
+            digests[name] = entry[2]
+        else:
+            stale.append(name)
+
+    if stale:
+        # hashlib releases the GIL, so large shards hash in parallel
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for name, digest in zip(stale, pool.map(_sha256, [os.path.join(weights_dir, n) for n in stale])):
+                digests[name] = digest
+        if cache_path:
+            _write_json(cache_path, {name: stats[name] + [digests[name]] for name in sorted(digests)})
+    return dict(sorted(digests.items()))
+
+
+def build_key(digests, precision, engine_id, args):
+    """Hex key of an engine built from ``digests`` with ``precision`` on ``engine_id`` with ``args``."""
+    payload = json.dumps({"format": FORMAT_VERSION, "weights": digests, "precision": precision,
+                          "engine_id": engine_id, "args": list(args)}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def read_manifest(engine_dir):
+    """The engine's manifest, or None if it has none (or an unreadable one)."""
+    try:
+        with open(os.path.join(engine_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(engine_dir, key):
+    manifest = read_manifest(engine_dir)
+    return (manifest is not None and manifest.get("key") == key
+            and os.path.exists(os.path.join(engine_dir, ENGINE_FILE)))
+
+
+def engine_identity(engine_dir):
+    """The build key of ``engine_dir``, else name, size and mtime of its engine files; None without an engine."""
+    manifest = read_manifest(engine_dir)
+    if manifest is not None and manifest.get("key"):
+        return manifest["key"]
+    try:
+        return [[name, st.st_size, st.st_mtime_ns] for name, st in
+                ((name, os.stat(os.path.join(engine_dir, name))) for name in (ENGINE_FILE, "config.json"))]
+    except OSError:
+        return None
+
+
+def read_timings(path):
+    """``{stage: seconds}`` from the ``<stage> <milliseconds>`` lines ``build-models.sh`` appends."""
+    timings = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                stage, _, ms = line.strip().partition(" ")
+                if stage and ms:
+                    timings[stage] = timings.get(stage, 0.0) + int(ms) / 1000.0
+    return timings
+
+
+def _write_json(path, data):
+    """Write ``path`` through a temporary file and a rename, so readers never see half of it."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_manifest(engine_dir, key, model, precision, engine_id, args, digests=None, timings=None):
+    manifest = {
+        "format": FORMAT_VERSION,
+        "key": key,
+        "model": model,
+        "precision": precision,
+        "engine_id": engine_id,
+        "args": list(args),
+        "weights": digests or {},
+        "timings": timings or {},
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    _write_json(os.path.join(engine_dir, MANIFEST_FILE), manifest)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Content-keyed build manifest of TensorRT-LLM engines.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    key = sub.add_parser("key", help="print the build key")
+    key.add_argument("weights_dir")
+    key.add_argument("--precision", required=True)
+    key.add_argument("--engine-id", required=True)
+    key.add_argument("--digest-cache", help="JSON file caching per-file digests by size and mtime")
+
+    check = sub.add_parser("check", help="exit 0 if engine_dir was built with key")
+    check.add_argument("engine_dir")
+    check.add_argument("key")
+
+    manifest = sub.add_parser("manifest", help="write build-manifest.json into engine_dir")
+    manifest.add_argument("engine_dir")
+    manifest.add_argument("--key", required=True)
+    manifest.add_argument("--model", required=True)
+    manifest.add_argument("--precision", required=True)
+    manifest.add_argument("--engine-id", required=True)
+    manifest.add_argument("--weights-dir", help="record the weight digests (from --digest-cache)")
+    manifest.add_argument("--digest-cache")
+    manifest.add_argument("--timings", help="file of '<stage> <milliseconds>' lines")
+
+    # convert_checkpoint.py / trtllm-build arguments follow "--" (argparse would parse them as options)
+    argv = list(sys.argv[1:] if argv is None else argv)
+    build_args = argv[argv.index("--") + 1:] if "--" in argv else []
+    args = parser.parse_args(argv[:argv.index("--")] if "--" in argv else argv)
+    args.args = build_args
+    if args.command == "key":
+        digests = weight_digests(args.weights_dir, args.digest_cache)
+        print(build_key(digests, args.precision, args.engine_id, args.args))
+        return 0
+    if args.command == "check":
+        return 0 if is_current(args.engine_dir, args.key) else 1
+
+    digests = weight_digests(args.weights_dir, args.digest_cache) if args.weights_dir else None
+    written = write_manifest(args.engine_dir, args.key, args.model, args.precision, args.engine_id, args.args,
+                             digests, read_timings(args.timings))
+    stages = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in written["timings"].items())
+    print(f"Manifest {written['key'][:12]} written to {args.engine_dir}" + (f" ({stages})" if stages else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Guided (structured) decoding for ``mistral-cpu`` with xgrammar.
+
+The GPU path hands ``guided_decoding_guide_type`` / ``guided_decoding_guide``
+to TRT-LLM, which runs xgrammar inside the engine. On CPU the same
+grammars are compiled here and applied as a token mask before sampling:
+``Guide.mask`` sets the logits of every token the grammar cannot accept
+next to ``-inf`` and ``Guide.accept`` advances the matcher with the
+sampled token, so the output is valid JSON / matches the regex or
+grammar without a retry loop. Once the grammar is complete only the
+stop tokens remain allowed and generation ends with EOS.
+
+``xgrammar`` is imported on the first guided request; the Triton Python
+image does not ship it (``pip install xgrammar``). Without it, guided
+requests fail with an error and all other requests are unaffected.
+Compiled grammars are cached by xgrammar's ``GrammarCompiler``, so a
+schema that is sent with every request is only compiled once.
+"""
+import threading
+
+from .config import get_parameter
+
+
+class Guide:
+    """Grammar state of one request."""
+
+    def __init__(self, xgr, compiled, vocab_size):
+        self._xgr = xgr
+        self.matcher = xgr.GrammarMatcher(compiled)
+        self.vocab_size = vocab_size
+        self.bitmask = xgr.allocate_token_bitmask(1, vocab_size)
+
+    def mask(self, logits):
+        """Mask a ``[1, vocab]`` float logits row in place to the tokens the grammar allows next."""
+        self.matcher.fill_next_token_bitmask(self.bitmask)
+        self._xgr.apply_token_bitmask_inplace(logits, self.bitmask, vocab_size=self.vocab_size)
+        return logits
+
+    def accept(self, token):
+        return self.matcher.accept_token(int(token))
+
+    @property
+    def terminated(self):
+        return self.matcher.is_terminated()
+
+
+class GuideCompiler:
+    """Compiles ``SamplingParams`` guides into ``Guide`` objects (lazily imports xgrammar)."""
+
+    def __init__(self, tokenizer, vocab_size, weights_dir=None, cache_limit_bytes=64 * 1024 ** 2):
+        self.tokenizer = tokenizer
+        self.vocab_size = vocab_size
+        self.weights_dir = weights_dir
+        self.cache_limit_bytes = cache_limit_bytes
+        self._xgr = None
+        self._compiler = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._compiler is None:
+                import xgrammar
+
+                tokenizer = self.tokenizer
+                if not hasattr(tokenizer, "get_vocab"):  # FastTokenizer: xgrammar needs the HF tokenizer
+                    from .tokenizer import load_auto_tokenizer
+                    tokenizer = load_auto_tokenizer(self.weights_dir)
+                info = xgrammar.TokenizerInfo.from_huggingface(tokenizer, vocab_size=self.vocab_size)
+                self._compiler = xgrammar.GrammarCompiler(info, cache_limit_bytes=self.cache_limit_bytes)
+                self._xgr = xgrammar
+        return self._compiler
+
+    def compile(self, guide_type, guide=None):
+        compiler = self._load()
+        if guide_type == "json":
+            return compiler.compile_builtin_json_grammar()
+        if guide_type == "json_schema":
+            return compiler.compile_json_schema(guide)
+        if guide_type == "regex":
+            return compiler.compile_regex(guide)
+        if guide_type == "ebnf_grammar":
+            return compiler.compile_grammar(guide)
+        raise ValueError(f"Unknown guided_decoding_guide_type {guide_type!r}")
+
+    def new_guide(self, params):
+        """A ``Guide`` for ``params`` (a ``SamplingParams``), or None without a guide."""
+        if params.guide_type is None:
+            return None
+        compiled = self.compile(params.guide_type, params.guide)
+        return Guide(self._xgr, compiled, self.vocab_size)
+
+
+def logits_processor(guide):
+    """A transformers ``LogitsProcessor`` that applies ``guide`` in ``generate()`` (batch size 1)."""
+    from transformers import LogitsProcessor
+
+    class _GuideLogitsProcessor(LogitsProcessor):
+
+        def __init__(self):
+            self.started = False
+
+        def __call__(self, input_ids, scores):
+            if self.started:  # the token sampled after the previous call
+                guide.accept(input_ids[0, -1])
+            self.started = True
+            return guide.mask(scores.float())
+
+    return _GuideLogitsProcessor()
+
+
+def from_model_config(model_config, tokenizer, vocab_size):
+    """Build the compiler from the ``guided_decoding_*`` parameters (None if disabled)."""
+    if not get_parameter(model_config, "guided_decoding_enabled", True, bool):
+        return None
+    return GuideCompiler(
+        tokenizer,
+        vocab_size,
+        weights_dir=get_parameter(model_config, "weights_dir", "/cache/weights/mistral-7b-instruct-v0.3"),
+        cache_limit_bytes=get_parameter(model_config, "guided_decoding_cache_bytes", 64 * 1024 ** 2, int),
+    )
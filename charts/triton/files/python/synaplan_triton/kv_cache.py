@@ -0,0 +1,219 @@
+"""Cross-turn reuse of ``past_key_values`` for the PyTorch CPU backend.
+
+After a generation the backend stores the model's KV cache together with
+the token IDs it covers. When the next turn of the same conversation
+arrives its prompt starts with (almost) the same tokens, so the stored
+cache is cropped to the longest common prefix and handed to
+``model.generate``; only the remaining tokens go through prefill.
+
+An entry is *taken* out of the store on reuse (``generate`` extends the
+cache in place) and the extended cache is stored again afterwards, so one
+conversation occupies a single entry. Entries expire after ``ttl_seconds``
+and the least recently used ones are evicted beyond ``max_bytes``.
+
+Lookups do not scan the entries: every entry is indexed under chained
+digests of its first 16, 32, 48, ... tokens, so ``take`` hashes the prompt
+block by block until a prefix is unknown, then compares only the entries
+sharing the longest known prefix to find where they diverge inside the
+next block. Prefixes shorter than one block are not reused. With the
+default ``min_reuse_tokens`` of 16 they would not be reused anyway.
+Hits, reused tokens and the memory held are published as
+``synaplan_llm_kv_cache_*`` metrics.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from .config import get_parameter
+
+
+def cache_nbytes(cache):
+    """Approximate memory held by a transformers KV cache object."""
+    layers = getattr(cache, "layers", None)
+    if layers is not None:  # transformers >= 4.54
+        tensors = [t for layer in layers for t in (getattr(layer, "keys", None), getattr(layer, "values", None))]
+    elif hasattr(cache, "key_cache"):
+        tensors = list(cache.key_cache) + list(cache.value_cache)
+    else:  # legacy tuple-of-tuples format
+        tensors = [t for layer in cache for t in layer]
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None and hasattr(t, "numel"))
+
+
+BLOCK_TOKENS = 16
+
+
+def common_prefix_length(a, b, start=0):
+    """Length of the common prefix of ``a`` and ``b``, which are known to agree up to ``start``."""
+    n = min(len(a), len(b))
+    i = start
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def block_digests(token_ids, block=BLOCK_TOKENS):
+    """Chained digests of ``token_ids[:block]``, ``token_ids[:2 * block]``, ... (whole blocks only, lazily)."""
+    h = hashlib.sha1()
+    for end in range(block, len(token_ids) + 1, block):
+        h.update(",".join(map(str, token_ids[end - block:end])).encode("ascii") + b";")
+        yield h.digest()
+
+
+def _digest(token_ids):
+    return hashlib.sha1(",".join(map(str, token_ids)).encode("ascii")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("token_ids", "cache", "nbytes", "last_used", "blocks")
+
+    def __init__(self, token_ids, cache, nbytes):
+        self.token_ids = token_ids
+        self.cache = cache
+        self.nbytes = nbytes
+        self.last_used = time.monotonic()
+        self.blocks = list(block_digests(token_ids))
+
+
+class KVCacheStore:
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, ttl_seconds=600.0, min_reuse_tokens=16, metrics=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.min_reuse_tokens = min_reuse_tokens
+        self.metrics = metrics
+
+        self._entries = OrderedDict()  # digest(token_ids) -> _Entry, least recently stored first
+        self._prefixes = {}  # block digest -> {digest(token_ids) of the entries starting with that prefix}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.prefill_tokens = 0
+
+    def _drop(self, digest):
+        entry = self._entries.pop(digest)
+        self._bytes -= entry.nbytes
+        for block in entry.blocks:
+            owners = self._prefixes[block]
+            owners.discard(digest)
+            if not owners:
+                del self._prefixes[block]
+        return entry
+
+    def _expire(self):
+        # Entries are stored (and re-stored after reuse) in order, so the expired ones come first
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            digest, entry = next(iter(self._entries.items()))
+            if entry.last_used >= deadline:
+                break
+            self._drop(digest)
+
+    def _longest_prefix(self, input_ids):
+        """``(digest, common prefix length)`` of the entry sharing the longest prefix with ``input_ids``."""
+        owners, matched = None, 0
+        for block in block_digests(input_ids):
+            found = self._prefixes.get(block)
+            if found is None:
+                break
+            owners, matched = found, matched + BLOCK_TOKENS
+        if owners is None:
+            return None, 0
+        # All owners agree on the matched blocks; they may diverge inside the next one
+        return max(((d, common_prefix_length(self._entries[d].token_ids, input_ids, matched)) for d in owners),
+                   key=lambda item: item[1])
+
+    def _publish(self, hit, reused, prefill):
+        """Called without the lock: metric updates are IPC round trips."""
+        if self.metrics is None:
+            return
+        self.metrics.increment("kv_cache_hits_total" if hit else "kv_cache_misses_total")
+        if reused:
+            self.metrics.increment("kv_cache_reused_tokens_total", reused)
+        self.metrics.increment("kv_cache_prefill_tokens_total", prefill)
+        self._publish_size()
+
+    def _publish_size(self):
+        if self.metrics is not None:
+            self.metrics.set("kv_cache_bytes", self._bytes)
+            self.metrics.set("kv_cache_entries", len(self._entries))
+
+    def take(self, input_ids):
+        """Pop the best cache for ``input_ids`` -> ``(cache, reused_tokens)``.
+
+        Returns ``(None, 0)`` on a miss. The returned cache has been cropped
+        so at least one input token is left for prefill.
+        """
+        input_ids = list(input_ids)
+        with self._lock:
+            self._expire()
+            best, best_len = self._longest_prefix(input_ids)
+            best_len = min(best_len, len(input_ids) - 1)
+
+            if best is None or best_len < self.min_reuse_tokens:
+                self.misses += 1
+                self.prefill_tokens += len(input_ids)
+                entry = None
+            else:
+                entry = self._drop(best)
+                self.hits += 1
+                self.reused_tokens += best_len
+                self.prefill_tokens += len(input_ids) - best_len
+
+        if entry is None:
+            self._publish(False, 0, len(input_ids))
+            return None, 0
+        self._publish(True, best_len, len(input_ids) - best_len)
+        if best_len < len(entry.token_ids):
+            entry.cache.crop(best_len - len(entry.token_ids))  # negative: drop that many tokens
+        return entry.cache, best_len
+
+    def put(self, token_ids, cache):
+        """Store ``cache``, which holds keys/values for ``token_ids``."""
+        token_ids = tuple(int(t) for t in token_ids)
+        nbytes = cache_nbytes(cache)
+        if nbytes > self.max_bytes:
+            return
+        digest = _digest(token_ids)
+        entry = _Entry(token_ids, cache, nbytes)  # hashes the blocks outside the lock
+        with self._lock:
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = entry
+            for block in entry.blocks:
+                self._prefixes.setdefault(block, set()).add(digest)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+        self._publish_size()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            total = self.reused_tokens + self.prefill_tokens
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "reused_tokens": self.reused_tokens,
+                "prefill_tokens": self.prefill_tokens,
+                "reuse_ratio": self.reused_tokens / total if total else 0.0,
+            }
+
+
+def from_model_config(model_config, metrics=None):
+    """Build the store from ``kv_cache_*`` model parameters (None if disabled)."""
+    if not get_parameter(model_config, "kv_cache_enabled", True, bool):
+        return None
+    return KVCacheStore(
+        max_bytes=get_parameter(model_config, "kv_cache_max_bytes", 2 * 1024 ** 3, int),
+        ttl_seconds=get_parameter(model_config, "kv_cache_ttl_seconds", 600.0, float),
+        min_reuse_tokens=get_parameter(model_config, "kv_cache_min_reuse_tokens", 16, int),
+        metrics=metrics,
+    )
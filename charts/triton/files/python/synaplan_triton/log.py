@@ -0,0 +1,155 @@
+"""Logging setup for the Python backends.
+
+Replaces the per-token ``print(..., flush=True)`` calls with leveled,
+lazily formatted ``logging`` records:
+
+* ``INFO``  - startup, configuration and one line per finished request
+* ``DEBUG`` - per-request details (input sizes, timings, cache stats)
+* ``TRACE`` - per-token output and full rendered prompts; off by default
+
+Settings come from model parameters and fall back to environment
+variables (the parameter wins):
+
+=============  ======================  =========
+parameter      environment variable    default
+=============  ======================  =========
+``log_level``  ``SYNAPLAN_LOG_LEVEL``  ``INFO``
+``log_format`` ``SYNAPLAN_LOG_FORMAT`` ``text`` (or ``json``)
+``log_async``  ``SYNAPLAN_LOG_ASYNC``  ``true``
+=============  ======================  =========
+
+With ``log_async`` records are handed to a ``QueueHandler`` and written
+to stdout by a listener thread, so the streaming loops never block on
+stdout I/O.
+"""
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+from .config import get_setting
+
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+ROOT_LOGGER = "synaplan_triton"
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class Lazy:
+    """Defers an expensive log argument (``json.dumps`` of a config, ...) until formatted."""
+
+    __slots__ = ("fn", "args", "kwargs")
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+
+    def __str__(self):
+        return str(self.fn(*self.args, **self.kwargs))
+
+
+def resident_memory_mb():
+    """Current RSS of this process in MB (None where ``/proc`` is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+class StartupTimer:
+    """Wall-clock breakdown of ``initialize``, logged as one line once ready::
+
+        timer = StartupTimer(logger, started=IMPORT_START)
+        timer.add("imports", IMPORT_SECONDS)
+        with timer.stage("tokenizer"):
+            ...
+        timer.report()   # ⏱️  Ready in 4.31s (RSS 812 MB): imports 1.20s, tokenizer 0.04s, ..., other 0.02s
+    """
+
+    def __init__(self, logger, started=None):
+        self.logger = logger
+        self.started = time.perf_counter() if started is None else started
+        self.stages = []
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        stages = self.stages + [("other", max(0.0, total - sum(s for _, s in self.stages)))]
+        rss = resident_memory_mb()
+        self.logger.info("⏱️  Ready in %.2fs (RSS %s MB): %s", total, "?" if rss is None else f"{rss:.0f}",
+                         ", ".join(f"{n} {s:.2f}s" for n, s in stages))
+        return total
+
+
+def setup_logging(model_name, model_config):
+    """Configure the ``synaplan_triton`` logger tree and return the model's logger."""
+    global _listener
+
+    level_name = get_setting(model_config, "log_level", "SYNAPLAN_LOG_LEVEL", "INFO").upper()
+    level = TRACE if level_name == "TRACE" else logging.getLevelName(level_name)
+    if not isinstance(level, int):
+        level = logging.INFO
+    log_format = get_setting(model_config, "log_format", "SYNAPLAN_LOG_FORMAT", "text").lower()
+    use_async = get_setting(model_config, "log_async", "SYNAPLAN_LOG_ASYNC", True, bool)
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.propagate = False
+
+    if not root.handlers:
+        stream = logging.StreamHandler(sys.stdout)
+        if log_format == "json":
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+        if use_async:
+            records = queue.SimpleQueue()
+            root.addHandler(logging.handlers.QueueHandler(records))
+            _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=False)
+            _listener.start()
+            atexit.register(shutdown_logging)
+        else:
+            root.addHandler(stream)
+
+    return root.getChild(model_name)
+
+
+def shutdown_logging():
+    """Flush and stop the async listener (called from ``finalize``)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,286 @@
+"""LLM latency metrics exported through Triton's ``/metrics`` endpoint.
+
+Triton's built-in metrics end at the boundary of a decoupled Python model,
+so time-to-first-token and per-token latency are invisible to it. The
+backends record them per request with a ``RequestMetrics`` and publish
+``pb_utils.MetricFamily`` histograms, counters and gauges labelled
+``{model="<name>"}``:
+
+==================================================  ==================================================
+metric                                              observed
+==================================================  ==================================================
+``synaplan_llm_time_to_first_token_seconds``        request arrival -> first text chunk
+``synaplan_llm_inter_token_latency_seconds``        each gap between consecutive tokens
+``synaplan_llm_tokenize_seconds``                   tokenization of the rendered prompt
+``synaplan_llm_detokenize_seconds``                 total detokenization time, per request
+``synaplan_llm_prompt_tokens``                      prompt length
+``synaplan_llm_output_tokens``                      generated tokens
+``synaplan_llm_tokens_per_second``                  output tokens / decode time
+``synaplan_llm_speculative_acceptance_rate``        accepted / drafted tokens, per request
+``synaplan_llm_speculative_drafted_tokens_total``   counter of tokens proposed by speculative decoding
+``synaplan_llm_speculative_accepted_tokens_total``  counter of drafted tokens the model accepted
+``synaplan_llm_cancelled_requests_total``           counter of requests cancelled by the client
+``synaplan_llm_response_cache_hits_total``          counter of responses replayed from the response cache
+``synaplan_llm_response_cache_misses_total``        counter of cacheable requests that ran inference
+``synaplan_llm_oversized_requests_total``           counter of requests rejected for the engine's length limits
+``synaplan_llm_truncated_requests_total``           counter of requests whose oldest turns were dropped to fit
+``synaplan_llm_clamped_requests_total``             counter of requests whose max_tokens was clamped to fit
+``synaplan_llm_queue_wait_seconds``                 scheduler queue -> BLS stream start, also labelled
+                                                    ``priority="<class>"``
+``synaplan_llm_prompt_cache_hits_total``            counter of prompts with a cached token-ID prefix
+``synaplan_llm_prompt_cache_misses_total``          counter of prompts tokenized from scratch
+``synaplan_llm_prompt_cache_reused_tokens_total``   counter of prompt token IDs from the cache
+``synaplan_llm_prompt_cache_encoded_tokens_total``  counter of prompt token IDs from the tokenizer
+``synaplan_llm_kv_cache_hits_total``                counter of prompts reusing a stored KV cache
+``synaplan_llm_kv_cache_misses_total``              counter of prompts prefilled from scratch
+``synaplan_llm_kv_cache_reused_tokens_total``       counter of prompt tokens from stored KV caches
+``synaplan_llm_kv_cache_prefill_tokens_total``      counter of prompt tokens that went through prefill
+``synaplan_llm_kv_cache_bytes``                     gauge of memory held by stored KV caches
+``synaplan_llm_kv_cache_entries``                   gauge of stored KV caches
+==================================================  ==================================================
+
+Every metric update is an IPC round trip from the Python stub to the
+Triton process, so per-token values are accumulated locally and only
+published when the request finishes (inter-token gaps one observation
+each, the other histograms once per request). Cancelled requests are
+published with the tokens they got; replays from the response cache
+only with their time to first token and prompt.
+"""
+import logging
+import time
+
+from .config import get_parameter
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "synaplan_llm"
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+TOKEN_BUCKETS = [16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768]
+RATE_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+RATIO_BUCKETS = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+HISTOGRAMS = {
+    "time_to_first_token_seconds": ("Time from request arrival to the first streamed text chunk", LATENCY_BUCKETS),
+    "inter_token_latency_seconds": ("Time between consecutive generated tokens", LATENCY_BUCKETS),
+    "tokenize_seconds": ("Time spent tokenizing the rendered prompt", LATENCY_BUCKETS),
+    "detokenize_seconds": ("Total time spent detokenizing the output of a request", LATENCY_BUCKETS),
+    "prompt_tokens": ("Prompt length in tokens", TOKEN_BUCKETS),
+    "output_tokens": ("Generated tokens per request", TOKEN_BUCKETS),
+    "tokens_per_second": ("Generated tokens per second of decode time", RATE_BUCKETS),
+    "speculative_acceptance_rate": ("Fraction of speculatively drafted tokens accepted, per request", RATIO_BUCKETS),
+}
+
+COUNTERS = {
+    "cancelled_requests_total": "Requests cancelled by the client before generation finished",
+    "speculative_drafted_tokens_total": "Tokens proposed by speculative decoding",
+    "speculative_accepted_tokens_total": "Speculatively drafted tokens accepted by the model",
+    "response_cache_hits_total": "Deterministic requests answered from the response cache",
+    "response_cache_misses_total": "Deterministic requests not found in the response cache",
+    "oversized_requests_total": "Requests rejected because they exceed the engine's sequence or token limits",
+    "truncated_requests_total": "Requests whose oldest conversation turns were dropped to fit the engine",
+    "clamped_requests_total": "Requests whose max_tokens was lowered to fit the engine's max_seq_len",
+    "prompt_cache_hits_total": "Prompts whose rendered prefix was found in the token-ID cache",
+    "prompt_cache_misses_total": "Prompts tokenized without a cached prefix",
+    "prompt_cache_reused_tokens_total": "Prompt token IDs taken from the token-ID cache",
+    "prompt_cache_encoded_tokens_total": "Prompt token IDs produced by the tokenizer",
+    "kv_cache_hits_total": "Prompts that reused a stored KV cache of an earlier turn",
+    "kv_cache_misses_total": "Prompts without a reusable stored KV cache",
+    "kv_cache_reused_tokens_total": "Prompt tokens taken from stored KV caches instead of prefill",
+    "kv_cache_prefill_tokens_total": "Prompt tokens that went through prefill",
+}
+
+GAUGES = {
+    "kv_cache_bytes": "Memory held by stored KV caches",
+    "kv_cache_entries": "Stored KV caches",
+}
+
+
+# Histograms with one more label; a metric per label value is created on first use
+LABELLED_HISTOGRAMS = {
+    "queue_wait_seconds": ("Time a request waited in the scheduler for a stream slot", LATENCY_BUCKETS, "priority"),
+}
+
+
+class BackendMetrics:
+    """The histogram families of one model, labelled with its name."""
+
+    def __init__(self, pb_utils, model_name):
+        self.model_name = model_name
+        self._metrics = {}
+        self._families = {}
+        labels = {"model": model_name}
+        for name, (description, buckets) in HISTOGRAMS.items():
+            family = pb_utils.MetricFamily(
+                name=f"{PREFIX}_{name}",
+                description=description,
+                kind=pb_utils.MetricFamily.HISTOGRAM,
+            )
+            self._metrics[name] = family.Metric(labels=labels, buckets=buckets)
+        for name, description in COUNTERS.items():
+            family = pb_utils.MetricFamily(
+                name=f"{PREFIX}_{name}",
+                description=description,
+                kind=pb_utils.MetricFamily.COUNTER,
+            )
+            self._metrics[name] = family.Metric(labels=labels)
+        for name, description in GAUGES.items():
+            family = pb_utils.MetricFamily(
+                name=f"{PREFIX}_{name}",
+                description=description,
+                kind=pb_utils.MetricFamily.GAUGE,
+            )
+            self._metrics[name] = family.Metric(labels=labels)
+        for name, (description, buckets, label) in LABELLED_HISTOGRAMS.items():
+            self._families[name] = pb_utils.MetricFamily(
+                name=f"{PREFIX}_{name}",
+                description=description,
+                kind=pb_utils.MetricFamily.HISTOGRAM,
+            )
+
+    def observe(self, name, value):
+        metric = self._metrics.get(name)
+        if metric is None:
+            return
+        try:
+            metric.observe(value)
+        except Exception as e:  # metrics must never fail a request
+            logger.debug("Could not observe %s: %s", name, e)
+
+    def increment(self, name, value=1):
+        metric = self._metrics.get(name)
+        if metric is None:
+            return
+        try:
+            metric.increment(value)
+        except Exception as e:
+            logger.debug("Could not increment %s: %s", name, e)
+
+    def set(self, name, value):
+        metric = self._metrics.get(name)
+        if metric is None:
+            return
+        try:
+            metric.set(value)
+        except Exception as e:
+            logger.debug("Could not set %s: %s", name, e)
+
+    def observe_labelled(self, name, label_value, value):
+        """Observe a ``LABELLED_HISTOGRAMS`` entry for one value of its extra label."""
+        key = (name, label_value)
+        metric = self._metrics.get(key)
+        if metric is None:
+            family = self._families.get(name)
+            if family is None:
+                return
+            _, buckets, label = LABELLED_HISTOGRAMS[name]
+            try:
+                metric = self._metrics[key] = family.Metric(
+                    labels={"model": self.model_name, label: label_value}, buckets=buckets)
+            except Exception as e:
+                logger.debug("Could not create %s{%s=%s}: %s", name, label, label_value, e)
+                return
+        self.observe(key, value)
+
+    def request(self, start_time=None):
+        return RequestMetrics(self, start_time)
+
+
+class NullMetrics:
+
+    def observe(self, name, value):
+        pass
+
+    def increment(self, name, value=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def observe_labelled(self, name, label_value, value):
+        pass
+
+    def request(self, start_time=None):
+        return RequestMetrics(self, start_time)
+
+
+class RequestMetrics:
+    """Timings of a single request, published to ``BackendMetrics`` by ``finish``."""
+
+    __slots__ = ("metrics", "start_time", "first_token_time", "last_token_time",
+                 "tokens", "gaps", "tokenize_seconds", "detokenize_seconds", "prompt_tokens",
+                 "drafted_tokens", "accepted_tokens", "replayed")
+
+    def __init__(self, metrics, start_time=None):
+        self.metrics = metrics
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.first_token_time = None
+        self.last_token_time = None
+        self.tokens = 0
+        self.gaps = []  # seconds between consecutive tokens
+        self.tokenize_seconds = None
+        self.detokenize_seconds = None  # set to 0.0 by callers that detokenize per token
+        self.prompt_tokens = None
+        self.drafted_tokens = None  # set by speculative decoding
+        self.accepted_tokens = None
+        self.replayed = False  # answered from the response cache, nothing generated
+
+    def token(self, now=None):
+        """Record one generated token (call right after its text was handed to the sender)."""
+        now = time.perf_counter() if now is None else now
+        if self.first_token_time is None:
+            self.first_token_time = now
+        else:
+            self.gaps.append(now - self.last_token_time)
+        self.last_token_time = now
+        self.tokens += 1
+
+    def replay(self, now=None):
+        """Record that the first chunk of a cached response was sent."""
+        self.first_token_time = time.perf_counter() if now is None else now
+        self.replayed = True
+
+    def finish(self):
+        """Publish the request (completed, cancelled or replayed) to the histograms."""
+        observe = self.metrics.observe
+        if self.tokenize_seconds is not None:
+            observe("tokenize_seconds", self.tokenize_seconds)
+        if self.prompt_tokens is not None:
+            observe("prompt_tokens", self.prompt_tokens)
+        if not self.replayed:
+            observe("output_tokens", self.tokens)
+            if self.detokenize_seconds is not None:
+                observe("detokenize_seconds", self.detokenize_seconds)
+            if self.drafted_tokens:
+                observe("speculative_acceptance_rate", self.accepted_tokens / self.drafted_tokens)
+                self.metrics.increment("speculative_drafted_tokens_total", self.drafted_tokens)
+                self.metrics.increment("speculative_accepted_tokens_total", self.accepted_tokens)
+        if self.first_token_time is None:
+            return
+        observe("time_to_first_token_seconds", self.first_token_time - self.start_time)
+        if self.replayed:
+            return
+        for gap in self.gaps:
+            observe("inter_token_latency_seconds", gap)
+        if self.tokens > 1:
+            decode_time = self.last_token_time - self.first_token_time
+            if decode_time > 0:
+                observe("tokens_per_second", (self.tokens - 1) / decode_time)
+
+
+def from_model_config(model_name, model_config):
+    """Build the model's metrics from the ``metrics_enabled`` parameter.
+
+    Returns a ``NullMetrics`` when disabled or when the running Triton has
+    no custom histogram support.
+    """
+    if not get_parameter(model_config, "metrics_enabled", True, bool):
+        return NullMetrics()
+    try:
+        import triton_python_backend_utils as pb_utils
+    except ImportError:
+        return NullMetrics()
+    if not hasattr(getattr(pb_utils, "MetricFamily", None), "HISTOGRAM"):
+        logger.warning("Custom histogram metrics are not supported by this Triton version")
+        return NullMetrics()
+    return BackendMetrics(pb_utils, model_name)
@@ -0,0 +1,103 @@
+"""Batched request preprocessing for the Python backends.
+
+When Triton hands ``execute()`` several requests at once, all
+conversations are validated and rendered first, then tokenized with a
+single batch call to the fast tokenizer (the Rust side encodes the batch
+in parallel). The resulting IDs are packed into one contiguous buffer and
+every request gets a ``[1, length]`` view of its own row range, so no
+per-request array is allocated or copied.
+
+Failures stay per request: ``prepare_batch`` returns, for each input,
+either a ``[1, length]`` array or the exception that request raised.
+"""
+import json
+
+import numpy as np
+
+
+def decode_text(raw):
+    """A STRING input element (bytes, str or a 0-dim numpy array) -> str."""
+    if isinstance(raw, bytes):
+        return raw.decode('utf-8')
+    if isinstance(raw, str):
+        return raw
+    # Extract scalar if it's a 0-dim numpy array
+    return decode_text(raw.item())
+
+
+def decode_conversation(raw):
+    """Parse and validate the ``conversation`` input -> list of messages.
+
+    ``raw`` is the first element of the input tensor (bytes, str or a
+    0-dim numpy array). Raises ValueError with a client-facing message.
+    """
+    conversation_json = decode_text(raw)
+
+    try:
+        conversation = json.loads(conversation_json)
+    except json.JSONDecodeError as e:
+        snippet = conversation_json[:200] + ("..." if len(conversation_json) > 200 else "")
+        raise ValueError(f"Invalid JSON in conversation input: {e}. Malformed content (truncated): '{snippet}'")
+
+    if not isinstance(conversation, list):
+        raise ValueError("Conversation must be a list of message objects")
+    for msg in conversation:
+        if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
+            raise ValueError("Each message must have 'role' and 'content' fields")
+    return conversation
+
+
+def encode_batch(tokenizer, rendered, prompt_cache=None):
+    """Tokenize rendered prompts in one batch -> list of ID lists or exceptions."""
+    if prompt_cache is not None:
+        return prompt_cache.encode_batch(rendered)
+    try:
+        return tokenizer(rendered, add_special_tokens=True)["input_ids"]
+    except Exception:
+        # Isolate the prompt that broke the batch call
+        results = []
+        for text in rendered:
+            try:
+                results.append(tokenizer(text, add_special_tokens=True)["input_ids"])
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def pack(id_lists, dtype=np.int32):
+    """Copy ID lists into one contiguous buffer -> list of ``[1, length]`` views."""
+    lengths = np.fromiter((len(ids) for ids in id_lists), dtype=np.int64, count=len(id_lists))
+    offsets = np.zeros(len(id_lists) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    flat = np.fromiter((t for ids in id_lists for t in ids), dtype=dtype, count=int(offsets[-1]))
+    return [flat[offsets[i]:offsets[i + 1]].reshape(1, -1) for i in range(len(id_lists))]
+
+
+def prepare_batch(tokenizer, conversations, prompt_cache=None, dtype=np.int32):
+    """Render and tokenize conversations -> ``[1, length]`` arrays or exceptions.
+
+    ``conversations`` may contain exceptions (requests that already failed
+    to parse); they are passed through unchanged.
+    """
+    results = list(conversations)
+    rendered, index = [], []
+    for i, conversation in enumerate(conversations):
+        if isinstance(conversation, Exception):
+            continue
+        try:
+            rendered.append(tokenizer.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True))
+            index.append(i)
+        except Exception as e:
+            results[i] = e
+
+    if not rendered:
+        return results
+
+    encoded = encode_batch(tokenizer, rendered, prompt_cache)
+    ok = [(i, ids) for i, ids in zip(index, encoded) if not isinstance(ids, Exception)]
+    for i, ids in zip(index, encoded):
+        if isinstance(ids, Exception):
+            results[i] = ids
+    for (i, _), view in zip(ok, pack([ids for _, ids in ok], dtype)):
+        results[i] = view
+    return results
@@ -0,0 +1,292 @@
+"""Token-ID cache for rendered chat prompts.
+
+Synaplan resends the same system prompt and a growing history every turn,
+so most of each rendered prompt has already been tokenized. The rendered
+text is split right after *boundary tokens* (special tokens such as
+``</s>`` and ``[/INST]``); the tokenizer never merges across a special
+token, so every segment can be tokenized on its own and cached under the
+hash of the rendered text up to its end.
+
+Mistral's chat template moves the system prompt into the *last* user turn,
+so prompts are keyed on rendered text rather than on the message list:
+only prefixes that really render identically are reused.
+
+Segments after the first are tokenized as ``<boundary token> + segment``
+with the leading boundary ID dropped, which reproduces how the tokenizer
+treats text that follows a special token (no SentencePiece prefix space).
+``verify()`` checks that this matches a full tokenization and the backends
+disable the cache if it does not.
+
+Only token IDs are cached; ``apply_chat_template`` still renders the whole
+conversation every turn. For the same reason as above (the system prompt
+moves to the last turn) rendered text cannot be reused per message, and
+rendering costs well under a millisecond next to tokenizing. Hits and
+reused / tokenized tokens are published as ``synaplan_llm_prompt_cache_*``
+metrics.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .config import get_parameter
+
+DEFAULT_BOUNDARY_TOKENS = ("</s>", "[/INST]")
+
+# Rendered once at startup to check segment-wise tokenization against a full pass
+VERIFY_CONVERSATION = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Hello! Wie geht's?"},
+    {"role": "assistant", "content": " Fine, thanks.\n\n- item one\n- item two "},
+    {"role": "user", "content": "  Summarize: ‹café› 👍"},
+]
+
+
+class PromptCache:
+    """Bounded LRU of ``hash(rendered prefix) -> segment token IDs``.
+
+    Entries form chains: each one stores the digest of the preceding
+    prefix plus the IDs of its own segment, so memory grows with the
+    number of distinct segments rather than with prefix length squared.
+    Eviction drops least-recently-used segments once ``max_tokens`` token
+    IDs are cached; lookups touch chains leaf-to-root so shared prefixes
+    (the system prompt) are the last to go.
+    """
+
+    def __init__(self, tokenizer, max_tokens=262144, boundary_tokens=DEFAULT_BOUNDARY_TOKENS, metrics=None):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.metrics = metrics
+        self.boundary_tokens = {}
+        for token in boundary_tokens:
+            token_id = tokenizer.convert_tokens_to_ids(token)
+            if token_id is not None and token_id != tokenizer.unk_token_id:
+                self.boundary_tokens[token] = token_id
+
+        self._entries = OrderedDict()  # digest -> (parent_digest, segment_ids)
+        self._cached_tokens = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.tokenized_tokens = 0
+
+    # --- segmentation ---
+
+    def _segments(self, rendered):
+        """Split ``rendered`` after each boundary token -> [(text, anchor_token)]."""
+        cuts = []
+        for token in self.boundary_tokens:
+            start = rendered.find(token)
+            while start != -1:
+                cuts.append((start + len(token), token))
+                start = rendered.find(token, start + len(token))
+        cuts.sort()
+
+        segments = []
+        pos, anchor = 0, None
+        for end, token in cuts:
+            if end > pos:
+                segments.append((rendered[pos:end], anchor))
+                pos, anchor = end, token
+        if pos < len(rendered):
+            segments.append((rendered[pos:], anchor))
+        return segments
+
+    def _tokenize_segment(self, text, anchor):
+        if anchor is None:
+            return self.tokenizer(text, add_special_tokens=True)["input_ids"]
+        ids = self.tokenizer(anchor + text, add_special_tokens=False)["input_ids"]
+        if not ids or ids[0] != self.boundary_tokens[anchor]:
+            raise ValueError(f"Boundary token {anchor!r} did not tokenize to a single leading ID")
+        return ids[1:]
+
+    # --- cache access ---
+
+    def _assemble(self, digest):
+        """Concatenate the chain ending at ``digest`` or return None if broken."""
+        chain = []
+        while digest is not None:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            chain.append(digest)
+            digest = entry[0]
+        ids = []
+        for d in reversed(chain):
+            ids.extend(self._entries[d][1])
+        for d in chain:  # leaf first, so the root ends up most recently used
+            self._entries.move_to_end(d)
+        return ids
+
+    def _insert(self, digest, parent, segment_ids):
+        if digest in self._entries:
+            return
+        self._entries[digest] = (parent, tuple(segment_ids))
+        self._cached_tokens += len(segment_ids)
+        while self._cached_tokens > self.max_tokens and self._entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._cached_tokens -= len(evicted)
+
+    def _lookup(self, rendered):
+        """Segment ``rendered`` and find its longest cached prefix.
+
+        Returns ``(segments, digests, prefix_ids, reused)`` where ``reused``
+        is the number of leading segments covered by ``prefix_ids``.
+        """
+        segments = self._segments(rendered)
+
+        digests = []
+        hasher = hashlib.sha1()
+        for text, _ in segments:
+            hasher.update(text.encode("utf-8"))
+            digests.append(hasher.hexdigest())
+
+        # The final segment is usually the new user turn; only boundary-terminated prefixes are reusable
+        with self._lock:
+            for i in range(len(segments) - 1, -1, -1):
+                prefix_ids = self._assemble(digests[i])
+                if prefix_ids is not None:
+                    return segments, digests, prefix_ids, i + 1
+        return segments, digests, [], 0
+
+    def _commit(self, digests, prefix_ids, reused, new_segments):
+        """Record stats, insert the newly tokenized segments and return the full IDs."""
+        ids = list(prefix_ids)
+        for segment_ids in new_segments:
+            ids.extend(segment_ids)
+        with self._lock:
+            if reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.reused_tokens += len(prefix_ids)
+            self.tokenized_tokens += len(ids) - len(prefix_ids)
+            for i, segment_ids in enumerate(new_segments, start=reused):
+                self._insert(digests[i], digests[i - 1] if i else None, segment_ids)
+        if self.metrics is not None:  # outside the lock: metric updates are IPC round trips
+            self.metrics.increment("prompt_cache_hits_total" if reused else "prompt_cache_misses_total")
+            if prefix_ids:
+                self.metrics.increment("prompt_cache_reused_tokens_total", len(prefix_ids))
+            self.metrics.increment("prompt_cache_encoded_tokens_total", len(ids) - len(prefix_ids))
+        return ids
+
+    def encode(self, rendered):
+        """Return the token IDs of ``rendered``, tokenizing only uncached segments."""
+        segments, digests, prefix_ids, reused = self._lookup(rendered)
+        new_segments = [self._tokenize_segment(text, anchor) for text, anchor in segments[reused:]]
+        return self._commit(digests, prefix_ids, reused, new_segments)
+
+    def encode_batch(self, rendered):
+        """``encode`` for several prompts with batched tokenizer calls.
+
+        Uncached segments of all prompts are deduplicated (concurrent
+        requests usually share a new system prompt) and tokenized together.
+        Returns a list with token IDs or the exception raised for each prompt;
+        a segment that breaks the batched call fails only the prompts it is in.
+        """
+        lookups = []
+        for text in rendered:
+            try:
+                lookups.append(self._lookup(text))
+            except Exception as e:  # e.g. text that does not encode to UTF-8
+                lookups.append(e)
+
+        pending = {}  # digest -> (text, anchor)
+        for lookup in lookups:
+            if not isinstance(lookup, Exception):
+                segments, digests, _, reused = lookup
+                for i in range(reused, len(segments)):
+                    pending.setdefault(digests[i], segments[i])
+
+        tokenized = self._tokenize_pending(pending) if pending else {}
+
+        results = []
+        for lookup in lookups:
+            if isinstance(lookup, Exception):
+                results.append(lookup)
+                continue
+            segments, digests, prefix_ids, reused = lookup
+            new_segments = [tokenized[digests[i]] for i in range(reused, len(segments))]
+            error = next((s for s in new_segments if isinstance(s, Exception)), None)
+            if error is not None:
+                results.append(error)
+            else:
+                results.append(self._commit(digests, prefix_ids, reused, new_segments))
+        return results
+
+    def _tokenize_pending(self, pending):
+        """``{digest: (text, anchor)}`` -> ``{digest: segment IDs or exception}``."""
+        try:
+            tokenized = {}
+            keys = list(pending)
+            with_specials = [k for k in keys if pending[k][1] is None]
+            anchored = [k for k in keys if pending[k][1] is not None]
+            if with_specials:
+                encoded = self.tokenizer([pending[k][0] for k in with_specials], add_special_tokens=True)["input_ids"]
+                tokenized.update(zip(with_specials, encoded))
+            if anchored:
+                encoded = self.tokenizer([pending[k][1] + pending[k][0] for k in anchored],
+                                         add_special_tokens=False)["input_ids"]
+                for key, ids in zip(anchored, encoded):
+                    anchor = pending[key][1]
+                    if not ids or ids[0] != self.boundary_tokens[anchor]:
+                        tokenized[key] = ValueError(f"Boundary token {anchor!r} did not tokenize to a single leading ID")
+                    else:
+                        tokenized[key] = ids[1:]
+            return tokenized
+        except Exception:
+            # Isolate the segment that broke the batch call
+            tokenized = {}
+            for key, (text, anchor) in pending.items():
+                try:
+                    tokenized[key] = self._tokenize_segment(text, anchor)
+                except Exception as e:
+                    tokenized[key] = e
+            return tokenized
+
+    def verify(self, rendered):
+        """True if cached and uncached tokenization of ``rendered`` agree."""
+        expected = self.tokenizer(rendered, add_special_tokens=True)["input_ids"]
+        probe = PromptCache(self.tokenizer, self.max_tokens, tuple(self.boundary_tokens))
+        return (probe.encode(rendered) == expected and probe.encode(rendered) == expected
+                and probe.encode_batch([rendered, rendered + "."]) == [expected, probe.encode(rendered + ".")])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            total = self.reused_tokens + self.tokenized_tokens
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "reused_tokens": self.reused_tokens,
+                "tokenized_tokens": self.tokenized_tokens,
+                "token_reuse_ratio": self.reused_tokens / total if total else 0.0,
+                "entries": len(self._entries),
+                "cached_tokens": self._cached_tokens,
+            }
+
+
+def from_model_config(tokenizer, model_config, metrics=None):
+    """Build the cache from ``prompt_cache_*`` model parameters.
+
+    Returns None when disabled and raises ValueError when segment-wise
+    tokenization does not reproduce a full tokenization for this tokenizer.
+    """
+    if not get_parameter(model_config, "prompt_cache_enabled", True, bool):
+        return None
+    boundary_tokens = get_parameter(model_config, "prompt_cache_boundary_tokens",
+                                    ",".join(DEFAULT_BOUNDARY_TOKENS))
+    cache = PromptCache(
+        tokenizer,
+        max_tokens=get_parameter(model_config, "prompt_cache_max_tokens", 262144, int),
+        boundary_tokens=tuple(t.strip() for t in boundary_tokens.split(",") if t.strip()),
+        metrics=metrics,
+    )
+    if not cache.boundary_tokens:
+        raise ValueError(f"None of the boundary tokens {boundary_tokens!r} are single tokens")
+    sample = tokenizer.apply_chat_template(VERIFY_CONVERSATION, tokenize=False, add_generation_prompt=True)
+    if not cache.verify(sample):
+        raise ValueError("Segment-wise tokenization does not match full tokenization")
+    return cache
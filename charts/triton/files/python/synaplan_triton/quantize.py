@@ -0,0 +1,256 @@
+"""Weight-only int8/int4 checkpoints for ``mistral-cpu``.
+
+Loading the bf16 Hugging Face checkpoint costs every instance process
+~15 GB of private memory for a 7B model. ``build-models.sh`` (CPU mode)
+instead converts it once into ``/cache/engines/<model>/<precision>/cpu``:
+
+* ``config.json`` / ``generation_config.json`` of the source model
+* ``model.pt`` - ``torch.save`` of the state dict with every decoder
+  ``nn.Linear`` replaced by ``WeightOnlyLinear`` buffers, plus the
+  non-persistent buffers (rotary ``inv_freq``) the skeleton needs
+* ``manifest.json`` - precision, group size, quantized modules, torch
+  version and a fingerprint of the source checkpoint
+
+``load`` builds the model skeleton on the ``meta`` device and assigns
+the tensors from ``torch.load(..., mmap=True)``, so weights are never
+copied: they stay file-backed, read-only pages that all instances on the
+node share through the page cache.
+
+``int8`` stores per-output-channel symmetric weights and runs
+``aten._weight_int8pack_mm``; ``int4`` stores asymmetric groups of
+``group_size`` input channels packed for ``aten._weight_int4pack_mm_for_cpu``.
+Both kernels take bf16 activations; embeddings, norms and ``lm_head``
+stay bf16. The int4 packing is specific to the torch build, so the
+artifact is rejected when the serving torch version differs from the one
+that wrote it (convert with the same image that serves).
+
+Convert by hand with::
+
+    python3 -m synaplan_triton.quantize /cache/weights/<model> <output_dir> --precision int8
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+
+import torch
+from torch import nn
+
+from .config import get_parameter
+
+FORMAT_VERSION = 1
+PRECISIONS = ("int8", "int4")
+WEIGHTS_FILE = "model.pt"
+MANIFEST_FILE = "manifest.json"
+SKIP_MODULES = ("lm_head",)
+
+
+def source_fingerprint(weights_dir):
+    """Name, size and mtime of the checkpoint files in ``weights_dir``."""
+    fingerprint = []
+    for path in sorted(glob.glob(os.path.join(weights_dir, "*.safetensors")) +
+                       glob.glob(os.path.join(weights_dir, "*.bin")) + [os.path.join(weights_dir, "config.json")]):
+        st = os.stat(path)
+        fingerprint.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+    return fingerprint
+
+
+class WeightOnlyLinear(nn.Module):
+    """``nn.Linear`` with int8 or packed int4 weights and bf16 activations."""
+
+    def __init__(self, in_features, out_features, precision, group_size=128, bias=False,
+                 dtype=torch.bfloat16, device="meta"):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.precision = precision
+        self.group_size = group_size
+        if precision == "int8":
+            self.register_buffer("qweight", torch.empty(out_features, in_features, dtype=torch.int8, device=device))
+            self.register_buffer("scales", torch.empty(out_features, dtype=dtype, device=device))
+        else:
+            self.register_buffer("qweight", torch.empty(out_features, in_features // 2, dtype=torch.uint8, device=device))
+            self.register_buffer("scales", torch.empty(in_features // group_size, out_features, 2, dtype=dtype,
+                                                       device=device))
+        self.register_buffer("bias", torch.empty(out_features, dtype=dtype, device=device) if bias else None)
+
+    @staticmethod
+    def supports(linear, precision, group_size):
+        if precision == "int4":
+            return linear.out_features % 16 == 0 and linear.in_features % group_size == 0
+        return True
+
+    @classmethod
+    def quantize(cls, linear, precision, group_size=128, dtype=torch.bfloat16):
+        module = cls(linear.in_features, linear.out_features, precision, group_size,
+                     bias=linear.bias is not None, dtype=dtype, device="cpu")
+        w = linear.weight.detach().float()
+        if precision == "int8":
+            scales = (w.abs().amax(dim=1) / 127).clamp(min=1e-8).to(dtype)
+            module.qweight = (w / scales.float()[:, None]).round().clamp(-127, 127).to(torch.int8)
+            module.scales = scales
+        else:
+            groups = w.reshape(w.shape[0], -1, group_size)
+            low, high = groups.amin(dim=-1, keepdim=True), groups.amax(dim=-1, keepdim=True)
+            scales = ((high - low) / 15).clamp(min=1e-8).to(dtype).float()
+            zeros = (low + 8 * scales).to(dtype).float()
+            q = ((groups - zeros) / scales + 8).round().clamp(0, 15).reshape(w.shape).to(torch.int32)
+            module.qweight = torch.ops.aten._convert_weight_to_int4pack_for_cpu(q, 1)
+            module.scales = torch.cat([scales, zeros], dim=-1).transpose(0, 1).contiguous().to(dtype)
+        if linear.bias is not None:
+            module.bias = linear.bias.detach().to(dtype)
+        return module
+
+    def forward(self, x):
+        shape = x.shape
+        x2d = x.reshape(-1, self.in_features).to(self.scales.dtype)
+        if self.precision == "int8":
+            y = torch.ops.aten._weight_int8pack_mm(x2d, self.qweight, self.scales)
+        else:
+            y = torch.ops.aten._weight_int4pack_mm_for_cpu(x2d, self.qweight, self.group_size, self.scales)
+        if self.bias is not None:
+            y = y + self.bias
+        return y.reshape(*shape[:-1], self.out_features).to(x.dtype)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, precision={self.precision}"
+
+
+def _set_module(model, name, module):
+    parent, _, child = name.rpartition(".")
+    setattr(model.get_submodule(parent) if parent else model, child, module)
+
+
+def quantize_model(model, precision, group_size=128, dtype=torch.bfloat16):
+    """Replace the model's ``nn.Linear`` layers in place; returns the quantized module names."""
+    names = [name for name, module in model.named_modules()
+             if isinstance(module, nn.Linear) and name.rsplit(".", 1)[-1] not in SKIP_MODULES
+             and WeightOnlyLinear.supports(module, precision, group_size)]
+    for name in names:
+        _set_module(model, name, WeightOnlyLinear.quantize(model.get_submodule(name), precision, group_size, dtype))
+    return names
+
+
+def convert(weights_dir, output_dir, precision="int8", group_size=128, dtype=torch.bfloat16):
+    """Quantize the checkpoint in ``weights_dir`` into ``output_dir`` (replaced atomically)."""
+    from transformers import AutoModelForCausalLM
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got {precision!r}")
+    model = AutoModelForCausalLM.from_pretrained(weights_dir, local_files_only=True, trust_remote_code=True,
+                                                 torch_dtype=dtype, low_cpu_mem_usage=True)
+    modules = quantize_model(model, precision, group_size, dtype)
+
+    state_dict = model.state_dict()
+    buffers = {name: b for name, b in model.named_buffers() if name not in state_dict}
+    tmp = f"{output_dir.rstrip('/')}.tmp.{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    model.config.save_pretrained(tmp)
+    if model.generation_config is not None:
+        model.generation_config.save_pretrained(tmp)
+    torch.save({"state_dict": state_dict, "buffers": buffers}, os.path.join(tmp, WEIGHTS_FILE))
+    with open(os.path.join(tmp, MANIFEST_FILE), "w") as f:
+        json.dump({
+            "format": FORMAT_VERSION,
+            "precision": precision,
+            "group_size": group_size,
+            "dtype": str(dtype).replace("torch.", ""),
+            "modules": modules,
+            "torch": torch.__version__,
+            "source": source_fingerprint(weights_dir),
+        }, f, indent=2)
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.rename(tmp, output_dir)
+    return modules
+
+
+def read_manifest(artifact_dir, weights_dir=None):
+    """The artifact's manifest; ValueError if it is missing or not loadable by this torch build."""
+    manifest_path = os.path.join(artifact_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"No quantized weights in {artifact_dir}")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION or manifest.get("torch") != torch.__version__:
+        raise ValueError(f"Quantized weights were written by torch {manifest.get('torch')} "
+                         f"(format {manifest.get('format')}), running {torch.__version__}")
+    if weights_dir and os.path.isdir(weights_dir) and manifest.get("source") != source_fingerprint(weights_dir):
+        raise ValueError(f"Quantized weights are stale, {weights_dir} changed since conversion")
+    return manifest
+
+
+def load(artifact_dir, weights_dir=None):
+    """Model from a ``convert`` artifact, its weights memory-mapped from ``model.pt``.
+
+    Raises ValueError when the artifact is incomplete, was written by a
+    different torch version or (if ``weights_dir`` exists) is older than
+    the checkpoint it was converted from.
+    """
+    from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
+
+    manifest = read_manifest(artifact_dir, weights_dir)
+    dtype = getattr(torch, manifest["dtype"])
+    config = AutoConfig.from_pretrained(artifact_dir, trust_remote_code=True)
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype, trust_remote_code=True)
+    for name in manifest["modules"]:
+        linear = model.get_submodule(name)
+        _set_module(model, name, WeightOnlyLinear(linear.in_features, linear.out_features, manifest["precision"],
+                                                  manifest["group_size"], bias=linear.bias is not None, dtype=dtype))
+
+    checkpoint = torch.load(os.path.join(artifact_dir, WEIGHTS_FILE), mmap=True, weights_only=True,
+                            map_location="cpu")
+    model.load_state_dict(checkpoint["state_dict"], assign=True, strict=True)
+    for name, buffer in checkpoint["buffers"].items():
+        module_name, _, buffer_name = name.rpartition(".")
+        module = model.get_submodule(module_name) if module_name else model
+        module.register_buffer(buffer_name, buffer, persistent=False)
+    if os.path.exists(os.path.join(artifact_dir, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(artifact_dir)
+
+    left_on_meta = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if left_on_meta:
+        raise ValueError(f"Quantized weights are missing tensors: {left_on_meta[:5]}")
+    return model.eval()
+
+
+def artifact_dir(model_config, precision):
+    """``quantized_weights_dir`` parameter with ``{precision}`` filled in."""
+    template = get_parameter(model_config, "quantized_weights_dir",
+                             "/cache/engines/mistral-7b-instruct-v0.3/{precision}/cpu")
+    return template.format(precision=precision)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a Hugging Face checkpoint to weight-only int8/int4.")
+    parser.add_argument("weights_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--precision", choices=PRECISIONS, default="int8")
+    parser.add_argument("--group-size", type=int, default=128, help="int4 quantization group size")
+    parser.add_argument("--if-stale", action="store_true", help="skip when output_dir is current for weights_dir")
+    args = parser.parse_args(argv)
+
+    if args.if_stale:
+        try:
+            manifest = read_manifest(args.output_dir, args.weights_dir)
+            if manifest["precision"] == args.precision:
+                print(f"{args.output_dir} is up to date, skipping")
+                return 0
+        except ValueError as e:
+            print(f"Converting: {e}")
+
+    start = time.perf_counter()
+    modules = convert(args.weights_dir, args.output_dir, args.precision, args.group_size)
+    size = os.path.getsize(os.path.join(args.output_dir, WEIGHTS_FILE))
+    print(f"Quantized {len(modules)} linear layers to {args.precision} in {time.perf_counter() - start:.1f}s "
+          f"-> {args.output_dir} ({size / 2 ** 30:.2f} GiB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
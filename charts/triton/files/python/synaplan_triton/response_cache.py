@@ -0,0 +1,219 @@
+"""Exact-match cache of complete responses for deterministic requests.
+
+Synaplan sends many identical short prompts (classification, titles,
+sorting helpers). With greedy decoding the same prompt token IDs and
+``max_tokens`` always produce the same text, so the backends key the
+streamed chunks of a finished response on a hash of
+
+    namespace, prompt token IDs, max_tokens, sampling parameters, stop
+    strings and guide
+
+and replay them on a hit, chunk by chunk, so the client protocol does
+not change. Requests that sample (temperature > 0 and top_k != 1) are
+neither looked up nor stored; neither are cancelled or failed ones.
+
+The namespace identifies the model that produced the text (``identity``:
+the engine build key, or the loaded precision and a fingerprint of the
+weights), so entries written before a weights update or engine rebuild
+are never replayed. Without an identity the disk tier, which outlives the
+process, is turned off.
+
+The in-memory tier is an LRU bounded by ``max_bytes``. With a
+``disk_dir`` every entry is also written there as one JSON file
+(atomically, so instances and restarts can share the directory); disk
+hits are promoted to memory. Entries expire after ``ttl_seconds`` and
+the oldest files are removed once the directory exceeds
+``disk_max_bytes`` (as counted by this instance).
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .config import get_parameter, get_setting
+
+logger = logging.getLogger(__name__)
+
+
+def is_deterministic(sampling):
+    """True for greedy decoding: temperature 0, top_k 1 or none of temperature / top_p / top_k set."""
+    if sampling.get("temperature") == 0 or sampling.get("top_k") == 1:
+        return True
+    return all(sampling.get(name) is None for name in ("temperature", "top_p", "top_k"))
+
+
+def chunks_nbytes(chunks):
+    return sum(len(c.encode("utf-8")) for c in chunks) + 64 * len(chunks)
+
+
+class ResponseCache:
+
+    def __init__(self, namespace="", max_bytes=64 * 1024 ** 2, ttl_seconds=86400.0, disk_dir=None,
+                 disk_max_bytes=1024 ** 3):
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._entries = OrderedDict()  # key -> (created, chunks, nbytes)
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(e.stat().st_size for e in os.scandir(disk_dir) if e.name.endswith(".json"))
+
+    def key(self, prompt_ids, max_tokens, sampling=None):
+        h = hashlib.sha256()
+        h.update(json.dumps([self.namespace, int(max_tokens), sorted((sampling or {}).items())]).encode("utf-8"))
+        h.update(",".join(map(str, prompt_ids)).encode("ascii"))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _remember(self, key, created, chunks):
+        nbytes = chunks_nbytes(chunks)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[2]
+        self._entries[key] = (created, chunks, nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            self._bytes -= self._entries.popitem(last=False)[1][2]
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry["created"], entry["chunks"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def get(self, key):
+        """The cached chunks for ``key`` (the last one is the final response's text), or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._bytes -= self._entries.pop(key)[2]
+
+        disk_entry = self._read_disk(key) if self.disk_dir else None
+        with self._lock:
+            if disk_entry is not None and now - disk_entry[0] < self.ttl_seconds:
+                self._remember(key, *disk_entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return disk_entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, chunks):
+        """Store the chunks of a finished response (the last one is the final response's text)."""
+        chunks = list(chunks)
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, chunks)
+        if self.disk_dir:
+            self._write_disk(key, created, chunks)
+
+    def _write_disk(self, key, created, chunks):
+        path = self._path(key)
+        tmp = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "chunks": chunks}, f, ensure_ascii=False)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._disk_bytes += size
+            over = self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete expired files, then the oldest ones, until the directory is 10% under its budget."""
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        deadline = time.time() - self.ttl_seconds
+        for mtime, size, path in files:
+            if total <= self.disk_max_bytes * 0.9 and mtime >= deadline:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self._disk_bytes if self.disk_dir else None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def namespace(*identity):
+    """Namespace of the model identified by ``identity`` (JSON-serializable parts), None if any part is None."""
+    if any(part is None for part in identity):
+        return None
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def from_model_config(model_config, namespace):
+    """Build the cache from ``response_cache_*`` model parameters (None if disabled).
+
+    ``response_cache_dir`` falls back to the ``SYNAPLAN_RESPONSE_CACHE_DIR``
+    env var; the model's entries go to a subdirectory named after it. A
+    None ``namespace`` (model identity unknown) keeps the cache in memory.
+    """
+    if not get_parameter(model_config, "response_cache_enabled", True, bool):
+        return None
+    disk_dir = get_setting(model_config, "response_cache_dir", "SYNAPLAN_RESPONSE_CACHE_DIR", "")
+    if disk_dir and namespace is None:
+        logger.warning("⚠️ Model identity unknown, response cache disk tier %s disabled", disk_dir)
+        disk_dir = ""
+    return ResponseCache(
+        namespace=namespace or "",
+        max_bytes=get_parameter(model_config, "response_cache_max_bytes", 64 * 1024 ** 2, int),
+        ttl_seconds=get_parameter(model_config, "response_cache_ttl_seconds", 86400.0, float),
+        disk_dir=os.path.join(disk_dir, model_config.get("name", "model")) if disk_dir else None,
+        disk_max_bytes=get_parameter(model_config, "response_cache_disk_max_bytes", 1024 ** 3, int),
+    )
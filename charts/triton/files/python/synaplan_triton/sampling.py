@@ -0,0 +1,170 @@
+"""Per-request sampling parameters, stop strings and guided decoding inputs.
+
+Both backends accept these optional inputs next to ``conversation`` and
+``max_tokens``:
+
+================================  ========  ==========================================
+input                             type      meaning
+================================  ========  ==========================================
+``temperature``                   FP32      0 = greedy
+``top_p``                         FP32      nucleus sampling threshold (0, 1]
+``top_k``                         INT32     sample from the k most likely tokens, 1 = greedy
+``seed``                          UINT64    random seed of the request
+``stop_words``                    STRING    strings that end the generation (not returned)
+``guided_decoding_guide_type``    STRING    ``json``, ``json_schema``, ``regex`` or ``ebnf_grammar``
+``guided_decoding_guide``         STRING    the schema / regex / grammar (not needed for ``json``)
+================================  ========  ==========================================
+
+Unset values fall back to the model's ``default_temperature`` /
+``default_top_p`` / ``default_top_k`` parameters. The guide constrains
+decoding itself (TRT-LLM's xgrammar backend on GPU, ``guided`` logits
+masks on CPU), so structured output is valid in a single pass.
+
+Stop strings are matched on the detokenized text by ``StopMatcher``, so
+they are found across token boundaries no matter how they tokenize.
+"""
+import numpy as np
+
+from .config import get_parameter
+from .preprocess import decode_text
+
+GUIDE_TYPES = ("json", "json_schema", "regex", "ebnf_grammar")
+
+
+def _scalar(array):
+    value = np.asarray(array).reshape(-1)[0]
+    return value.item() if hasattr(value, "item") else value
+
+
+class SamplingParams:
+    """Effective sampling settings of one request."""
+
+    __slots__ = ("temperature", "top_p", "top_k", "seed", "stop", "guide_type", "guide")
+
+    def __init__(self, temperature=None, top_p=None, top_k=None, seed=None, stop=(), guide_type=None, guide=None):
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.seed = seed
+        self.stop = tuple(stop)
+        self.guide_type = guide_type
+        self.guide = guide
+
+    def validate(self):
+        """Raise ValueError with a client-facing message for out-of-range values."""
+        if self.temperature is not None and not self.temperature >= 0:
+            raise ValueError(f"temperature must be >= 0, got {self.temperature}")
+        if self.top_p is not None and not 0 < self.top_p <= 1:
+            raise ValueError(f"top_p must be in (0, 1], got {self.top_p}")
+        if self.top_k is not None and self.top_k < 0:
+            raise ValueError(f"top_k must be >= 0, got {self.top_k}")
+        if any(not s for s in self.stop):
+            raise ValueError("stop_words must not contain empty strings")
+        if self.guide_type is not None:
+            if self.guide_type not in GUIDE_TYPES:
+                raise ValueError(f"guided_decoding_guide_type must be one of {GUIDE_TYPES}, got {self.guide_type!r}")
+            if self.guide_type != "json" and not self.guide:
+                raise ValueError(f"guided_decoding_guide is required for {self.guide_type}")
+        elif self.guide:
+            raise ValueError("guided_decoding_guide needs guided_decoding_guide_type")
+        return self
+
+    def as_dict(self):
+        """The set values (response cache key, ``response_cache.is_deterministic``)."""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values["stop"] = list(self.stop)
+        return {k: v for k, v in values.items() if v is not None and v != []}
+
+    def __repr__(self):
+        return f"SamplingParams({self.as_dict()})"
+
+
+def defaults_from_model_config(model_config):
+    """``SamplingParams`` of requests that set nothing, from the ``default_*`` parameters."""
+    return SamplingParams(
+        temperature=get_parameter(model_config, "default_temperature", None, float),
+        top_p=get_parameter(model_config, "default_top_p", None, float),
+        top_k=get_parameter(model_config, "default_top_k", None, int),
+    )
+
+
+def from_inputs(get_input, defaults):
+    """Read the optional inputs with ``get_input(name)`` (numpy array or None) over ``defaults``."""
+    temperature, top_p, top_k = defaults.temperature, defaults.top_p, defaults.top_k
+    seed, stop, guide_type, guide = defaults.seed, defaults.stop, None, None
+
+    value = get_input("temperature")
+    if value is not None:
+        temperature = float(_scalar(value))
+        if temperature == 0:  # greedy: the defaults' nucleus / top-k settings no longer apply
+            top_p, top_k = None, None
+    value = get_input("top_p")
+    if value is not None:
+        top_p = float(_scalar(value))
+    value = get_input("top_k")
+    if value is not None:
+        top_k = int(_scalar(value))
+    value = get_input("seed")
+    if value is not None:
+        seed = int(_scalar(value))
+    value = get_input("stop_words")
+    if value is not None:
+        stop = tuple(decode_text(s) for s in np.asarray(value).reshape(-1))
+    value = get_input("guided_decoding_guide_type")
+    if value is not None:
+        guide_type = decode_text(_scalar(value)) or None
+    value = get_input("guided_decoding_guide")
+    if value is not None:
+        guide = decode_text(_scalar(value)) or None
+
+    return SamplingParams(temperature, top_p, top_k, seed, stop, guide_type, guide).validate()
+
+
+def stop_words_list(tokenizer, stop):
+    """TRT-LLM ``stop_words_list`` ([1, 2, n] int32: flattened token IDs, end offsets padded with -1)."""
+    ids, offsets = [], []
+    for word in stop:
+        ids.extend(tokenizer(word, add_special_tokens=False)["input_ids"])
+        offsets.append(len(ids))
+    offsets += [-1] * (len(ids) - len(offsets))
+    return np.array([[ids, offsets]], dtype=np.int32)
+
+
+class StopMatcher:
+    """Cuts streamed text at the first stop string.
+
+    ``feed`` returns the text that is safe to send: text that could still
+    turn out to be the start of a stop string is held back until the next
+    delta decides it (``flush`` releases it at the end of generation).
+    """
+
+    def __init__(self, stop):
+        self.stop = tuple(stop)
+        self.longest = max((len(s) for s in self.stop), default=0)
+        self.stopped = False
+        self._held = ""
+
+    def feed(self, text):
+        if self.stopped or not text:
+            return ""
+        if not self.stop:
+            return text
+        buffer = self._held + text
+        hits = [i for i in (buffer.find(s) for s in self.stop) if i >= 0]
+        if hits:
+            self.stopped = True
+            self._held = ""
+            return buffer[:min(hits)]
+        # Hold back the longest suffix that is a prefix of a stop string
+        keep = 0
+        for n in range(min(self.longest - 1, len(buffer)), 0, -1):
+            tail = buffer[-n:]
+            if any(s.startswith(tail) for s in self.stop):
+                keep = n
+                break
+        self._held = buffer[len(buffer) - keep:] if keep else ""
+        return buffer[:len(buffer) - keep]
+
+    def flush(self):
+        held, self._held = self._held, ""
+        return "" if self.stopped else held
@@ -0,0 +1,254 @@
+"""Priority classes and per-tenant fair sharing of the BLS stream slots.
+
+In decoupled mode ``execute()`` may return before any response is sent,
+so each request is handed to a worker thread that drains its own BLS
+stream. Handing them over in arrival order lets one tenant's burst of
+document summaries fill every slot of TRT-LLM's in-flight batch while
+interactive chats wait behind it. ``FairScheduler`` queues requests per
+priority class and, inside a class, per tenant:
+
+* classes share the ``max_in_flight`` stream slots by weight (stride
+  scheduling: the eligible class with the lowest virtual time runs next
+  and advances by ``1 / weight``; a class that was idle starts at the
+  current virtual time instead of with banked credit)
+* a class never holds more than its own ``max_in_flight`` streams, so
+  bulk work cannot take the slots interactive requests need
+* tenants of a class take turns (round robin), so one tenant's backlog
+  does not delay another's requests of the same class
+
+Classes come from the ``scheduler_classes`` parameter, written as
+``name:weight:max_in_flight`` entries separated by commas; the first
+one is the default for requests without a ``priority`` input. Once
+``max_queued`` requests are waiting, ``submit`` blocks, so the surplus
+stays in Triton's scheduler queue (and shows up in its queue metrics)
+instead of piling up inside the model.
+
+With ``max_inflight_tokens`` every request also carries a token cost
+(its worst-case KV cache footprint, see ``synaplan_triton.admission``)
+and a request waits until the running ones leave room for it. Requests
+of other classes that fit start past it meanwhile, but only
+``max_bypass`` times (default ``max_in_flight``); after that it holds the
+line until room frees up, so long prompts are delayed, never starved. A
+request that is larger than the budget runs alone.
+"""
+import collections
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .config import get_parameter
+
+DEFAULT_CLASSES = "interactive:4:16,batch:1:12"
+DEFAULT_TENANT = ""
+
+
+class PriorityClass:
+
+    def __init__(self, name, weight=1.0, max_in_flight=None):
+        if weight <= 0:
+            raise ValueError(f"Priority class {name!r} needs a positive weight, got {weight}")
+        self.name = name
+        self.weight = weight
+        self.max_in_flight = max_in_flight
+        self.tenants = collections.OrderedDict()  # tenant -> deque of queued items, in turn order
+        self.queued = 0
+        self.in_flight = 0
+        self.virtual_time = 0.0
+
+    @property
+    def eligible(self):
+        return self.queued > 0 and (self.max_in_flight is None or self.in_flight < self.max_in_flight)
+
+    def push(self, tenant, item):
+        queue = self.tenants.get(tenant)
+        if queue is None:
+            queue = self.tenants[tenant] = collections.deque()
+        queue.append(item)
+        self.queued += 1
+
+    def pop(self):
+        """Next item of the tenant whose turn it is; the tenant moves to the back."""
+        tenant, queue = next(iter(self.tenants.items()))
+        item = queue.popleft()
+        del self.tenants[tenant]
+        if queue:
+            self.tenants[tenant] = queue
+        self.queued -= 1
+        return item
+
+    def peek(self):
+        return next(iter(self.tenants.values()))[0]
+
+
+def parse_classes(spec):
+    """``"name:weight:max_in_flight,..."`` -> ``[PriorityClass]`` (weight and cap are optional)."""
+    classes = []
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, *rest = [part.strip() for part in entry.split(":")]
+        weight = float(rest[0]) if rest and rest[0] else 1.0
+        max_in_flight = int(rest[1]) if len(rest) > 1 and rest[1] else None
+        classes.append(PriorityClass(name, weight, max_in_flight))
+    if not classes:
+        raise ValueError(f"No priority classes in {spec!r}")
+    return classes
+
+
+class _Item:
+    __slots__ = ("fn", "args", "future", "priority", "enqueued", "tokens", "bypassed")
+
+    def __init__(self, fn, args, future, priority, enqueued, tokens=0):
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.priority = priority
+        self.enqueued = enqueued
+        self.tokens = tokens
+        self.bypassed = 0  # times a request of another class started while this one waited for tokens
+
+
+class FairScheduler:
+
+    def __init__(self, classes, max_in_flight, max_queued=256, on_dispatch=None,
+                 thread_name_prefix="request", clock=time.perf_counter, max_inflight_tokens=None,
+                 max_bypass=None):
+        self.classes = {c.name: c for c in classes}
+        self.default_class = classes[0].name
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.max_inflight_tokens = max_inflight_tokens
+        self.max_bypass = max_in_flight if max_bypass is None else max_bypass
+        self.on_dispatch = on_dispatch  # on_dispatch(priority, queue_wait_seconds)
+        self.clock = clock
+
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=thread_name_prefix)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._queued = 0
+        self._tokens = 0
+        self._virtual_time = 0.0
+        self._closed = False
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queued(self):
+        return self._queued
+
+    @property
+    def tokens_in_flight(self):
+        return self._tokens
+
+    def resolve(self, priority):
+        """The class name for a request's ``priority`` input (None = default); ValueError if unknown."""
+        if not priority:
+            return self.default_class
+        if priority not in self.classes:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {', '.join(self.classes)}")
+        return priority
+
+    def submit(self, fn, *args, priority=None, tenant=DEFAULT_TENANT, tokens=0):
+        """Queue ``fn(*args)`` costing ``tokens``; returns a ``Future``. Blocks while ``max_queued`` requests wait."""
+        cls = self.classes[self.resolve(priority)]
+        future = Future()
+        with self._cond:
+            while self._queued >= self.max_queued and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+            if cls.queued == 0:
+                cls.virtual_time = max(cls.virtual_time, self._virtual_time)  # no credit for idle time
+            cls.push(tenant or DEFAULT_TENANT, _Item(fn, args, future, cls.name, self.clock(), tokens))
+            self._queued += 1
+            ready = self._take_ready()
+        self._start(ready)
+        return future
+
+    def stats(self):
+        with self._cond:
+            return {name: {"queued": c.queued, "in_flight": c.in_flight, "tenants": len(c.tenants)}
+                    for name, c in self.classes.items()}
+
+    def _take_ready(self):
+        """Dequeue everything that may start now (caller holds the lock)."""
+        ready = []
+        while self._in_flight < self.max_in_flight:
+            eligible = sorted((c for c in self.classes.values() if c.eligible), key=lambda c: c.virtual_time)
+            cls = next((c for c in eligible if self._fits(c.peek())), None)
+            if cls is None:
+                break  # every next request waits for room in the token budget
+            # Classes ahead whose next request does not fit are passed over, a bounded number of times
+            blocked = [c.peek() for c in eligible[:eligible.index(cls)]]
+            if any(item.bypassed >= self.max_bypass for item in blocked):
+                break
+            for item in blocked:
+                item.bypassed += 1
+            item = cls.pop()
+            self._virtual_time = cls.virtual_time
+            cls.virtual_time += 1.0 / cls.weight
+            cls.in_flight += 1
+            self._in_flight += 1
+            self._tokens += item.tokens
+            self._queued -= 1
+            ready.append(item)
+        if ready:
+            self._cond.notify_all()
+        return ready
+
+    def _fits(self, item):
+        return (self.max_inflight_tokens is None or not self._tokens
+                or self._tokens + item.tokens <= self.max_inflight_tokens)
+
+    def _start(self, ready):
+        now = self.clock()
+        for item in ready:
+            if self.on_dispatch is not None:
+                self.on_dispatch(item.priority, now - item.enqueued)
+            try:
+                self._pool.submit(self._run, item)
+            except Exception as e:
+                self._done(item)
+                item.future.set_exception(e)
+
+    def _run(self, item):
+        try:
+            if item.future.set_running_or_notify_cancel():
+                item.future.set_result(item.fn(*item.args))
+        except BaseException as e:
+            item.future.set_exception(e)
+        finally:
+            self._done(item)
+
+    def _done(self, item):
+        with self._cond:
+            self.classes[item.priority].in_flight -= 1
+            self._in_flight -= 1
+            self._tokens -= item.tokens
+            ready = self._take_ready()
+            self._cond.notify_all()
+        self._start(ready)
+
+    def shutdown(self, wait=True):
+        """Stop accepting requests; with ``wait``, run the queued ones and wait for all streams."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            while wait and (self._queued or self._in_flight):
+                self._cond.wait()
+        self._pool.shutdown(wait=wait)
+
+
+def from_model_config(model_config, max_in_flight, on_dispatch=None, thread_name_prefix="request",
+                      max_inflight_tokens=None):
+    """Build the scheduler from the ``scheduler_classes`` / ``scheduler_max_queued`` parameters."""
+    return FairScheduler(
+        parse_classes(get_parameter(model_config, "scheduler_classes", DEFAULT_CLASSES)),
+        max_in_flight,
+        max_queued=get_parameter(model_config, "scheduler_max_queued", 256, int),
+        on_dispatch=on_dispatch,
+        thread_name_prefix=thread_name_prefix,
+        max_inflight_tokens=max_inflight_tokens,
+    )
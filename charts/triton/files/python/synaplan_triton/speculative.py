@@ -0,0 +1,120 @@
+"""Speculative decoding for the ``mistral-cpu`` serial path.
+
+At batch size 1 a CPU decode step is bound by reading the weights, so
+verifying several drafted tokens in one forward pass costs about as much
+as generating one. ``speculative_mode`` selects where the drafts come
+from; both use the assisted generation built into ``model.generate``:
+
+* ``prompt_lookup`` - copy the ``speculative_num_tokens`` tokens that
+  followed the last occurrence of the current ``speculative_max_ngram``
+  tokens in the prompt. Free to draft and a good fit for RAG answers,
+  which quote their context.
+* ``draft_model`` - a small model from ``speculative_draft_dir`` (it
+  must share the tokenizer) proposes ``speculative_num_tokens`` tokens,
+  adapted per step by the ``heuristic`` schedule of ``transformers``.
+
+Sampling stays unbiased: draft tokens are accepted against the tokens
+the target model samples (or by speculative sampling for a draft model),
+and ``generate`` still hands every verified token to the streamer.
+Assisted generation prefills the whole prompt on its first step, so it
+cannot start from a reused ``past_key_values``; the backend turns KV
+cache reuse off while speculative decoding is on.
+
+``AcceptanceCounter`` measures a generation from the target model's
+forward calls: each call verifies the tokens drafted for it, and each
+verification step emits its accepted tokens plus one token sampled by
+the target model, so ``accepted = generated - steps``.
+"""
+from .config import get_parameter
+
+MODES = ("off", "prompt_lookup", "draft_model")
+
+
+class AcceptanceCounter:
+    """Drafted tokens and verification steps of one assisted ``generate()``."""
+
+    def __init__(self, model, prompt_tokens):
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.steps = 0
+        self.drafted = 0
+        self._handle = None
+
+    def __enter__(self):
+        self._handle = self.model.register_forward_pre_hook(self._pre_hook, with_kwargs=True)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._handle.remove()
+
+    def _pre_hook(self, module, args, kwargs):
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        if input_ids is None:
+            return
+        inputs = input_ids.shape[1]
+        if self.steps == 0:
+            self.drafted += max(0, inputs - self.prompt_tokens)  # the first call also prefills the prompt
+        else:
+            self.drafted += inputs - 1  # the last verified token + the drafts
+        self.steps += 1
+
+    def accepted(self, generated):
+        return max(0, generated - self.steps)
+
+
+class Speculation:
+    """``generate()`` arguments for one ``speculative_mode``."""
+
+    def __init__(self, mode, num_tokens=10, max_ngram=3, draft_model=None):
+        if mode not in MODES[1:]:
+            raise ValueError(f"speculative_mode must be one of {MODES}, got {mode!r}")
+        self.mode = mode
+        self.num_tokens = num_tokens
+        self.max_ngram = max_ngram
+        self.draft_model = draft_model
+        if draft_model is not None:
+            draft_model.generation_config.num_assistant_tokens = num_tokens
+
+    def generation_kwargs(self):
+        if self.mode == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": self.num_tokens, "max_matching_ngram_size": self.max_ngram}
+        return {"assistant_model": self.draft_model}
+
+    def track(self, model, prompt_tokens):
+        return AcceptanceCounter(model, prompt_tokens)
+
+    def describe(self):
+        if self.mode == "prompt_lookup":
+            return f"prompt lookup ({self.num_tokens} tokens, n-gram <= {self.max_ngram})"
+        return f"draft model {self.draft_model.config.name_or_path} ({self.num_tokens} tokens)"
+
+
+def load_draft_model(path, target):
+    """bf16 draft model from ``path``; ValueError unless it shares ``target``'s vocabulary."""
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    draft = AutoModelForCausalLM.from_pretrained(path, local_files_only=True, trust_remote_code=True,
+                                                 torch_dtype=torch.bfloat16, low_cpu_mem_usage=True)
+    if draft.config.vocab_size != target.config.vocab_size:
+        raise ValueError(f"Draft model vocabulary ({draft.config.vocab_size}) differs from the target model's "
+                         f"({target.config.vocab_size})")
+    return draft.eval()
+
+
+def from_model_config(model_config, model):
+    """Build the ``Speculation`` for ``model``, or None when ``speculative_mode`` is off."""
+    mode = get_parameter(model_config, "speculative_mode", "off")
+    if mode == "off":
+        return None
+    if mode not in MODES:
+        raise ValueError(f"speculative_mode must be one of {MODES}, got {mode!r}")
+    num_tokens = get_parameter(model_config, "speculative_num_tokens", 10, int)
+    max_ngram = get_parameter(model_config, "speculative_max_ngram", 3, int)
+    draft_model = None
+    if mode == "draft_model":
+        path = get_parameter(model_config, "speculative_draft_dir", "")
+        if not path:
+            raise ValueError("speculative_mode draft_model needs speculative_draft_dir")
+        draft_model = load_draft_model(path, model)
+    return Speculation(mode, num_tokens, max_ngram, draft_model)
@@ -0,0 +1,242 @@
+"""Tokenizer loading shared by the Python backends.
+
+``AutoTokenizer.from_pretrained`` costs each Triton instance process the
+``transformers`` (and ``torch``) import plus a parse of the tokenizer
+files. ``build-models.sh`` therefore compiles a single artifact next to
+the engine::
+
+    SYNAPLAN-TOKENIZER 1\\n
+    <header JSON: special tokens, chat template, source fingerprint>\\n
+    <serialized Rust tokenizer (tokenizer.json)>
+
+``load`` reads the artifact and builds a ``FastTokenizer`` from it, which
+only imports ``tokenizers`` and ``jinja2``. The serialized tokenizer is
+handed to the Rust side as one string, with no JSON round trip through
+Python objects; the string is dropped once it is parsed.
+``FastTokenizer`` implements the part of the Hugging Face tokenizer API
+the backends use (``__call__``, ``decode``, ``apply_chat_template``,
+``convert_tokens_to_ids`` and the special-token attributes), and the
+artifact is only written after it reproduced ``AutoTokenizer`` on a
+sample conversation.
+
+A missing or stale artifact (its source fingerprint no longer matches
+the weights directory) falls back to ``AutoTokenizer``; when the
+artifact path is writable the backend then compiles it for the next
+start. Compile by hand with::
+
+    python3 -m synaplan_triton.tokenizer /cache/weights/<model> <artifact>
+"""
+import json
+import os
+import sys
+
+from .config import get_parameter
+
+MAGIC = b"SYNAPLAN-TOKENIZER 1\n"
+
+SOURCE_FILES = ("tokenizer.json", "tokenizer_config.json", "special_tokens_map.json", "chat_template.jinja")
+
+SPECIAL_TOKENS = ("bos_token", "eos_token", "unk_token", "pad_token")
+
+VERIFY_CONVERSATION = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "Hello! Wie geht's?"},
+    {"role": "assistant", "content": " Fine, thanks.\n\n- item one\n- item two "},
+    {"role": "user", "content": "  Summarize: ‹café› 👍 [/INST] </s>"},
+]
+
+
+def source_fingerprint(weights_dir):
+    """Name, size and mtime of the files the tokenizer is built from."""
+    fingerprint = []
+    for name in SOURCE_FILES:
+        try:
+            st = os.stat(os.path.join(weights_dir, name))
+        except FileNotFoundError:
+            continue
+        fingerprint.append([name, st.st_size, st.st_mtime_ns])
+    return fingerprint
+
+
+def _compile_chat_template(template):
+    """Compile ``template`` in the same Jinja environment ``transformers`` uses."""
+    from datetime import datetime
+
+    import jinja2
+    from jinja2.ext import loopcontrols
+    from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+    def raise_exception(message):
+        raise jinja2.exceptions.TemplateError(message)
+
+    def tojson(x, ensure_ascii=False, indent=None, separators=None, sort_keys=False):
+        return json.dumps(x, ensure_ascii=ensure_ascii, indent=indent, separators=separators, sort_keys=sort_keys)
+
+    env = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True, extensions=[loopcontrols])
+    env.filters["tojson"] = tojson
+    env.globals["raise_exception"] = raise_exception
+    env.globals["strftime_now"] = lambda fmt: datetime.now().strftime(fmt)
+    return env.from_string(template)
+
+
+class FastTokenizer:
+    """``tokenizers.Tokenizer`` with the Hugging Face methods the backends call.
+
+    Padding and truncation are switched off once here, so no call
+    reconfigures the Rust tokenizer afterwards: ``decode`` and ``encode``
+    only take shared borrows and may run from several threads at once.
+    """
+
+    def __init__(self, tokenizer, special_tokens, chat_template):
+        tokenizer.no_padding()
+        tokenizer.no_truncation()
+        self._tokenizer = tokenizer
+        self.special_tokens_map = {k: v for k, v in special_tokens.items() if v is not None}
+        for key in SPECIAL_TOKENS:
+            token = special_tokens.get(key)
+            setattr(self, key, token)
+            setattr(self, key + "_id", tokenizer.token_to_id(token) if token is not None else None)
+        self.chat_template = chat_template
+        self._template = None
+
+    def __len__(self):
+        return self._tokenizer.get_vocab_size(with_added_tokens=True)
+
+    def __call__(self, text, add_special_tokens=True):
+        if isinstance(text, str):
+            return {"input_ids": self._tokenizer.encode(text, add_special_tokens=add_special_tokens).ids}
+        encodings = self._tokenizer.encode_batch(list(text), add_special_tokens=add_special_tokens)
+        return {"input_ids": [e.ids for e in encodings]}
+
+    def decode(self, token_ids, skip_special_tokens=False, **kwargs):
+        return self._tokenizer.decode(list(token_ids), skip_special_tokens=skip_special_tokens)
+
+    def convert_tokens_to_ids(self, token):
+        token_id = self._tokenizer.token_to_id(token)
+        return self.unk_token_id if token_id is None else token_id
+
+    def apply_chat_template(self, conversation, tokenize=True, add_generation_prompt=False, **kwargs):
+        if self._template is None:
+            self._template = _compile_chat_template(self.chat_template)
+        rendered = self._template.render(messages=conversation, tools=None, documents=None,
+                                         add_generation_prompt=add_generation_prompt,
+                                         **{**self.special_tokens_map, **kwargs})
+        if tokenize:
+            return self(rendered, add_special_tokens=False)["input_ids"]
+        return rendered
+
+
+def read_artifact(path):
+    """Return ``(header, FastTokenizer)`` for the artifact at ``path``."""
+    from tokenizers import Tokenizer
+
+    with open(path, "rb") as f:
+        if f.readline() != MAGIC:
+            raise ValueError(f"{path} is not a tokenizer artifact")
+        header = json.loads(f.readline())
+        tokenizer = Tokenizer.from_str(f.read().decode("utf-8"))
+    return header, FastTokenizer(tokenizer, header["special_tokens"], header["chat_template"])
+
+
+def verify(reference, candidate, conversation=VERIFY_CONVERSATION):
+    """True when ``candidate`` renders, encodes and decodes like ``reference``."""
+    rendered = reference.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True)
+    if candidate.apply_chat_template(conversation, tokenize=False, add_generation_prompt=True) != rendered:
+        return False
+    ids = reference(rendered, add_special_tokens=True)["input_ids"]
+    if candidate(rendered, add_special_tokens=True)["input_ids"] != ids:
+        return False
+    if candidate([rendered, "x"], add_special_tokens=False)["input_ids"] != \
+            reference([rendered, "x"], add_special_tokens=False)["input_ids"]:
+        return False
+    return all(candidate.decode(ids[:n], skip_special_tokens=s) == reference.decode(ids[:n], skip_special_tokens=s)
+               for n in (1, len(ids) // 2, len(ids)) for s in (True, False))
+
+
+def write_artifact(reference, weights_dir, path):
+    """Serialize the ``AutoTokenizer`` ``reference`` to ``path`` (atomically).
+
+    Raises ValueError if the artifact would not behave like ``reference``.
+    """
+    from tokenizers import Tokenizer
+
+    chat_template = reference.chat_template
+    if not isinstance(chat_template, str):
+        raise ValueError("Tokenizer has no (single) chat template")
+    if getattr(reference, "clean_up_tokenization_spaces", False):
+        raise ValueError("clean_up_tokenization_spaces is not supported")
+    header = {
+        "special_tokens": {k: str(getattr(reference, k)) if getattr(reference, k, None) is not None else None
+                           for k in SPECIAL_TOKENS},
+        "chat_template": chat_template,
+        "source": source_fingerprint(weights_dir),
+    }
+    serialized = reference.backend_tokenizer.to_str()
+    candidate = FastTokenizer(Tokenizer.from_str(serialized), header["special_tokens"], chat_template)
+    if not verify(reference, candidate):
+        raise ValueError("Compiled tokenizer does not reproduce AutoTokenizer output")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+        f.write(serialized.encode("utf-8"))
+    os.replace(tmp, path)
+
+
+def load_auto_tokenizer(weights_dir):
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(weights_dir, local_files_only=True, trust_remote_code=True,
+                                              padding_side="left")
+    tokenizer.pad_token = tokenizer.eos_token
+    # As in FastTokenizer: calls without padding / truncation arguments then never reconfigure the
+    # Rust tokenizer (a mutable borrow that would fail a decode running on another thread)
+    tokenizer.backend_tokenizer.no_padding()
+    tokenizer.backend_tokenizer.no_truncation()
+    return tokenizer
+
+
+def load(model_config, logger, default_weights_dir="/cache/weights/mistral-7b-instruct-v0.3"):
+    """Tokenizer for a backend from its ``weights_dir`` / ``tokenizer_artifact`` parameters.
+
+    Returns ``(tokenizer, source)`` with ``source`` one of ``"artifact"``
+    or ``"transformers"``.
+    """
+    weights_dir = get_parameter(model_config, "weights_dir", default_weights_dir)
+    artifact = get_parameter(model_config, "tokenizer_artifact", "")
+
+    if artifact and os.path.exists(artifact):
+        try:
+            header, tokenizer = read_artifact(artifact)
+            if header.get("source") == source_fingerprint(weights_dir) or not os.path.isdir(weights_dir):
+                tokenizer.pad_token, tokenizer.pad_token_id = tokenizer.eos_token, tokenizer.eos_token_id
+                return tokenizer, "artifact"
+            logger.warning("⚠️ Tokenizer artifact %s is stale, loading from %s", artifact, weights_dir)
+        except Exception as e:
+            logger.warning("⚠️ Tokenizer artifact %s unusable (%s), loading from %s", artifact, e, weights_dir)
+
+    tokenizer = load_auto_tokenizer(weights_dir)
+    if artifact and os.access(os.path.dirname(os.path.abspath(artifact)) or ".", os.W_OK):
+        try:
+            write_artifact(tokenizer, weights_dir, artifact)
+            logger.info("🗃️  Tokenizer artifact written to %s", artifact)
+        except Exception as e:
+            logger.warning("⚠️ Tokenizer artifact not written: %s", e)
+    return tokenizer, "transformers"
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("usage: python3 -m synaplan_triton.tokenizer <weights_dir> <artifact>", file=sys.stderr)
+        return 2
+    weights_dir, path = argv
+    write_artifact(load_auto_tokenizer(weights_dir), weights_dir, path)
+    print(f"Tokenizer artifact written to {path} ({os.path.getsize(path)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,199 +1,562 @@
+import contextlib
+import time
+IMPORT_START = time.perf_counter()
+
 import triton_python_backend_utils as pb_utils
 import numpy as np
 import json
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
+from transformers import AutoModelForCausalLM, LogitsProcessorList, StoppingCriteriaList
 from threading import Thread
-import traceback
+
+from synaplan_triton import cancellation, coalescer, cpu_affinity, guided, kv_cache, metrics, preprocess, prompt_cache, quantize, response_cache, sampling, speculative, tokenizer
+from synaplan_triton.batcher import ContinuousBatcher, Sequence, seeded_logits_processor
+from synaplan_triton.config import get_parameter, get_setting
+from synaplan_triton.detokenizer import IncrementalDetokenizer, text_streamer
+from synaplan_triton.log import TRACE, Lazy, StartupTimer, setup_logging, shutdown_logging
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START
 
 class TritonPythonModel:
 
     def initialize(self, args):
-        print("🔍 [DEBUG] Initializing PyTorch CPU Backend...", flush=True)
         self.model_config = json.loads(args['model_config'])
+        self.logger = logger = setup_logging(self.model_config.get("name", "mistral-cpu"), self.model_config)
+        logger.info("🔍 Initializing PyTorch CPU Backend...")
+        timer = StartupTimer(logger, started=IMPORT_START)
+        timer.add("imports", IMPORT_SECONDS)
+
+        # Pin this instance to its CPU partition before torch starts thread pools or touches weight pages
+        self.placement = cpu_affinity.from_model_config(self.model_config, args.get("model_instance_name", ""))
+        logger.info("📌 CPU placement: %s", self.placement.describe() if self.placement else "torch defaults")
 
         output_config = pb_utils.get_output_config_by_name(self.model_config, "text_output")
         self.output_dtype = pb_utils.triton_string_to_numpy(output_config['data_type'])
-        print(f"🔤 [DEBUG] Output dtype: {self.output_dtype}", flush=True)
+        logger.debug("🔤 Output dtype: %s", self.output_dtype)
 
-        # Load tokenizer
-        print("⏳ [DEBUG] Loading tokenizer...", flush=True)
-        model_path = "/cache/weights/mistral-7b-instruct-v0.3"
+        # Load tokenizer (compiled artifact if present, else HuggingFace)
+        logger.info("⏳ Loading tokenizer...")
+        model_path = get_parameter(self.model_config, "weights_dir", "/cache/weights/mistral-7b-instruct-v0.3")
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                model_path,
-                local_files_only=True,
-                trust_remote_code=True,
-                padding_side='left'
-            )
-            self.tokenizer.pad_token = self.tokenizer.eos_token
-            print(f"✅ [DEBUG] Tokenizer loaded from {model_path}", flush=True)
-        except Exception as e:
-            print(f"❌ [CRITICAL] Failed to load tokenizer: {str(e)}", flush=True)
+            with timer.stage("tokenizer"):
+                self.tokenizer, source = tokenizer.load(self.model_config, logger)
+            logger.info("✅ Tokenizer loaded from %s (%s)", model_path, source)
+        except Exception:
+            logger.critical("❌ Failed to load tokenizer", exc_info=True)
             raise
 
-        # Load model on CPU
-        print("⏳ [DEBUG] Loading model on CPU (this may take a while)...", flush=True)
+        # TTFT / inter-token latency / tokens-per-second histograms, cache counters on Triton's /metrics
+        self.metrics = metrics.from_model_config(self.model_config.get("name", "mistral-cpu"), self.model_config)
+
+        # Token-ID cache for repeated system prompts / chat history
         try:
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                local_files_only=True,
-                trust_remote_code=True,
-                torch_dtype=torch.bfloat16,
-                low_cpu_mem_usage=True
-            )
-            self.model = self.model.to('cpu')
-            self.model.eval()
-            print(f"✅ [DEBUG] Model loaded on CPU with bfloat16", flush=True)
+            with timer.stage("prompt_cache"):
+                self.prompt_cache = prompt_cache.from_model_config(self.tokenizer, self.model_config, self.metrics)
+            logger.info("🗃️  Prompt prefix cache: %s", "enabled" if self.prompt_cache else "disabled")
         except Exception as e:
-            print(f"❌ [CRITICAL] Failed to load model: {str(e)}", flush=True)
+            self.prompt_cache = None
+            logger.warning("⚠️ Prompt prefix cache disabled: %s", e)
+
+        # Load model on CPU: memory-mapped int8/int4 weights from build-models.sh (weight_precision, set by
+        # cpuQuantization), else the bf16 checkpoint. Quantized weights that do not load are an error, not a
+        # fallback: every instance would load a private ~15 GB bf16 copy, beyond the pod's memory limit
+        weight_precision = get_setting(self.model_config, "weight_precision", "SYNAPLAN_CPU_WEIGHT_PRECISION", "bf16")
+        self.loaded_weights = None  # what was actually loaded: precision and quantization manifest
+        logger.info("⏳ Loading model on CPU (this may take a while)...")
+        try:
+            with timer.stage("model"):
+                if weight_precision != "bf16":
+                    artifact = quantize.artifact_dir(self.model_config, weight_precision)
+                    try:
+                        self.model = quantize.load(artifact, model_path)
+                    except Exception as e:
+                        raise RuntimeError(f"{weight_precision} weights in {artifact} unusable ({e}); rerun the "
+                                           f"cpu-quantize init container or unset weight_precision for bf16") from e
+                    self.loaded_weights = [weight_precision, quantize.read_manifest(artifact)]
+                    logger.info("✅ Model loaded on CPU with %s weight-only quantization from %s (memory-mapped)",
+                                weight_precision, artifact)
+                else:
+                    self.model = AutoModelForCausalLM.from_pretrained(
+                        model_path,
+                        local_files_only=True,
+                        trust_remote_code=True,
+                        torch_dtype=torch.bfloat16,
+                        low_cpu_mem_usage=True
+                    )
+                    self.model = self.model.to('cpu')
+                    self.model.eval()
+                    self.loaded_weights = ["bf16"]
+                    logger.info("✅ Model loaded on CPU with bfloat16")
+        except Exception:
+            logger.critical("❌ Failed to load model", exc_info=True)
             raise
 
-        print("🟢 [DEBUG] PyTorch CPU Backend initialization complete.", flush=True)
+
+        # Sampling of requests without sampling inputs (default_* parameters); guides compile with xgrammar on first use
+        self.default_sampling = sampling.defaults_from_model_config(self.model_config)
+        self.guides = guided.from_model_config(self.model_config, self.tokenizer, self.model.config.vocab_size)
+        logger.info("🎲 Default sampling: %s (guided decoding: %s)", self.default_sampling,
+                    "enabled" if self.guides else "disabled")
+
+        # Replay stored responses for repeated greedy requests (temperature 0 or top_k 1), namespaced by the
+        # weights (file sizes and mtimes) and the precision actually loaded
+        try:
+            weights_identity = quantize.source_fingerprint(model_path)
+        except OSError:
+            weights_identity = None
+        self.response_cache = response_cache.from_model_config(self.model_config, response_cache.namespace(
+            model_path, weights_identity, self.loaded_weights))
+        logger.info("🗃️  Response cache: %s (disk tier: %s)", "enabled" if self.response_cache else "disabled",
+                    self.response_cache.disk_dir if self.response_cache and self.response_cache.disk_dir else "off")
+
+        # Poll for client cancellation between tokens and stop generating for cancelled requests
+        self.new_cancellation_watch = cancellation.from_model_config(self.model_config)
+
+        # Flush policy for streamed text: one response per N tokens / M ms / newline / sentence end
+        self.new_coalescer = coalescer.from_model_config(self.model_config)
+
+        # Speculative decoding: drafts from the prompt or a small model, verified in one forward pass
+        try:
+            with timer.stage("speculative"):
+                self.speculation = speculative.from_model_config(self.model_config, self.model)
+        except Exception as e:
+            self.speculation = None
+            logger.warning("⚠️ Speculative decoding disabled: %s", e)
+        logger.info("🔮 Speculative decoding: %s", self.speculation.describe() if self.speculation else "off")
+
+        # Per-conversation past_key_values reuse across turns (assisted generate() always prefills the whole prompt)
+        self.kv_cache = (kv_cache.from_model_config(self.model_config, self.metrics)
+                         if self.speculation is None else None)
+        logger.info("🗃️  KV cache reuse: %s", "enabled" if self.kv_cache else "disabled")
+
+        # Continuous batching: one scheduler thread decodes all active requests together
+        self.batching_mode = get_parameter(self.model_config, "batching_mode", "continuous")
+        if self.speculation is not None and self.batching_mode != "serial":
+            # assisted generate() runs one sequence at a time
+            logger.info("ℹ️ Speculative decoding needs batching_mode serial, ignoring %s", self.batching_mode)
+            self.batching_mode = "serial"
+        self.batcher = None
+        if self.batching_mode == "continuous":
+            self.batcher = ContinuousBatcher(
+                self.model,
+                eos_token_id=self.tokenizer.eos_token_id,
+                max_batch_size=get_parameter(self.model_config, "max_active_sequences", 8, int),
+                on_token=self._send_batched_token,
+                on_finish=self._finish_batched,
+                kv_cache=self.kv_cache,
+            )
+        logger.info("🧵 Batching mode: %s", self.batching_mode)
+
+        logger.info("🟢 PyTorch CPU Backend initialization complete.")
+        timer.report()
 
 
     def execute(self, requests):
-        print(f"📬 [DEBUG] Received {len(requests)} request(s)", flush=True)
+        arrival = time.perf_counter()
+        logger = self.logger
+        logger.debug("📬 Received %d request(s)", len(requests))
+
+        request_metrics = [self.metrics.request(arrival) for _ in requests]
+        prepared = self._preprocess(requests, request_metrics)
 
         for idx, request in enumerate(requests):
-            print(f"📨 [DEBUG] Processing request {idx + 1}/{len(requests)}", flush=True)
+            if prepared[idx] is None:
+                continue  # error response already sent
+            input_ids, max_tokens, params = prepared[idx]
+            logger.debug("📨 Processing request %d/%d (prompt tokens: %d, max tokens: %d)",
+                         idx + 1, len(requests), input_ids.shape[1], max_tokens)
+
+            # Identical greedy request seen before: replay its chunks instead of generating
+            cache_key = None
+            if self.response_cache is not None and response_cache.is_deterministic(params.as_dict()):
+                cache_key = self.response_cache.key(input_ids[0].tolist(), max_tokens, params.as_dict())
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    self._replay(request.get_response_sender(), cached, request_metrics[idx])
+                    continue
+                self.metrics.increment("response_cache_misses_total")
 
-            # Extract inputs
+            # Grammar state of a structured-output request (the compiled grammar is cached)
+            try:
+                guide = self._new_guide(params)
+            except Exception as e:
+                logger.error("❌ Guided decoding setup failed: %s", e)
+                self._send_error(request, f"Guided decoding error: {e}")
+                continue
+
+            if self.batcher is not None:
+                # Joins the shared decode loop; responses are sent from the batcher thread
+                request_metrics[idx].detokenize_seconds = 0.0
+                prompt_ids = input_ids[0].tolist()
+                response_sender = request.get_response_sender()
+                self.batcher.submit(Sequence(
+                    prompt_ids,
+                    max_tokens,
+                    temperature=params.temperature or 0.0,
+                    top_p=params.top_p if params.top_p is not None else 1.0,
+                    top_k=params.top_k or 0,
+                    seed=params.seed,
+                    guide=guide,
+                    context={
+                        "sender": response_sender,
+                        "cancelled": self.new_cancellation_watch(response_sender),
+                        "detokenizer": IncrementalDetokenizer(self.tokenizer, prompt_ids),
+                        "pending": self.new_coalescer(),
+                        "stop": sampling.StopMatcher(params.stop),
+                        "start_time": time.time(),
+                        "metrics": request_metrics[idx],
+                        "cache_key": cache_key,
+                        "sent": [],
+                        "complete": True,  # every chunk decoded and delivered; a partial response is not cached
+                    },
+                ))
+                logger.debug("🧵 Queued for continuous batching (active=%d, queued=%d)", self.batcher.active, self.batcher.queued)
+            else:
+                self._generate_serial(request, input_ids, max_tokens, params, guide, request_metrics[idx], cache_key)
+
+        logger.debug("✅ All requests processed.")
+        return None  # Required for decoupled mode
+
+
+    def _send_error(self, request, message):
+        response_sender = request.get_response_sender()
+        error_response = pb_utils.InferenceResponse(
+            output_tensors=[],
+            error=pb_utils.TritonError(message)
+        )
+        response_sender.send(error_response, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+
+
+    def _preprocess(self, requests, request_metrics):
+        """Parse all requests, then render and tokenize them in one batch.
+
+        Returns ``(input_ids [1, seq] long tensor, max_tokens, SamplingParams)``
+        per request, or None for requests that failed (their error response is
+        already sent).
+        """
+        logger = self.logger
+
+        # Extract inputs
+        conversations, max_tokens, params = [], [], []
+        for request in requests:
             try:
                 conversation_input = pb_utils.get_input_tensor_by_name(request, "conversation")
                 if conversation_input is None:
                     raise ValueError("Input 'conversation' not found")
+                conversation = preprocess.decode_conversation(conversation_input.as_numpy().reshape(-1)[0])
+                logger.log(TRACE, "💬 Parsed conversation: %r", conversation)
 
-                raw_conversation = conversation_input.as_numpy()[0]
-                if isinstance(raw_conversation, bytes):
-                    conversation_json = raw_conversation.decode('utf-8')
-                elif isinstance(raw_conversation, str):
-                    conversation_json = raw_conversation
-                else:
-                    conversation_json = raw_conversation.item().decode('utf-8')
+                max_tokens_input = pb_utils.get_input_tensor_by_name(request, "max_tokens")
+                request_max_tokens = int(max_tokens_input.as_numpy().reshape(-1)[0]) if max_tokens_input else 512
+                request_params = sampling.from_inputs(lambda name: self._optional_input(request, name),
+                                                      self.default_sampling)
+                # Appended only once every input parsed, so the lists stay aligned with the batch
+                max_tokens.append(request_max_tokens)
+                params.append(request_params)
+                conversations.append(conversation)
+            except Exception as e:
+                logger.error("❌ Input parsing failed: %s", e)
+                max_tokens.append(None)
+                params.append(None)
+                conversations.append(e)
 
-                conversation = json.loads(conversation_json)
-                print(f"💬 [DEBUG] Parsed conversation: {conversation!r}", flush=True)
+        # Apply chat template + tokenize (one batch call)
+        tokenize_start = time.perf_counter()
+        try:
+            encoded = preprocess.prepare_batch(self.tokenizer, conversations, self.prompt_cache, np.int64)
+        except Exception as e:
+            encoded = [c if isinstance(c, Exception) else e for c in conversations]
+        tokenize_seconds = time.perf_counter() - tokenize_start
+        logger.debug("✅ Tokenized %d request(s) in %.4fs", len(requests), tokenize_seconds)
+        if self.prompt_cache is not None:
+            logger.debug("🗃️  Prompt cache stats: %s", Lazy(self.prompt_cache.stats))
 
-                # Validate conversation
-                if not isinstance(conversation, list):
-                    raise ValueError("Conversation must be a list")
-                for msg in conversation:
-                    if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
-                        raise ValueError("Each message must have 'role' and 'content'")
+        prepared = []
+        for request, conversation, result, tokens, p, rm in zip(requests, conversations, encoded, max_tokens, params,
+                                                                request_metrics):
+            if isinstance(conversation, Exception):
+                self._send_error(request, f"Input error: {conversation}")
+                prepared.append(None)
+            elif isinstance(result, Exception):
+                logger.error("❌ Tokenization failed: %s", result)
+                self._send_error(request, f"Tokenization error: {result}")
+                prepared.append(None)
+            else:
+                rm.tokenize_seconds = tokenize_seconds
+                rm.prompt_tokens = result.shape[1]
+                prepared.append((torch.from_numpy(result), tokens, p))  # shares the packed buffer
+        return prepared
 
-                max_tokens_input = pb_utils.get_input_tensor_by_name(request, "max_tokens")
-                max_tokens = int(max_tokens_input.as_numpy()[0]) if max_tokens_input else 512
-                print(f"🔢 [DEBUG] Max tokens: {max_tokens}", flush=True)
 
-            except Exception as e:
-                print(f"❌ [ERROR] Input parsing failed: {str(e)}", flush=True)
-                response_sender = request.get_response_sender()
-                error_response = pb_utils.InferenceResponse(
-                    output_tensors=[],
-                    error=pb_utils.TritonError(f"Input error: {str(e)}")
-                )
-                response_sender.send(error_response, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
-                continue
+    def _optional_input(self, request, name):
+        tensor = pb_utils.get_input_tensor_by_name(request, name)
+        return tensor.as_numpy() if tensor is not None else None
 
-            # Apply chat template
-            try:
-                print("🧩 [DEBUG] Applying chat template...", flush=True)
-                rendered = self.tokenizer.apply_chat_template(
-                    conversation,
-                    tokenize=False,
-                    add_generation_prompt=True
-                )
-                print(f"📜 [DEBUG] Rendered prompt: {rendered[:100]}...", flush=True)
 
-                inputs = self.tokenizer(rendered, return_tensors="pt", add_special_tokens=True)
-                input_ids = inputs["input_ids"]
-                print(f"✅ [DEBUG] Tokenized. Input length: {input_ids.shape[1]}", flush=True)
+    def _new_guide(self, params):
+        if params.guide_type is None:
+            return None
+        if self.guides is None:
+            raise ValueError("guided decoding is disabled for this model")
+        return self.guides.new_guide(params)
 
-            except Exception as e:
-                print(f"❌ [ERROR] Tokenization failed: {str(e)}", flush=True)
-                response_sender = request.get_response_sender()
-                error_response = pb_utils.InferenceResponse(
-                    output_tensors=[],
-                    error=pb_utils.TritonError(f"Tokenization error: {str(e)}")
-                )
-                response_sender.send(error_response, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
-                continue
 
-            # Start streaming inference
-            response_sender = request.get_response_sender()
-            print("🌀 [DEBUG] Starting streaming generation...", flush=True)
+    def _generate_serial(self, request, input_ids, max_tokens, params, guide, request_metrics, cache_key=None):
+        # Start streaming inference
+        logger = self.logger
+        trace = logger.isEnabledFor(TRACE)  # checked once; per-token logging is off by default
+        response_sender = request.get_response_sender()
+        cancelled = self.new_cancellation_watch(response_sender)
+        if cancelled():
+            self._finish_cancelled(response_sender, 0, request_metrics)
+            return
+        logger.debug("🌀 Starting streaming generation...")
+
+        try:
+            # Create streamer (yields the text of each step with its number of tokens)
+            streamer = text_streamer(self.tokenizer, skip_special_tokens=True)
+
+            # Generation kwargs
+            stop = sampling.StopMatcher(params.stop)
+            do_sample = bool(params.temperature) and params.top_k != 1
+            generation_kwargs = {
+                "input_ids": input_ids,
+                "max_new_tokens": max_tokens,
+                "streamer": streamer,
+                "do_sample": do_sample,
+                "pad_token_id": self.tokenizer.eos_token_id,
+                "return_dict_in_generate": True,
+                # Ends generate() early once the client has gone away or a stop string was streamed
+                "stopping_criteria": StoppingCriteriaList([
+                    cancellation.stopping_criteria(lambda: cancelled() or stop.stopped)]),
+            }
+            processors = LogitsProcessorList()
+            if guide is not None:
+                processors.append(guided.logits_processor(guide))
+            if do_sample and params.seed is not None:
+                # Drawn from the request's own generator (as in the batcher), then taken greedily by generate()
+                processors.append(seeded_logits_processor(params.temperature, params.top_p or 1.0, params.top_k or 0,
+                                                          params.seed))
+                generation_kwargs["do_sample"] = False
+            elif do_sample:
+                generation_kwargs.update(temperature=params.temperature, top_p=params.top_p or 1.0,
+                                         top_k=params.top_k or 0)
+            if processors:
+                generation_kwargs["logits_processor"] = processors
 
+            # Reuse the KV cache of an earlier turn: prefill only runs over the new tokens
+            if self.kv_cache is not None:
+                past_key_values, reused = self.kv_cache.take(input_ids[0].tolist())
+                if past_key_values is not None:
+                    generation_kwargs["past_key_values"] = past_key_values
+                logger.debug("🗃️  KV cache reused %d/%d prompt tokens", reused, input_ids.shape[1])
+
+            # Draft several tokens per step and verify them in one forward pass of the model
+            # (drafts bypass the grammar mask, so guided requests decode one token per step)
+            acceptance = None
+            if self.speculation is not None and guide is None:
+                generation_kwargs.update(self.speculation.generation_kwargs())
+                acceptance = self.speculation.track(self.model, input_ids.shape[1])
+
+            # Start generation in background thread
+            generation = {}
+            thread = Thread(target=self._generate, args=(generation_kwargs, generation, acceptance))
+            thread.start()
+
+            # Stream tokens (the streamer yields whole words; the coalescer may merge several per response)
+            pending = self.new_coalescer()
+            sent = []
+            complete = True  # every chunk delivered; a partial response is not cached
+            token_count = 0
+            for word, step_tokens in streamer:
+                text_chunk = pending.add(stop.feed(word))
+                if text_chunk and not cancelled.cancelled:
+                    token_count += 1
+                    try:
+                        response = pb_utils.InferenceResponse(output_tensors=[
+                            pb_utils.Tensor("text_output", np.array([text_chunk], dtype=object)),
+                            pb_utils.Tensor("is_final", np.array([False], dtype=bool))
+                        ])
+                        response_sender.send(response)
+                        sent.append(text_chunk)
+                        if trace:
+                            logger.log(TRACE, "📤 Sent chunk #%d: %r", token_count, text_chunk)
+                    except Exception as e:
+                        logger.error("❌ Failed to send chunk: %s", e)
+                        complete = False
+                for _ in range(step_tokens):
+                    request_metrics.token()
+
+            thread.join()
+            if "error" in generation:
+                raise generation["error"]
+            if acceptance is not None:
+                request_metrics.drafted_tokens = acceptance.drafted
+                request_metrics.accepted_tokens = acceptance.accepted(request_metrics.tokens)
+                logger.debug("🔮 Accepted %d/%d drafted tokens in %d steps", request_metrics.accepted_tokens,
+                             acceptance.drafted, acceptance.steps)
+            logger.info("✅ Generation complete. Prompt tokens: %d. Sent %d chunks", input_ids.shape[1], token_count)
+
+            if self.kv_cache is not None:
+                self._store_kv_cache(generation["output"])
+            if cancelled.cancelled:
+                self._finish_cancelled(response_sender, request_metrics.tokens, request_metrics)
+                return
+
+            # Send final flag with any text still buffered
+            tail = (pending.add(stop.flush(), tokens=0) or "") + pending.flush()
+            final_resp = pb_utils.InferenceResponse(output_tensors=[
+                pb_utils.Tensor("text_output", np.array([tail], dtype=object)),
+                pb_utils.Tensor("is_final", np.array([True], dtype=bool))
+            ])
+            if cache_key is not None and complete:  # before the final response, so an immediate retry already hits
+                self.response_cache.put(cache_key, sent + [tail])
+            response_sender.send(final_resp, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+            request_metrics.finish()
+
+        except Exception as e:
+            logger.critical("❌ Generation error: %s", e, exc_info=True)
             try:
-                # Create streamer
-                streamer = TextIteratorStreamer(
-                    self.tokenizer,
-                    skip_prompt=True,
-                    skip_special_tokens=True
+                response_sender.send(
+                    pb_utils.InferenceResponse(
+                        output_tensors=[],
+                        error=pb_utils.TritonError(f"Generation error: {str(e)}")
+                    ),
+                    flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL
                 )
+            except Exception as send_err:
+                logger.error("❌ Failed to send error response: %s", send_err)
+
 
-                # Generation kwargs
-                generation_kwargs = {
-                    "input_ids": input_ids,
-                    "max_new_tokens": max_tokens,
-                    "streamer": streamer,
-                    "do_sample": True,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "pad_token_id": self.tokenizer.eos_token_id,
-                }
-
-                # Start generation in background thread
-                thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
-                thread.start()
-
-                # Stream tokens
-                token_count = 0
-                for text_chunk in streamer:
-                    if text_chunk:
-                        token_count += 1
-                        try:
-                            response = pb_utils.InferenceResponse(output_tensors=[
-                                pb_utils.Tensor("text_output", np.array([text_chunk], dtype=object)),
-                                pb_utils.Tensor("is_final", np.array([False], dtype=bool))
-                            ])
-                            response_sender.send(response)
-                            print(f"📤 [DEBUG] Sent chunk #{token_count}: {text_chunk!r}", flush=True)
-                        except Exception as e:
-                            print(f"❌ [ERROR] Failed to send chunk: {e}", flush=True)
-
-                thread.join()
-                print(f"✅ [DEBUG] Generation complete. Sent {token_count} chunks", flush=True)
-
-                # Send final flag
-                final_resp = pb_utils.InferenceResponse(output_tensors=[
-                    pb_utils.Tensor("text_output", np.array([""], dtype=object)),
-                    pb_utils.Tensor("is_final", np.array([True], dtype=bool))
+    def _send_batched_token(self, seq, token_id):
+        """Batcher callback: detokenize and stream one token of ``seq``; False cancels it."""
+        ctx = seq.context
+        if ctx["cancelled"]():
+            return False
+        request_metrics = ctx["metrics"]
+        try:
+            decode_start = time.perf_counter()
+            delta = ctx["detokenizer"].step(token_id)
+            request_metrics.detokenize_seconds += time.perf_counter() - decode_start
+            text_chunk = ctx["pending"].add(ctx["stop"].feed(delta))
+            seq.stopped = ctx["stop"].stopped
+            if text_chunk:
+                response = pb_utils.InferenceResponse(output_tensors=[
+                    pb_utils.Tensor("text_output", np.array([text_chunk], dtype=object)),
+                    pb_utils.Tensor("is_final", np.array([False], dtype=bool))
                 ])
-                response_sender.send(final_resp, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+                ctx["sender"].send(response)
+                ctx["sent"].append(text_chunk)
+                self.logger.log(TRACE, "📤 Sent chunk #%d: %r", seq.generated, text_chunk)
+        except Exception as e:
+            self.logger.error("❌ Failed to send chunk: %s", e)
+            ctx["complete"] = False
+        request_metrics.token()
 
-            except Exception as e:
-                print(f"❌ [CRITICAL] Generation error: {str(e)}", flush=True)
-                print(traceback.format_exc(), flush=True)
-                try:
-                    response_sender.send(
-                        pb_utils.InferenceResponse(
-                            output_tensors=[],
-                            error=pb_utils.TritonError(f"Generation error: {str(e)}")
-                        ),
-                        flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL
-                    )
-                except Exception as send_err:
-                    print(f"❌ [ERROR] Failed to send error response: {str(send_err)}", flush=True)
 
-        print("✅ [DEBUG] All requests processed.", flush=True)
-        return None  # Required for decoupled mode
+    def _finish_batched(self, seq, error):
+        """Batcher callback: flush held-back text and close the response stream."""
+        ctx = seq.context
+        if seq.cancelled:
+            self._finish_cancelled(ctx["sender"], seq.generated, ctx["metrics"])
+            return
+        try:
+            if error is not None:
+                self.logger.critical("❌ Generation error: %s", error, exc_info=error)
+                ctx["sender"].send(
+                    pb_utils.InferenceResponse(
+                        output_tensors=[],
+                        error=pb_utils.TritonError(f"Generation error: {str(error)}")
+                    ),
+                    flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL
+                )
+                return
+
+            tail = ctx["pending"].add(ctx["stop"].feed(ctx["detokenizer"].flush()), tokens=0) or ""
+            tail += ctx["pending"].add(ctx["stop"].flush(), tokens=0) or ""
+            tail += ctx["pending"].flush()
+            final_resp = pb_utils.InferenceResponse(output_tensors=[
+                pb_utils.Tensor("text_output", np.array([tail], dtype=object)),
+                pb_utils.Tensor("is_final", np.array([True], dtype=bool))
+            ])
+            if ctx["cache_key"] is not None and ctx["complete"]:
+                self.response_cache.put(ctx["cache_key"], ctx["sent"] + [tail])
+            ctx["sender"].send(final_resp, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+            elapsed = time.time() - ctx["start_time"]
+            self.logger.info("✅ Generation complete. %d tokens in %.2fs (reused %d/%d prompt tokens)",
+                             seq.generated, elapsed, seq.reused_tokens, len(seq.input_ids))
+            ctx["metrics"].finish()
+        except Exception as e:
+            self.logger.error("❌ Failed to send final response: %s", e)
+
+
+    def _replay(self, response_sender, chunks, request_metrics):
+        """Stream a cached response: the stored chunks, then the final one."""
+        self.metrics.increment("response_cache_hits_total")
+        try:
+            for i, chunk in enumerate(chunks[:-1]):
+                response_sender.send(pb_utils.InferenceResponse(output_tensors=[
+                    pb_utils.Tensor("text_output", np.array([chunk], dtype=object)),
+                    pb_utils.Tensor("is_final", np.array([False], dtype=bool))
+                ]))
+                if i == 0:
+                    request_metrics.replay()
+            response_sender.send(pb_utils.InferenceResponse(output_tensors=[
+                pb_utils.Tensor("text_output", np.array([chunks[-1]], dtype=object)),
+                pb_utils.Tensor("is_final", np.array([True], dtype=bool))
+            ]), flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+            if request_metrics.first_token_time is None:
+                request_metrics.replay()
+            request_metrics.finish()
+            self.logger.info("✅ Replayed cached response (%d chunks).", len(chunks))
+        except Exception as e:
+            self.logger.error("❌ Failed to replay cached response: %s", e)
+
+
+    def _finish_cancelled(self, response_sender, token_count, request_metrics):
+        self.logger.info("🚫 Request cancelled by client after %d tokens.", token_count)
+        self.metrics.increment("cancelled_requests_total")
+        request_metrics.finish()  # the tokens it got still count towards latency and throughput
+        try:
+            response_sender.send(flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+        except Exception as e:
+            self.logger.debug("ℹ️ Could not close cancelled stream: %s", e)
+
+
+    def _generate(self, generation_kwargs, generation, acceptance=None):
+        """Thread target: keep generate()'s output and unblock the streamer on failure."""
+        try:
+            with acceptance or contextlib.nullcontext():
+                generation["output"] = self.model.generate(**generation_kwargs)
+        except Exception as e:
+            generation["error"] = e
+            generation_kwargs["streamer"].end()
+
+
+    def _store_kv_cache(self, output):
+        past_key_values = getattr(output, "past_key_values", None)
+        if past_key_values is None:
+            return
+        try:
+            # The cache covers every token except the last sampled one
+            cached_len = past_key_values.get_seq_length()
+            self.kv_cache.put(output.sequences[0, :cached_len].tolist(), past_key_values)
+            self.logger.debug("🗃️  KV cache stats: %s", Lazy(self.kv_cache.stats))
+        except Exception as e:
+            self.logger.warning("⚠️ Could not store KV cache: %s", e)
 
 
     def finalize(self):
-        print("🧹 [DEBUG] Finalizing PyTorch CPU Backend...", flush=True)
+        self.logger.info("🧹 Finalizing PyTorch CPU Backend...")
+        if getattr(self, 'batcher', None) is not None:
+            self.batcher.stop()
+        if getattr(self, 'kv_cache', None) is not None:
+            self.logger.info("🗃️  KV cache stats: %s", self.kv_cache.stats())
+        if getattr(self, 'response_cache', None) is not None:
+            self.logger.info("🗃️  Response cache stats: %s", self.response_cache.stats())
         if hasattr(self, 'model'):
             del self.model
         if hasattr(self, 'tokenizer'):
             del self.tokenizer
-        print("✅ [DEBUG] Cleanup complete.", flush=True)
+        self.logger.info("✅ Cleanup complete.")
+        shutdown_logging()
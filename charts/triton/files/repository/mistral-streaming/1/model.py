@@ -1,323 +1,577 @@
+import time
+IMPORT_START = time.perf_counter()
+
 import triton_python_backend_utils as pb_utils
 import numpy as np
 import json
-from transformers import AutoTokenizer
-import time
-import traceback
+import threading
+import uuid
+
+from synaplan_triton import admission, cancellation, coalescer, engine_cache, metrics, preprocess, prompt_cache, response_cache, sampling, scheduler, tokenizer
+from synaplan_triton.config import get_parameter
+from synaplan_triton.detokenizer import IncrementalDetokenizer
+from synaplan_triton.log import TRACE, Lazy, StartupTimer, setup_logging, shutdown_logging
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START
 
 class TritonPythonModel:
 
     def initialize(self, args):
-        print("🔍 [DEBUG] Initializing Python Backend Wrapper...", flush=True)
         self.model_config = model_config = json.loads(args['model_config'])
-        print(f"📊 [DEBUG] Model config loaded: {json.dumps(model_config, indent=2)}", flush=True)
+        self.logger = logger = setup_logging(model_config.get("name", "mistral-streaming"), model_config)
+        logger.info("🔍 Initializing Python Backend Wrapper...")
+        timer = StartupTimer(logger, started=IMPORT_START)
+        timer.add("imports", IMPORT_SECONDS)
+        logger.debug("📊 Model config loaded: %s", Lazy(json.dumps, model_config, indent=2))
 
         output_config = pb_utils.get_output_config_by_name(model_config, "text_output")
         self.output_dtype = pb_utils.triton_string_to_numpy(output_config['data_type'])
-        print(f"🔤 [DEBUG] Output dtype for 'text_output': {self.output_dtype}", flush=True)
+        logger.debug("🔤 Output dtype for 'text_output': %s", self.output_dtype)
 
-        # Load tokenizer — critical step
-        print("⏳ [DEBUG] Loading HuggingFace tokenizer for Mistral-7B...", flush=True)
+        # Load tokenizer — critical step (compiled artifact from build-models.sh, else HuggingFace)
+        logger.info("⏳ Loading tokenizer for Mistral-7B...")
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(
-              "/cache/weights/mistral-7b-instruct-v0.3",
-              local_files_only=True,
-              trust_remote_code=True,
-              padding_side='left'
-            )
-            self.tokenizer.pad_token = self.tokenizer.eos_token
-            print(f"✅ [DEBUG] Tokenizer loaded. Pad token: '{self.tokenizer.pad_token}' (ID: {self.tokenizer.pad_token_id})", flush=True)
-        except Exception as e:
-            print(f"❌ [CRITICAL] Failed to load tokenizer: {str(e)}", flush=True)
+            with timer.stage("tokenizer"):
+                self.tokenizer, source = tokenizer.load(model_config, logger)
+            logger.info("✅ Tokenizer loaded (%s). Pad token: '%s' (ID: %s)", source, self.tokenizer.pad_token, self.tokenizer.pad_token_id)
+        except Exception:
+            logger.critical("❌ Failed to load tokenizer", exc_info=True)
             raise
 
-        # Target model for BLS
-        self.target_model = "mistral-7b-instruct-v0.3"
-        print(f"🎯 [DEBUG] Target TRT-LLM model for BLS: {self.target_model}", flush=True)
+        # TTFT / inter-token latency / tokens-per-second histograms, cache counters on Triton's /metrics
+        self.metrics = metrics.from_model_config(model_config.get("name", "mistral-streaming"), model_config)
+
+        # Token-ID cache for repeated system prompts / chat history
+        try:
+            with timer.stage("prompt_cache"):
+                self.prompt_cache = prompt_cache.from_model_config(self.tokenizer, model_config, self.metrics)
+            logger.info("🗃️  Prompt prefix cache: %s", "enabled" if self.prompt_cache else "disabled")
+        except Exception as e:
+            self.prompt_cache = None
+            logger.warning("⚠️ Prompt prefix cache disabled: %s", e)
 
-        print("🟢 [DEBUG] Python Backend Wrapper initialization complete.", flush=True)
+        # Target model for BLS
+        self.target_model = get_parameter(model_config, "target_model", "mistral-7b-instruct-v0.3")
+        logger.info("🎯 Target TRT-LLM model for BLS: %s", self.target_model)
+
+        # Sampling of requests without sampling inputs (default_* parameters; unset = TRT-LLM's greedy decoding)
+        self.default_sampling = sampling.defaults_from_model_config(model_config)
+        logger.info("🎲 Default sampling: %s", self.default_sampling)
+
+        # Replay stored responses for repeated greedy requests (classification, titles, sorting helpers),
+        # namespaced by the engine build so a rebuilt engine never replays answers of the previous one
+        engine_dir = get_parameter(model_config, "engine_dir")
+        self.response_cache = response_cache.from_model_config(model_config, response_cache.namespace(
+            self.target_model, engine_cache.engine_identity(engine_dir) if engine_dir else None))
+        logger.info("🗃️  Response cache: %s (disk tier: %s)", "enabled" if self.response_cache else "disabled",
+                    self.response_cache.disk_dir if self.response_cache and self.response_cache.disk_dir else "off")
+
+        # Poll for client cancellation between tokens and stop TRT-LLM to free the batch slot
+        self.new_cancellation_watch = cancellation.from_model_config(model_config)
+
+        # Flush policy for streamed text: one response per N tokens / M ms / newline / sentence end
+        self.new_coalescer = coalescer.from_model_config(model_config)
+
+        # Sequence / token budgets of the engine: oversized requests are clamped, truncated or rejected here
+        self.admission = admission.from_model_config(model_config)
+        logger.info("📏 Engine limits: %s (max_tokens policy: %s, truncate history: %s, max in-flight tokens: %d)",
+                    self.admission.limits, self.admission.max_tokens_policy, self.admission.truncate_history,
+                    self.admission.max_inflight_tokens)
+
+        # Concurrent mode drains each BLS stream on a worker thread so many
+        # generations are in flight at once for TRT-LLM's in-flight batcher.
+        # The stream slots are shared by priority class (weighted) and tenant (round robin); a request
+        # also waits while the admitted tokens in flight leave no room for its prompt + max_tokens
+        self.execution_mode = get_parameter(model_config, "execution_mode", "concurrent")
+        self.max_concurrent_streams = get_parameter(model_config, "max_concurrent_streams", 16, int)
+        self.scheduler = None
+        if self.execution_mode == "concurrent":
+            self.scheduler = scheduler.from_model_config(
+                model_config, self.max_concurrent_streams, thread_name_prefix="bls-stream",
+                max_inflight_tokens=self.admission.max_inflight_tokens,
+                on_dispatch=lambda priority, wait: self.metrics.observe_labelled("queue_wait_seconds", priority, wait))
+            logger.info("🚦 Priority classes: %s", ", ".join(
+                f"{c.name} (weight {c.weight:g}, max {c.max_in_flight or self.max_concurrent_streams} streams)"
+                for c in self.scheduler.classes.values()))
+        self.tokenizer_lock = threading.Lock()
+        logger.info("🧵 Execution mode: %s (max concurrent streams: %d)", self.execution_mode, self.max_concurrent_streams)
+
+        logger.info("🟢 Python Backend Wrapper initialization complete.")
+        timer.report()
 
 
     def execute(self, requests):
-        print(f"📬 [DEBUG] Received {len(requests)} request(s) in batch.", flush=True)
+        arrival = time.perf_counter()
+        self.logger.debug("📬 Received %d request(s) in batch.", len(requests))
+
+        request_metrics = [self.metrics.request(arrival) for _ in requests]
+        prepared = self._preprocess(requests, request_metrics)
 
         for idx, request in enumerate(requests):
-            print(f"📨 [DEBUG] Processing request {idx + 1}/{len(requests)}", flush=True)
+            if prepared[idx] is None:
+                continue  # error response already sent
+            input_ids_np, max_tokens, params, stop_ids, priority, tenant = prepared[idx]
+            tokens = input_ids_np.shape[1] + max_tokens
+            args = (request, idx, len(requests), input_ids_np, max_tokens, params, stop_ids, request_metrics[idx])
+
+            if self.scheduler is None:
+                self._process_request(*args)
+                continue
 
-            # --- Extract inputs ---
-            try:
-                conversation_input = pb_utils.get_input_tensor_by_name(request, "conversation")
-                if conversation_input is None:
-                    raise ValueError("Input tensor 'conversation' not found in request.")
+            # Starts once a stream slot and room in the token budget are free for the request's class;
+            # blocks only while scheduler_max_queued requests wait (backpressure into Triton's queue)
+            future = self.scheduler.submit(self._process_request, *args, priority=priority, tenant=tenant,
+                                           tokens=tokens)
+            future.add_done_callback(self._log_worker_failure)
 
-                raw_conversation = conversation_input.as_numpy()[0]
-                if isinstance(raw_conversation, bytes):
-                    conversation_json = raw_conversation.decode('utf-8')
-                elif isinstance(raw_conversation, str):
-                    conversation_json = raw_conversation
-                else:
-                    # Extract scalar if it's a 0-dim numpy array
-                    conversation_json = raw_conversation.item().decode('utf-8')
+        self.logger.debug("✅ All requests dispatched (%s).", self.execution_mode)
+        return None  # Required for decoupled mode
 
-                print(f"📝 [DEBUG] Raw conversation JSON received: '{conversation_json}'", flush=True)
 
-                # Parse JSON conversation
-                try:
-                    conversation = json.loads(conversation_json)
-                    print(f"💬 [DEBUG] Parsed conversation: {conversation!r}", flush=True)
-                except json.JSONDecodeError as e:
-                    snippet = conversation_json[:200] + ("..." if len(conversation_json) > 200 else "")
-                    raise ValueError(f"Invalid JSON in conversation input: {e}. Malformed content (truncated): '{snippet}'")
+    def _log_worker_failure(self, future):
+        err = future.exception()
+        if err is not None:
+            self.logger.critical("❌ Unhandled exception in stream worker: %r", err, exc_info=err)
 
-                # Validate conversation format
-                if not isinstance(conversation, list):
-                    raise ValueError("Conversation must be a list of message objects")
 
-                for msg in conversation:
-                    if not isinstance(msg, dict) or 'role' not in msg or 'content' not in msg:
-                        raise ValueError("Each message must have 'role' and 'content' fields")
+    def _send_error(self, request, message):
+        response_sender = request.get_response_sender()
+        error_response = pb_utils.InferenceResponse(
+            output_tensors=[],
+            error=pb_utils.TritonError(message)
+        )
+        response_sender.send(error_response, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+
+
+    def _preprocess(self, requests, request_metrics):
+        """Parse all requests, then render and tokenize them in one batch.
+
+        Returns ``(input_ids [1, seq] int32, max_tokens, SamplingParams,
+        stop_words_list, priority, tenant)`` per request, or None for requests
+        that failed (their error response is already sent). ``input_ids`` and
+        ``max_tokens`` are the admitted ones (history truncated, max_tokens
+        clamped to the engine's max_seq_len).
+        """
+        logger = self.logger
+
+        # --- Extract inputs ---
+        conversations, max_tokens, params, routing = [], [], [], []
+        for request in requests:
+            try:
+                conversation_input = pb_utils.get_input_tensor_by_name(request, "conversation")
+                if conversation_input is None:
+                    raise ValueError("Input tensor 'conversation' not found in request.")
+                conversation = preprocess.decode_conversation(conversation_input.as_numpy().reshape(-1)[0])
+                logger.log(TRACE, "💬 Parsed conversation: %r", conversation)
 
                 max_tokens_input = pb_utils.get_input_tensor_by_name(request, "max_tokens")
                 if max_tokens_input is None:
                     raise ValueError("Input tensor 'max_tokens' not found in request.")
-                max_tokens = int(max_tokens_input.as_numpy()[0])
-                print(f"🔢 [DEBUG] Max tokens requested: {max_tokens}", flush=True)
-
+                request_max_tokens = int(max_tokens_input.as_numpy().reshape(-1)[0])
+                request_params = sampling.from_inputs(lambda name: self._optional_input(request, name),
+                                                      self.default_sampling)
+                request_routing = self._routing(request)
+                # Appended only once every input parsed, so the lists stay aligned with the batch
+                max_tokens.append(request_max_tokens)
+                params.append(request_params)
+                routing.append(request_routing)
+                conversations.append(conversation)
             except Exception as e:
-                print(f"❌ [ERROR] Input parsing failed: {str(e)}", flush=True)
-                response_sender = request.get_response_sender()
-                error_response = pb_utils.InferenceResponse(
-                    output_tensors=[],
-                    error=pb_utils.TritonError(f"Input parsing error: {str(e)}")
-                )
-                response_sender.send(error_response, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
-                continue
-
-            # --- Apply chat template + tokenize ---
+                logger.error("❌ Input parsing failed: %s", e)
+                max_tokens.append(None)
+                params.append(None)
+                routing.append(None)
+                conversations.append(e)
+
+        # --- Apply chat template + tokenize (one batch call) ---
+        tokenize_start = time.perf_counter()
+        # One batch encode at a time: each call already fans out over the Rust thread pool, and admission
+        # re-renders truncated conversations. decode() on the stream threads needs no lock: tokenizer.load
+        # fixes padding / truncation, so neither call mutates the Rust tokenizer and both take shared borrows
+        with self.tokenizer_lock:
             try:
-              print("🧩 [DEBUG] Applying chat template...", flush=True)
-              rendered = self.tokenizer.apply_chat_template(
-                  conversation,
-                  tokenize=False,
-                  add_generation_prompt=True,
-              )
-              print(f"📜 [DEBUG] Rendered prompt: {rendered!r}", flush=True)
-
-              print("🔤 [DEBUG] Tokenizing rendered prompt...", flush=True)
-              tokenize_start = time.time()
-              tokenized = self.tokenizer(rendered, add_special_tokens=True, return_tensors="np")
-              input_ids_np = tokenized["input_ids"].astype(np.int32)  # shape: [1, seq]
-              input_lengths = np.array([input_ids_np.shape[1]], dtype=np.int32)
-              tokenize_end = time.time()
-
-              print(f"✅ [DEBUG] Tokenized in {tokenize_end - tokenize_start:.4f}s. Input IDs shape: {input_ids_np.shape}, Length: {input_lengths[0]}", flush=True)
-              print(f"🔢 [DEBUG] First 10 token IDs: {input_ids_np.flatten()[:10].tolist()}", flush=True)
-
-              # === Delta baseline includes the prompt ===
-              prompt_ids = input_ids_np.reshape(-1).tolist()  # keep visible for the stream loop
-              prompt_text = self.tokenizer.decode(
-                  prompt_ids,
-                  skip_special_tokens=True,
-                  clean_up_tokenization_spaces=False,
-                  spaces_between_special_tokens=False,
-              )
-              full_text_prev = prompt_text   # <-- IMPORTANT: baseline to avoid echo
-              pending_ws = ""                # safe to (re)initialize here
-              print(f"🧷 [DEBUG] Delta baseline set to decoded prompt (len={len(prompt_text)})", flush=True)
-
+                encoded = preprocess.prepare_batch(self.tokenizer, conversations, self.prompt_cache, np.int32)
             except Exception as e:
-              print(f"❌ [ERROR] Tokenization failed: {str(e)}", flush=True)
-              response_sender = request.get_response_sender()
-              error_response = pb_utils.InferenceResponse(
-                output_tensors=[],
-                error=pb_utils.TritonError(f"Tokenization error: {str(e)}")
-              )
-              response_sender.send(error_response, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
-              continue
+                encoded = [c if isinstance(c, Exception) else e for c in conversations]
+            # Per request from here on: one bad stop string or oversized prompt fails only its own request
+            stop_ids = [self._stop_ids(p) for p in params]
+            admitted = [self._admit(c, r, t) for c, r, t in zip(conversations, encoded, max_tokens)]
+        tokenize_seconds = time.perf_counter() - tokenize_start
+        logger.debug("✅ Tokenized %d request(s) in %.4fs", len(requests), tokenize_seconds)
+        if self.prompt_cache is not None:
+            logger.debug("🗃️  Prompt cache stats: %s", Lazy(self.prompt_cache.stats))
+
+        prepared = []
+        for request, conversation, result, admit, p, stop, route, rm in zip(requests, conversations, encoded, admitted,
+                                                                            params, stop_ids, routing, request_metrics):
+            if isinstance(conversation, Exception):
+                self._send_error(request, f"Input parsing error: {conversation}")
+                prepared.append(None)
+            elif isinstance(result, Exception):
+                logger.error("❌ Tokenization failed: %s", result)
+                self._send_error(request, f"Tokenization error: {result}")
+                prepared.append(None)
+            elif isinstance(stop, Exception):
+                logger.warning("❌ Stop words rejected: %s", stop)
+                self._send_error(request, f"Stop words error: {stop}")
+                prepared.append(None)
+            elif isinstance(admit, Exception):
+                logger.warning("📏 Request rejected: %s", admit)
+                self.metrics.increment("oversized_requests_total")
+                self._send_error(request, f"Length limit error: {admit}")
+                prepared.append(None)
+            else:
+                if admit.dropped_messages:
+                    logger.info("✂️  Dropped %d oldest message(s) to fit the engine: %d -> %d prompt tokens",
+                                admit.dropped_messages, result.shape[1], admit.prompt_tokens)
+                    self.metrics.increment("truncated_requests_total")
+                if admit.clamped:
+                    logger.debug("📏 max_tokens clamped from %d to %d (prompt tokens: %d)",
+                                 admit.requested_max_tokens, admit.max_tokens, admit.prompt_tokens)
+                    self.metrics.increment("clamped_requests_total")
+                rm.tokenize_seconds = tokenize_seconds
+                rm.prompt_tokens = admit.prompt_tokens
+                prepared.append((admit.input_ids, admit.max_tokens, p, stop) + route)
+        return prepared
+
+
+    def _stop_ids(self, params):
+        """TRT-LLM ``stop_words_list`` of a request, None without stop strings, or the error tokenizing them.
+
+        Called with the tokenizer lock held.
+        """
+        if params is None or not params.stop:
+            return None
+        try:
+            return sampling.stop_words_list(self.tokenizer, params.stop)
+        except Exception as e:
+            return e
 
 
-            # --- Prepare BLS request ---
-            try:
-                print("📤 [DEBUG] Preparing BLS tensors for TRT-LLM (with batch dim)...", flush=True)
+    def _admit(self, conversation, input_ids, max_tokens):
+        """``Admission`` of a tokenized request, the error that keeps it out, or None if it already failed.
 
-                # input_ids: from tokenizer, shape [1, seq] → already correct
-                input_ids_tensor = pb_utils.Tensor("input_ids", input_ids_np)
+        Called with the tokenizer lock held: truncating the history re-renders the conversation.
+        """
+        if isinstance(conversation, Exception) or isinstance(input_ids, Exception):
+            return None
 
-                # input_lengths: was [1] → reshape to [1, 1]
-                input_lengths_tensor = pb_utils.Tensor(
-                    "input_lengths",
-                    input_lengths.reshape(1, -1)  # shape: [1, 1]
-                )
+        def encode(shorter):
+            ids = preprocess.prepare_batch(self.tokenizer, [shorter], self.prompt_cache, np.int32)[0]
+            if isinstance(ids, Exception):
+                raise ids
+            return ids
 
-                # request_output_len: create as [1, 1]
-                request_output_len_tensor = pb_utils.Tensor(
-                    "request_output_len",
-                    np.array([[max_tokens]], dtype=np.int32)  # shape: [1, 1]
-                )
+        try:
+            return self.admission.admit(conversation, input_ids, max_tokens, encode)
+        except Exception as e:
+            return e
+
+
+    def _routing(self, request):
+        """``(priority class, tenant)`` of a request from its optional ``priority`` / ``tenant`` inputs."""
+        priority, tenant = (self._optional_input(request, name) for name in ("priority", "tenant"))
+        priority = preprocess.decode_text(priority.reshape(-1)[0]) if priority is not None else None
+        tenant = preprocess.decode_text(tenant.reshape(-1)[0]) if tenant is not None else scheduler.DEFAULT_TENANT
+        if self.scheduler is not None:
+            priority = self.scheduler.resolve(priority)  # ValueError for unknown classes
+        return priority, tenant
+
+
+    def _optional_input(self, request, name):
+        tensor = pb_utils.get_input_tensor_by_name(request, name)
+        return tensor.as_numpy() if tensor is not None else None
+
+
+    def _sampling_tensors(self, params, stop_ids):
+        """Optional TRT-LLM inputs ([1, 1] each) for the request's sampling / stop / guide settings."""
+        tensors = []
+        if params.temperature is not None:
+            tensors.append(pb_utils.Tensor("temperature", np.array([[params.temperature]], dtype=np.float32)))
+        top_p = params.top_p
+        if top_p is None and params.top_k is None and params.temperature:
+            top_p = 1.0  # TRT-LLM decodes greedily unless top_p or top_k is set
+        if top_p is not None:
+            tensors.append(pb_utils.Tensor("runtime_top_p", np.array([[top_p]], dtype=np.float32)))
+        if params.top_k is not None:
+            tensors.append(pb_utils.Tensor("runtime_top_k", np.array([[params.top_k]], dtype=np.int32)))
+        if params.seed is not None:
+            tensors.append(pb_utils.Tensor("random_seed", np.array([[params.seed]], dtype=np.uint64)))
+        if stop_ids is not None:
+            tensors.append(pb_utils.Tensor("stop_words_list", stop_ids))
+        if params.guide_type is not None:
+            tensors.append(pb_utils.Tensor("guided_decoding_guide_type", np.array([[params.guide_type]], dtype=object)))
+            if params.guide is not None:
+                tensors.append(pb_utils.Tensor("guided_decoding_guide", np.array([[params.guide]], dtype=object)))
+        return tensors
+
+
+    def _process_request(self, request, idx, total, input_ids_np, max_tokens, params, stop_ids, request_metrics):
+        logger = self.logger
+        trace = logger.isEnabledFor(TRACE)  # checked once; per-token logging is off by default
+        logger.debug("📨 Processing request %d/%d (prompt tokens: %d, max tokens: %d)",
+                     idx + 1, total, input_ids_np.shape[1], max_tokens)
+        input_lengths = np.array([input_ids_np.shape[1]], dtype=np.int32)
+        logger.log(TRACE, "🔢 First 10 token IDs: %s", input_ids_np[0, :10])
+
+        # === Detokenizer context is the tail of the prompt ===
+        prompt_ids = input_ids_np[0].tolist()
+        detokenizer = IncrementalDetokenizer(self.tokenizer, prompt_ids)
+        request_metrics.detokenize_seconds = 0.0
+
+        # === Identical greedy request seen before: replay its chunks instead of generating ===
+        cache_key = None
+        if self.response_cache is not None and response_cache.is_deterministic(params.as_dict()):
+            cache_key = self.response_cache.key(prompt_ids, max_tokens, params.as_dict())
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self._replay(request.get_response_sender(), cached, request_metrics)
+                return
+            self.metrics.increment("response_cache_misses_total")
+        sent = [] if cache_key is not None else None
+        complete = True  # every token decoded and every chunk delivered; a partial response is not cached
+
+        # --- Prepare BLS request ---
+        try:
+            logger.log(TRACE, "📤 Preparing BLS tensors for TRT-LLM (with batch dim)...")
 
-                # streaming: create as [1, 1]
-                streaming_tensor = pb_utils.Tensor(
-                    "streaming",
-                    np.array([[True]], dtype=bool)  # shape: [1, 1]
-                )
+            # input_ids: from tokenizer, shape [1, seq] → already correct
+            input_ids_tensor = pb_utils.Tensor("input_ids", input_ids_np)
 
-                infer_request = pb_utils.InferenceRequest(
-                    model_name=self.target_model,
-                    requested_output_names=["output_ids", "sequence_length"],
-                    inputs=[
-                        input_ids_tensor,
-                        input_lengths_tensor,
-                        request_output_len_tensor,
-                        streaming_tensor
-                    ]
-                )
-                print("✅ [DEBUG] BLS request prepared successfully with batch dimensions.", flush=True)
+            # input_lengths: was [1] → reshape to [1, 1]
+            input_lengths_tensor = pb_utils.Tensor(
+                "input_lengths",
+                input_lengths.reshape(1, -1)  # shape: [1, 1]
+            )
 
-            except Exception as e:
-                print(f"❌ [ERROR] Failed to prepare BLS request: {str(e)}", flush=True)
-                response_sender = request.get_response_sender()
-                error_response = pb_utils.InferenceResponse(
-                    output_tensors=[],
-                    error=pb_utils.TritonError(f"BLS request preparation error: {str(e)}")
-                )
-                response_sender.send(error_response, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
-                continue
+            # request_output_len: create as [1, 1]
+            request_output_len_tensor = pb_utils.Tensor(
+                "request_output_len",
+                np.array([[max_tokens]], dtype=np.int32)  # shape: [1, 1]
+            )
+
+            # streaming: create as [1, 1]
+            streaming_tensor = pb_utils.Tensor(
+                "streaming",
+                np.array([[True]], dtype=bool)  # shape: [1, 1]
+            )
+
+            # numeric ID so a later stop request can refer to this generation
+            bls_request_id = str(uuid.uuid4().int >> 65)
+            bls_inputs = [
+                input_ids_tensor,
+                input_lengths_tensor,
+                request_output_len_tensor,
+                streaming_tensor,
+                *self._sampling_tensors(params, stop_ids),
+            ]
+            infer_request = pb_utils.InferenceRequest(
+                model_name=self.target_model,
+                requested_output_names=["output_ids", "sequence_length"],
+                inputs=bls_inputs,
+                request_id=bls_request_id,
+            )
+            logger.log(TRACE, "✅ BLS request prepared successfully with batch dimensions.")
 
-            # --- Start streaming inference ---
+        except Exception as e:
+            logger.error("❌ Failed to prepare BLS request: %s", e)
             response_sender = request.get_response_sender()
-            print("🌀 [DEBUG] Starting decoupled streaming inference via BLS...", flush=True)
+            error_response = pb_utils.InferenceResponse(
+                output_tensors=[],
+                error=pb_utils.TritonError(f"BLS request preparation error: {str(e)}")
+            )
+            response_sender.send(error_response, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+            return
 
-            try:
-                infer_response_iterator = infer_request.exec(decoupled=True)
-                print("✅ [DEBUG] BLS exec() returned iterator. Awaiting first response...", flush=True)
-
-                generated_tokens = []
-                pending_ws = ""
-                token_count = 0
-                inference_start_time = time.time()
-
-                for infer_response in infer_response_iterator:
-                    if infer_response.has_error():
-                        err_msg = infer_response.error().message()
-                        print(f"❌ [STREAM ERROR] TRT-LLM returned error: {err_msg}", flush=True)
-                        raise pb_utils.TritonModelException(err_msg)
-
-                    output_ids_tensor = pb_utils.get_output_tensor_by_name(infer_response, "output_ids")
-                    if output_ids_tensor is None:
-                        print("⚠️ [DEBUG] No 'output_ids' in response. Skipping.", flush=True)
-                        continue
-
-                    output_ids = output_ids_tensor.as_numpy()
-                    print(f"📊 [DEBUG] Received output_ids with shape: {output_ids.shape}", flush=True)
-
-                    if len(output_ids.shape) != 3:
-                        print(f"❌ [ERROR] Unexpected output_ids shape: {output_ids.shape}. Expected [batch, beam, seq]", flush=True)
-                        continue
-
-                    # Assume batch=1, beam=1
-                    new_token_id = int(output_ids[0, 0, -1])  # last generated token
-                    token_count += 1
-                    generated_tokens.append(new_token_id)
-
-                    print(f"🔢 [DEBUG] Token #{token_count}: ID={new_token_id}", flush=True)
-
-                    # Stop if EOS
-                    if new_token_id == self.tokenizer.eos_token_id:
-                      # flush any whitespace you buffered while coalescing deltas
-                      if pending_ws:
-                        try:
-                          resp_ws = pb_utils.InferenceResponse(output_tensors=[
-                            pb_utils.Tensor("text_output", np.array([pending_ws], dtype=object))
-                          ])
-                          response_sender.send(resp_ws)
-                          print(f"↪️  [DEBUG] Flushed pending_ws at EOS: {pending_ws!r}", flush=True)
-                        except Exception as e:
-                          print(f"ℹ️ [DEBUG] Could not flush pending_ws at EOS: {e}", flush=True)
-                        pending_ws = ""
-                      print("🛑 [DEBUG] EOS token detected. Ending stream.", flush=True)
-                      break
-
-                    # Delta-decode accumulated text to preserve spacing/BPE merges
-                    decode_start = time.time()
-                    try:
-                        full_text = self.tokenizer.decode(
-                          (prompt_ids + generated_tokens),   # include prompt to keep boundary spaces/newlines
-                          skip_special_tokens=True,
-                          clean_up_tokenization_spaces=False,
-                          spaces_between_special_tokens=False,
-                        )
-                        chunk = full_text[len(full_text_prev):]
-                        full_text_prev = full_text
-                        decode_end = time.time()
-                        print(f"🔤 [DEBUG] Decoded delta: {chunk!r} (took {decode_end - decode_start:.4f}s)", flush=True)
-
-                        # Strip exactly one leading space on the first emitted chunk (SentencePiece boundary quirk)
-                        if token_count == 1 and chunk[:1] == " ":
-                            chunk = chunk[1:]
-                            print("🔧 [DEBUG] Stripped single leading space on first chunk", flush=True)
-                    except Exception as e:
-                        print(f"❌ [ERROR] Detokenization failed for ID {new_token_id}: {str(e)}", flush=True)
-                        chunk = ""
-
-                    # Newline-aware delta handling (don't drop '\n')
-                    if chunk == "":
-                      print("↪️  [DEBUG] Skipping empty delta", flush=True)
-                    else:
-                      # Coalesce whitespace; but emit newlines immediately so they aren't lost
-                      if "\n" in chunk or "\r" in chunk:
-                        to_send = pending_ws + chunk
-                        pending_ws = ""
-                        try:
-                          response = pb_utils.InferenceResponse(output_tensors=[
-                            pb_utils.Tensor("text_output", np.array([to_send], dtype=object))
-                          ])
-                          response_sender.send(response)
-                          print(f"📤 [DEBUG] Sent text chunk (with newlines): {to_send!r}", flush=True)
-                        except Exception as e:
-                          print(f"❌ [ERROR] Failed to send response chunk: {e}", flush=True)
-                      elif chunk.isspace():
-                        pending_ws += chunk
-                        print(f"⏸️  [DEBUG] Buffered whitespace: {pending_ws!r}", flush=True)
-                      else:
-                        to_send = pending_ws + chunk
-                        pending_ws = ""
-                        try:
-                          response = pb_utils.InferenceResponse(output_tensors=[
-                            pb_utils.Tensor("text_output", np.array([to_send], dtype=object))
-                          ])
-                          response_sender.send(response)
-                          print(f"📤 [DEBUG] Sent text chunk: {to_send!r}", flush=True)
-                        except Exception as e:
-                          print(f"❌ [ERROR] Failed to send response chunk: {e}", flush=True)
-
-                # --- Send final flag + finalize ---
-                total_inference_time = time.time() - inference_start_time
-                print(f"✅ [DEBUG] Stream completed. Total tokens: {token_count}. Total time: {total_inference_time:.2f}s", flush=True)
-
-                final_resp = pb_utils.InferenceResponse(output_tensors=[
-                  pb_utils.Tensor("text_output", np.array([""], dtype=object)),   # keep required output present
-                  pb_utils.Tensor("is_final",    np.array([True], dtype=bool)),   # <-- new
-                ])
-                response_sender.send(final_resp, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+        # --- Start streaming inference ---
+        response_sender = request.get_response_sender()
+        cancelled = self.new_cancellation_watch(response_sender)
+        if cancelled():  # gave up while queued for a stream slot
+            self._finish_cancelled(response_sender, 0, request_metrics)
+            return
+        logger.debug("🌀 Starting decoupled streaming inference via BLS...")
 
-            except Exception as e:
-                print(f"❌ [CRITICAL] Exception during streaming inference: {str(e)}", flush=True)
-                print(traceback.format_exc(), flush=True)
+        try:
+            infer_response_iterator = infer_request.exec(decoupled=True)
+            logger.log(TRACE, "✅ BLS exec() returned iterator. Awaiting first response...")
+
+            pending = self.new_coalescer()
+            # TRT-LLM also stops on stop_words_list, but only for the tokenization sent; match the text too
+            stop = sampling.StopMatcher(params.stop)
+            token_count = 0
+            inference_start_time = time.time()
+
+            for infer_response in infer_response_iterator:
+                if infer_response.has_error():
+                    err_msg = infer_response.error().message()
+                    logger.error("❌ TRT-LLM returned error: %s", err_msg)
+                    raise pb_utils.TritonModelException(err_msg)
+
+                output_ids_tensor = pb_utils.get_output_tensor_by_name(infer_response, "output_ids")
+                if output_ids_tensor is None:
+                    logger.warning("⚠️ No 'output_ids' in response. Skipping.")
+                    continue
+
+                output_ids = output_ids_tensor.as_numpy()
+
+                if len(output_ids.shape) != 3:
+                    logger.error("❌ Unexpected output_ids shape: %s. Expected [batch, beam, seq]", output_ids.shape)
+                    continue
+
+                # Assume batch=1, beam=1
+                new_token_id = int(output_ids[0, 0, -1])  # last generated token
+                token_count += 1
+
+                if trace:
+                    logger.log(TRACE, "🔢 Token #%d: ID=%d", token_count, new_token_id)
+
+                # Stop if EOS
+                if new_token_id == self.tokenizer.eos_token_id:
+                  logger.debug("🛑 EOS token detected. Ending stream.")
+                  break
+
+                # Incremental decode over a short trailing window (keeps spacing/BPE merges, O(1) per token)
+                decode_start = time.perf_counter()
                 try:
-                    response_sender.send(
-                        pb_utils.InferenceResponse(
-                            output_tensors=[],
-                            error=pb_utils.TritonError(f"Streaming inference error: {str(e)}")
-                        ),
-                        flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL
-                    )
-                except Exception as send_err:
-                    print(f"❌ [ERROR] Failed to send error response: {str(send_err)}", flush=True)
-
-        print("✅ [DEBUG] All requests processed.", flush=True)
-        return None  # Required for decoupled mode
+                    chunk = detokenizer.step(new_token_id)
+                    decode_end = time.perf_counter()
+                    request_metrics.detokenize_seconds += decode_end - decode_start
+                    if trace:
+                        logger.log(TRACE, "🔤 Decoded delta: %r (took %.4fs)", chunk, decode_end - decode_start)
+                except Exception as e:
+                    logger.error("❌ Detokenization failed for ID %d: %s", new_token_id, e)
+                    chunk = ""
+                    complete = False
+
+                # Buffer deltas (whitespace, N tokens, M ms) and send one response per flushed chunk
+                to_send = pending.add(stop.feed(chunk))
+                if to_send:
+                  try:
+                    response = pb_utils.InferenceResponse(output_tensors=[
+                      pb_utils.Tensor("text_output", np.array([to_send], dtype=object))
+                    ])
+                    response_sender.send(response)
+                    if sent is not None:
+                      sent.append(to_send)
+                    if trace:
+                      logger.log(TRACE, "📤 Sent text chunk: %r", to_send)
+                  except Exception as e:
+                    logger.error("❌ Failed to send response chunk: %s", e)
+                    complete = False
+
+                request_metrics.token()
+
+                if stop.stopped:
+                    logger.debug("🛑 Stop string generated. Ending stream.")
+                    self._stop_generation(infer_response_iterator, bls_request_id, bls_inputs)
+                    break
+
+                if cancelled():
+                    self._stop_generation(infer_response_iterator, bls_request_id, bls_inputs)
+                    break
+
+            if cancelled.cancelled:
+                self._finish_cancelled(response_sender, token_count, request_metrics)
+                return
+
+            # --- Send final flag + finalize ---
+            # held-back bytes and any text still buffered by the coalescer go out with the final response
+            tail = ""
+            try:
+                tail += pending.add(stop.feed(detokenizer.flush()), tokens=0) or ""
+            except Exception as e:
+                logger.debug("ℹ️ Could not flush detokenizer at end of stream: %s", e)
+                complete = False
+            tail += pending.add(stop.flush(), tokens=0) or ""
+            tail += pending.flush()
+            if trace and tail:
+                logger.log(TRACE, "↪️  Flushed buffered text at end of stream: %r", tail)
+
+            total_inference_time = time.time() - inference_start_time
+            logger.info("✅ Stream completed. Prompt tokens: %d. Total tokens: %d. Total time: %.2fs", len(prompt_ids), token_count, total_inference_time)
+
+            final_resp = pb_utils.InferenceResponse(output_tensors=[
+              pb_utils.Tensor("text_output", np.array([tail], dtype=object)),
+              pb_utils.Tensor("is_final",    np.array([True], dtype=bool)),
+            ])
+            if cache_key is not None and complete:  # before the final response, so an immediate retry already hits
+                self.response_cache.put(cache_key, sent + [tail])
+            response_sender.send(final_resp, flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+            request_metrics.finish()
+
+        except Exception as e:
+            logger.critical("❌ Exception during streaming inference: %s", e, exc_info=True)
+            try:
+                response_sender.send(
+                    pb_utils.InferenceResponse(
+                        output_tensors=[],
+                        error=pb_utils.TritonError(f"Streaming inference error: {str(e)}")
+                    ),
+                    flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL
+                )
+            except Exception as send_err:
+                logger.error("❌ Failed to send error response: %s", send_err)
+
+
+    def _replay(self, response_sender, chunks, request_metrics):
+        """Stream a cached response: the stored chunks, then the final one."""
+        self.metrics.increment("response_cache_hits_total")
+        try:
+            for i, chunk in enumerate(chunks[:-1]):
+                response_sender.send(pb_utils.InferenceResponse(output_tensors=[
+                    pb_utils.Tensor("text_output", np.array([chunk], dtype=object))
+                ]))
+                if i == 0:
+                    request_metrics.replay()
+            response_sender.send(pb_utils.InferenceResponse(output_tensors=[
+                pb_utils.Tensor("text_output", np.array([chunks[-1]], dtype=object)),
+                pb_utils.Tensor("is_final", np.array([True], dtype=bool)),
+            ]), flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+            if request_metrics.first_token_time is None:
+                request_metrics.replay()
+            request_metrics.finish()
+            self.logger.info("✅ Replayed cached response (%d chunks).", len(chunks))
+        except Exception as e:
+            self.logger.error("❌ Failed to replay cached response: %s", e)
+
+
+    def _stop_generation(self, infer_response_iterator, request_id, inputs):
+        """Cancel the BLS stream so TRT-LLM releases the sequence's batch slot."""
+        try:
+            cancel = getattr(infer_response_iterator, "cancel", None)
+            if cancel is not None:
+                cancel()
+                return
+            # Older Triton: the tensorrtllm backend stops a request on a "stop" input with the same ID
+            stop_request = pb_utils.InferenceRequest(
+                model_name=self.target_model,
+                requested_output_names=["output_ids"],
+                inputs=inputs + [pb_utils.Tensor("stop", np.array([[True]], dtype=bool))],
+                request_id=request_id,
+            )
+            for _ in stop_request.exec(decoupled=True):
+                pass
+        except Exception as e:
+            self.logger.warning("⚠️ Could not stop TRT-LLM generation %s: %s", request_id, e)
+
+
+    def _finish_cancelled(self, response_sender, token_count, request_metrics):
+        self.logger.info("🚫 Request cancelled by client after %d tokens.", token_count)
+        self.metrics.increment("cancelled_requests_total")
+        request_metrics.finish()  # the tokens it got still count towards latency and throughput
+        try:
+            response_sender.send(flags=pb_utils.TRITONSERVER_RESPONSE_COMPLETE_FINAL)
+        except Exception as e:
+            self.logger.debug("ℹ️ Could not close cancelled stream: %s", e)
 
 
     def finalize(self):
-        print("🧹 [DEBUG] Finalizing Python Backend Wrapper...", flush=True)
-        print("✅ [DEBUG] Cleanup complete.", flush=True)
+        self.logger.info("🧹 Finalizing Python Backend Wrapper...")
+        if self.scheduler is not None:
+            self.logger.info("⏳ Waiting for %d in-flight (%d tokens) and %d queued stream(s)...",
+                             self.scheduler.in_flight, self.scheduler.tokens_in_flight, self.scheduler.queued)
+            self.scheduler.shutdown(wait=True)
+        if self.response_cache is not None:
+            self.logger.info("🗃️  Response cache stats: %s", self.response_cache.stats())
+        self.logger.info("✅ Cleanup complete.")
+        shutdown_logging()
@@ -0,0 +1,82 @@
+"""Shared setup of the backend tests: import paths, tiny weights and model loading.
+
+The models run in-process against the stand-in ``triton_python_backend_utils``
+of ``benchmarks/triton/harness`` (and ``mistral-streaming`` against its mock
+TRT-LLM target), like ``benchmarks/triton/bench_models.py``.
+"""
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+BENCHMARKS = os.path.join(ROOT, "benchmarks", "triton")
+sys.path[:0] = [BENCHMARKS, os.path.join(BENCHMARKS, "harness"),
+                os.path.join(ROOT, "charts", "triton", "files", "python")]
+os.environ.setdefault("SYNAPLAN_LOG_LEVEL", "CRITICAL")
+
+import numpy as np  # noqa: E402
+
+import bench_models  # noqa: E402
+import fixtures  # noqa: E402
+import triton_python_backend_utils as pb_utils  # noqa: E402
+
+_WEIGHTS = {}
+
+
+def weights(with_model=False):
+    """Directory of the harness' tiny tokenizer (and random Mistral), built once per test run."""
+    if with_model not in _WEIGHTS:
+        directory = tempfile.mkdtemp(prefix="synaplan-test-weights-")
+        atexit.register(shutil.rmtree, directory, True)
+        _WEIGHTS[with_model] = fixtures.build_weights(directory, with_model=with_model)
+    return _WEIGHTS[with_model]
+
+
+def load_model(model, **parameters):
+    """An initialized ``TritonPythonModel`` of ``model`` with ``parameters`` over its ``config.pbtxt``."""
+    parameters = {"weights_dir": weights(model == "mistral-cpu"), "response_cache_enabled": "false", **parameters}
+    model_config = fixtures.load_model_config(model, parameters)
+    if model == "mistral-streaming":
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(parameters["weights_dir"])
+        target = model_config["parameters"]["target_model"]["string_value"]
+        pb_utils.register_model(target, fixtures.MockTrtLlm(tokenizer, 1000, eos_token_id=tokenizer.eos_token_id))
+    instance = bench_models.load_model_module(model).TritonPythonModel()
+    instance.initialize({"model_config": json.dumps(model_config), "model_name": model})
+    return instance
+
+
+class Call:
+    """One client request; collects its responses until the final flag."""
+
+    def __init__(self, messages, max_tokens=8, **inputs):
+        self.responses = []
+        tensors = fixtures.request_inputs(messages, max_tokens)
+        for name, value in inputs.items():
+            dtype = object if isinstance(value, str) else np.asarray(value).dtype
+            value = value.encode("utf-8") if isinstance(value, str) else value
+            tensors.append(pb_utils.Tensor(name, np.array([value], dtype=dtype).reshape(1, 1)))
+        self.request = pb_utils.Request(tensors, lambda response, flags: self.responses.append(response))
+
+    def wait(self, timeout=30):
+        if not self.request.sender.closed.wait(timeout):
+            raise TimeoutError("request did not finish")
+        return self
+
+    @property
+    def text(self):
+        """The streamed ``text_output`` chunks, joined."""
+        return "".join(pb_utils.get_output_tensor_by_name(response, "text_output").as_numpy().reshape(-1)[0]
+                       for response in self.responses if response is not None and not response.has_error())
+
+    @property
+    def error(self):
+        """Error message of the request, or None if it streamed without one."""
+        for response in self.responses:
+            if response is not None and response.has_error():
+                return response.error().message()
+        return None
@@ -0,0 +1,122 @@
+"""Per-request metrics: every inter-token gap, tokens of the serial path, and replayed or cancelled requests."""
+import unittest
+
+import numpy as np
+
+from support import Call, load_model, pb_utils
+from synaplan_triton import metrics
+
+HELLO = [{"role": "user", "content": "Please summarize the document."}]
+
+
+def observations(model, name):
+    metric = pb_utils.METRICS.get((f"{metrics.PREFIX}_{name}", frozenset({"model": model}.items())))
+    return list(metric.values) if metric is not None else []
+
+
+def count(model, name):
+    metric = pb_utils.METRICS.get((f"{metrics.PREFIX}_{name}", frozenset({"model": model}.items())))
+    return metric.value if metric is not None else 0
+
+
+class Recorder(metrics.NullMetrics):
+
+    def __init__(self):
+        self.observed = []
+
+    def observe(self, name, value):
+        self.observed.append((name, value))
+
+
+class InterTokenLatency(unittest.TestCase):
+
+    def test_each_gap_is_observed(self):
+        recorder = Recorder()
+        request = recorder.request(start_time=0.0)
+        for now in (0.5, 0.6, 0.9, 1.0):
+            request.token(now)
+        request.finish()
+        gaps = [round(v, 6) for name, v in recorder.observed if name == "inter_token_latency_seconds"]
+        self.assertEqual(gaps, [0.1, 0.3, 0.1])
+        self.assertIn(("time_to_first_token_seconds", 0.5), recorder.observed)
+
+
+class SerialTokens(unittest.TestCase):
+    """The serial path counts the token IDs generate() streamed, not the words the text is cut into."""
+
+    parameters = {"batching_mode": "serial"}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.instance = load_model("mistral-cpu", **cls.parameters)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.instance.finalize()
+
+    def test_one_gap_per_token(self):
+        gaps = len(observations("mistral-cpu", "inter_token_latency_seconds"))
+        call = Call(HELLO, max_tokens=16, temperature=np.float32(0))
+        self.instance.execute([call.request])
+        self.assertIsNone(call.wait().error)
+        tokens = observations("mistral-cpu", "output_tokens")[-1]
+        self.assertGreater(tokens, 1)
+        self.assertLessEqual(tokens, 16)
+        self.assertEqual(len(observations("mistral-cpu", "inter_token_latency_seconds")), gaps + tokens - 1)
+
+
+class SpeculativeTokens(SerialTokens):
+
+    parameters = {"batching_mode": "serial", "speculative_mode": "prompt_lookup"}
+
+
+class FinishedOnEveryPath(unittest.TestCase):
+
+    model = "mistral-streaming"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.instance = load_model(cls.model, response_cache_enabled="true", cancel_check_interval_ms="0")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.instance.finalize()
+
+    def run_call(self, call):
+        self.instance.execute([call.request])
+        return call.wait()
+
+    def test_replayed_request_counts_towards_time_to_first_token(self):
+        messages = [{"role": "user", "content": "Replay this answer"}]
+        self.run_call(Call(messages, temperature=np.float32(0)))
+        ttft, outputs = (len(observations(self.model, n)) for n in ("time_to_first_token_seconds", "output_tokens"))
+        hits = count(self.model, "response_cache_hits_total")
+        replayed = self.run_call(Call(messages, temperature=np.float32(0)))
+        self.assertIsNone(replayed.error)
+        self.assertEqual(count(self.model, "response_cache_hits_total"), hits + 1)
+        self.assertEqual(len(observations(self.model, "time_to_first_token_seconds")), ttft + 1)
+        self.assertEqual(len(observations(self.model, "output_tokens")), outputs)  # nothing was generated
+
+    def test_cancelled_request_is_published(self):
+        outputs = len(observations(self.model, "output_tokens"))
+        cancelled = count(self.model, "cancelled_requests_total")
+        call = Call(HELLO, max_tokens=64)
+        sender = call.request.sender
+
+        def cancel_after_first(response, flags):
+            call.responses.append(response)
+            sender.cancelled = True
+        sender._on_response = cancel_after_first
+        self.run_call(call)
+        self.assertEqual(count(self.model, "cancelled_requests_total"), cancelled + 1)
+        self.assertEqual(len(observations(self.model, "output_tokens")), outputs + 1)
+        self.assertLess(observations(self.model, "output_tokens")[-1], 64)
+
+
+class CpuFinishedOnEveryPath(FinishedOnEveryPath):
+
+    model = "mistral-cpu"
+
+
+if __name__ == "__main__":
+    unittest.main()
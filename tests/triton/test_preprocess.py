@@ -0,0 +1,66 @@
+"""Per-request input errors within one dynamic batch (``execute`` call)."""
+import unittest
+
+import numpy as np
+
+from support import Call, load_model
+
+HELLO = [{"role": "user", "content": "Please summarize the document."}]
+
+
+class BadInputInBatch:
+    """One request with a bad input fails alone; the requests batched with it stream normally."""
+
+    model = None
+    parameters = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.instance = load_model(cls.model, **cls.parameters)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.instance.finalize()
+
+    def execute(self, *calls):
+        self.instance.execute([call.request for call in calls])
+        return [call.wait() for call in calls]
+
+    def test_bad_sampling_input(self):
+        first, bad, last = self.execute(Call(HELLO, max_tokens=4, temperature=np.float32(0)),
+                                        Call(HELLO, temperature=np.float32(-1)),
+                                        Call(HELLO, max_tokens=6, top_k=np.int32(1)))
+        self.assertIn("temperature must be >= 0", bad.error)
+        self.assertIsNone(first.error)
+        self.assertIsNone(last.error)
+
+    def test_untokenizable_prompt_with_prompt_cache(self):
+        self.assertIsNotNone(self.instance.prompt_cache)
+        bad, good = self.execute(Call([{"role": "user", "content": "lone surrogate \ud800"}]), Call(HELLO))
+        self.assertIn("Tokenization error", bad.error)
+        self.assertIsNone(good.error)
+
+
+class StreamingBadInput(BadInputInBatch, unittest.TestCase):
+    model = "mistral-streaming"
+
+    def test_unknown_priority(self):
+        bad, good = self.execute(Call(HELLO, priority="bogus"), Call(HELLO, priority="batch"))
+        self.assertIn("bogus", bad.error)
+        self.assertIsNone(good.error)
+
+    def test_routing_stays_with_its_request(self):
+        calls = [Call(HELLO, priority="bogus"), Call(HELLO, max_tokens=6, priority="batch", tenant="acme")]
+        prepared = self.instance._preprocess([call.request for call in calls],
+                                             [self.instance.metrics.request() for _ in calls])
+        self.assertIsNone(prepared[0])
+        self.assertEqual(prepared[1][1], 6)
+        self.assertEqual(prepared[1][4:], ("batch", "acme"))
+
+
+class CpuBadInput(BadInputInBatch, unittest.TestCase):
+    model = "mistral-cpu"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""``PromptCache.encode_batch`` keeps tokenizer errors per prompt."""
+import unittest
+
+import support
+from synaplan_triton import prompt_cache
+
+
+class FailingTokenizer:
+    """The harness tokenizer, raising for any text that contains ``BOOM`` (like a batch call would)."""
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    def __getattr__(self, name):
+        return getattr(self._tokenizer, name)
+
+    def __call__(self, text, **kwargs):
+        if any("BOOM" in t for t in ([text] if isinstance(text, str) else text)):
+            raise ValueError("cannot tokenize BOOM")
+        return self._tokenizer(text, **kwargs)
+
+
+class EncodeBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from transformers import AutoTokenizer
+        cls.tokenizer = AutoTokenizer.from_pretrained(support.weights())
+
+    def render(self, content):
+        return self.tokenizer.apply_chat_template([{"role": "user", "content": content}], tokenize=False,
+                                                  add_generation_prompt=True)
+
+    def test_failing_segment_fails_only_its_prompt(self):
+        cache = prompt_cache.PromptCache(FailingTokenizer(self.tokenizer))
+        good, bad, other = self.render("Hello there"), self.render("BOOM"), self.render("Summarize this")
+        results = cache.encode_batch([good, bad, other])
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[0], self.tokenizer(good, add_special_tokens=True)["input_ids"])
+        self.assertEqual(results[2], self.tokenizer(other, add_special_tokens=True)["input_ids"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""Seeded sampling of ``mistral-cpu`` without touching the process-wide RNG."""
+import unittest
+
+import numpy as np
+import torch
+
+from support import Call, load_model
+from synaplan_triton import batcher
+
+HELLO = [{"role": "user", "content": "Please summarize the document."}]
+
+
+class SampleRows(unittest.TestCase):
+
+    def test_seeded_rows_leave_the_global_rng_alone(self):
+        logits = torch.randn(2, 32)
+        temperature, top_p, top_k = torch.ones(2), torch.ones(2), torch.zeros(2, dtype=torch.long)
+        torch.manual_seed(1234)
+        expected = torch.rand(4)
+        torch.manual_seed(1234)
+        batcher.sample(logits, temperature, top_p, top_k, [torch.Generator().manual_seed(s) for s in (5, 6)])
+        self.assertTrue(torch.equal(torch.rand(4), expected))
+
+
+class SeededSerialSampling(unittest.TestCase):
+
+    parameters = {"batching_mode": "serial"}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.instance = load_model("mistral-cpu", **cls.parameters)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.instance.finalize()
+
+    def generate(self, seed):
+        call = Call(HELLO, max_tokens=16, temperature=np.float32(1.5), top_k=np.int32(0), seed=np.uint64(seed))
+        self.instance.execute([call.request])
+        self.assertIsNone(call.wait().error)
+        return call.text
+
+    def test_seed_reproduces_and_leaves_global_rng_alone(self):
+        torch.manual_seed(1234)
+        expected = torch.rand(4)
+        torch.manual_seed(1234)
+        first = self.generate(7)
+        self.assertTrue(torch.equal(torch.rand(4), expected))
+        self.assertEqual(self.generate(7), first)
+
+
+class SeededSpeculativeSampling(SeededSerialSampling):
+
+    parameters = {"batching_mode": "serial", "speculative_mode": "prompt_lookup"}
+
+
+if __name__ == "__main__":
+    unittest.main()
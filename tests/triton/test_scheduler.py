@@ -0,0 +1,53 @@
+"""``FairScheduler`` with the token budget as the limit."""
+import threading
+import unittest
+
+import support  # noqa: F401 - sets up the import paths
+from synaplan_triton.scheduler import FairScheduler, parse_classes
+
+
+class TokenBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = []
+        self.scheduler = FairScheduler(parse_classes("interactive:1,batch:1"), max_in_flight=4,
+                                       max_inflight_tokens=100, max_bypass=2)
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.shutdown()
+
+    def submit(self, name, priority, tokens):
+        def run():
+            self.started.append(name)
+            self.release.wait(10)
+        return self.scheduler.submit(run, priority=priority, tokens=tokens)
+
+    def wait_started(self, count):
+        for _ in range(1000):
+            if len(self.started) >= count:
+                return
+            threading.Event().wait(0.01)
+        self.fail(f"only {self.started} started")
+
+    def test_blocked_class_does_not_hold_back_others(self):
+        self.submit("interactive-1", "interactive", 60)
+        self.submit("batch-big", "batch", 60)  # next in line (lowest virtual time), does not fit
+        self.submit("interactive-2", "interactive", 30)  # fits next to interactive-1
+        self.wait_started(2)
+        self.assertEqual(self.started, ["interactive-1", "interactive-2"])
+        self.assertEqual(self.scheduler.tokens_in_flight, 90)
+
+    def test_blocked_request_is_passed_over_a_bounded_number_of_times(self):
+        self.submit("interactive-1", "interactive", 40)
+        self.submit("batch-big", "batch", 70)
+        for i in range(4):
+            self.submit(f"small-{i}", "interactive", 10)
+        self.wait_started(3)
+        threading.Event().wait(0.05)
+        self.assertEqual(self.started, ["interactive-1", "small-0", "small-1"])  # then batch-big holds the line
+
+
+if __name__ == "__main__":
+    unittest.main()